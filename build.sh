@@ -13,6 +13,9 @@ python manage.py collectstatic --noinput
 python manage.py makemigrations --noinput
 python manage.py migrate --noinput
 
+# Build running totals for users that predate the UserStats table
+python manage.py rebuild_user_stats --missing
+
 # Create superuser if environment variables are set (idempotent if already exists)
 if [ -n "$DJANGO_SUPERUSER_USERNAME" ] && [ -n "$DJANGO_SUPERUSER_PASSWORD" ]; then
     python manage.py createsuperuser --noinput || true
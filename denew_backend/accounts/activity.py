@@ -0,0 +1,86 @@
+"""
+The merged transaction stream (api/transactions/stream/).
+
+Deposits, withdrawals and, on request, completed task earnings are read as one
+UNION ALL, newest first, keyset paginated on (created_at, kind, id): ids repeat
+across tables, so the kind breaks ties between rows of the same instant. Each
+branch applies the cursor and LIMIT itself and walks its own (user, time) index
+(deposit_user_page_idx, withdrawal_user_page_idx, task_user_status_done_idx),
+so a page costs one query however far back the client has paged.
+
+Totals come from the user's UserStats row and are only sent with the first page.
+"""
+from django.db import connection
+from django.db.models import CharField, F, Q, Value
+from rest_framework.exceptions import ValidationError
+
+from .models import Deposit, Task, Withdrawal
+from .pagination import decode_cursor, encode_cursor, get_page_size
+from .stats import get_stats
+
+# kind -> (queryset of the user's rows, amount column, time column)
+SOURCES = {
+    'deposit': (lambda user_id: Deposit.objects.filter(user_id=user_id), 'amount', 'created_at'),
+    'withdrawal': (lambda user_id: Withdrawal.objects.filter(user_id=user_id), 'amount', 'created_at'),
+    'task_earning': (lambda user_id: Task.objects.filter(user_id=user_id, status='completed', completed_at__isnull=False), 'earnings', 'completed_at'),
+}
+
+COLUMNS = ('kind', 'item_id', 'amount_value', 'item_status', 'occurred_at')
+
+
+def _branch(kind, user_id, limit, cursor):
+    rows, amount, occurred = SOURCES[kind]
+    queryset = rows(user_id)
+    if cursor:
+        created_at, pk, cursor_kind = cursor
+        # Rows of this kind at the cursor instant come after it only if they sort
+        # below it: kinds are ordered descending, then ids descending
+        if kind < cursor_kind:
+            same_instant = Q(**{occurred: created_at})
+        elif kind == cursor_kind:
+            same_instant = Q(**{occurred: created_at, 'id__lt': pk})
+        else:
+            same_instant = Q(pk__in=[])
+        queryset = queryset.filter(Q(**{f'{occurred}__lt': created_at}) | same_instant)
+    queryset = queryset.annotate(
+        kind=Value(kind, output_field=CharField()),
+        item_id=F('id'),
+        amount_value=F(amount),
+        item_status=F('status'),
+        occurred_at=F(occurred),
+    ).values_list(*COLUMNS)
+    if not connection.features.supports_slicing_ordering_in_compound:
+        return queryset  # SQLite: the outer ORDER BY/LIMIT alone, still correct
+    return queryset.order_by(f'-{occurred}', '-id')[:limit]
+
+
+def transaction_page(user_id, request, include_tasks=False):
+    """Returns (transactions, next_cursor, totals or None)."""
+    page_size = get_page_size(request)
+    cursor = request.query_params.get('cursor')
+    cursor = decode_cursor(cursor, extra=1) if cursor else None
+    if cursor and cursor[2] not in SOURCES:
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    kinds = ['deposit', 'withdrawal'] + (['task_earning'] if include_tasks else [])
+    branches = [_branch(kind, user_id, page_size + 1, cursor) for kind in kinds]
+    stream = branches[0].union(*branches[1:], all=True).order_by('-occurred_at', '-kind', '-item_id')
+    rows = list(stream[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        kind, item_id, _, _, occurred_at = rows[-1]
+        next_cursor = encode_cursor(occurred_at, item_id, kind)
+    transactions = [
+        {'type': kind, 'id': item_id, 'amount': str(amount), 'status': item_status, 'created_at': occurred_at}
+        for kind, item_id, amount, item_status, occurred_at in rows
+    ]
+    totals = None
+    if cursor is None:
+        stats = get_stats(user_id)
+        totals = {
+            'total_deposits': str(stats.deposits_confirmed),
+            'total_withdrawals': str(stats.withdrawals_completed),
+            'pending_withdrawals': str(stats.withdrawals_pending),
+            'total_task_earnings': str(stats.task_earnings),
+        }
+    return transactions, next_cursor, totals
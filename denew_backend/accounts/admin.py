@@ -1,39 +1,66 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.html import format_html
 from django.utils import timezone
 from django.urls import reverse
 from django.utils.safestring import mark_safe  # For safe HTML
-from .models import User, UserProfile, Task, Deposit, Withdrawal, Invitation, TermsAndConditions, Portfolio, SupportTicket, Product
+from .caching import invalidate_dashboard, invalidate_user
+from .ledger import set_balance
+from .search import search_payments, search_users
+from .settlement import settle_withdrawals
+from .models import User, UserProfile, Task, Deposit, Withdrawal, Invitation, TermsAndConditions, Portfolio, SupportTicket, Product, LedgerEntry, EmailOutbox
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for the big changelists. An unfiltered list on PostgreSQL takes
+    the planner's row estimate from pg_class instead of a COUNT(*) over the
+    whole table once that estimate passes ADMIN_ESTIMATED_COUNT_THRESHOLD;
+    filtered lists and smaller tables are still counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000):
+                return row[0]
+        return super().count
+
 
 # Admin Actions (existing ones unchanged)
 @admin.action(description='Mark selected users as verified')
 def make_verified(modeladmin, request, queryset):
+    ids = list(queryset.values_list('id', flat=True))
     queryset.update(is_verified=True)
+    # update() sends no signals. Invalidate after the write: in autocommit the
+    # bump runs at once, and an earlier one could re-cache the old row under it
+    invalidate_user(*ids)
+    invalidate_dashboard(*ids)
 
 @admin.action(description='Mark selected users as unverified')
 def make_unverified(modeladmin, request, queryset):
+    ids = list(queryset.values_list('id', flat=True))
     queryset.update(is_verified=False)
+    invalidate_user(*ids)
+    invalidate_dashboard(*ids)
 
 @admin.action(description='Approve selected withdrawals')
 def approve_withdrawals(modeladmin, request, queryset):
-    for withdrawal in queryset:
-        if withdrawal.status == 'pending':
-            withdrawal.status = 'completed'
-            withdrawal.processed_at = timezone.now()
-            withdrawal.save()
-            withdrawal.user.balance -= withdrawal.amount
-            withdrawal.user.save()
+    settled = settle_withdrawals(queryset.values_list('id', flat=True), 'approve')
+    modeladmin.message_user(request, f'Approved {settled} pending withdrawals.', level='success')
 
 @admin.action(description='Reject selected withdrawals')
 def reject_withdrawals(modeladmin, request, queryset):
-    for withdrawal in queryset:
-        if withdrawal.status == 'pending':
-            withdrawal.status = 'rejected'
-            withdrawal.processed_at = timezone.now()
-            withdrawal.user.balance += withdrawal.amount  # Refund
-            withdrawal.user.save()
-            withdrawal.save()
+    settled = settle_withdrawals(queryset.values_list('id', flat=True), 'reject')  # Refunds balances
+    modeladmin.message_user(request, f'Rejected and refunded {settled} pending withdrawals.', level='success')
 
 # NEW: Bulk action for confirming deposits (triggers signal for balance update)
 @admin.action(description='Confirm selected deposits (updates user balances)')
@@ -72,6 +99,10 @@ class UserAdmin(BaseUserAdmin):
     ordering = ('-date_joined',)
     list_per_page = 25
 
+    # search_fields only label the search box; matching runs on the indexed search columns
+    def get_search_results(self, request, queryset, search_term):
+        return search_users(queryset, search_term), False
+
     def verification_badge(self, obj):
         return format_html('<span style="color: green;">✓ Verified</span>' if obj.is_verified else '<span style="color: red;">✗ Unverified</span>')
     verification_badge.short_description = 'Verification Status'
@@ -98,7 +129,7 @@ class UserAdmin(BaseUserAdmin):
             'classes': ('wide',)
         }),
         ('Platform Settings', {
-            'fields': ('referral_code', 'is_verified', 'vip_level', 'balance',
+            'fields': ('referral_code', 'referred_by', 'is_verified', 'vip_level', 'balance',
                       'email_notifications', 'sms_notifications', 'twofa_enabled',
                       'profile_picture', 'withdrawal_password'),
             'classes': ('wide',)
@@ -121,7 +152,16 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
-    readonly_fields = ('last_login', 'date_joined')
+    readonly_fields = ('last_login', 'date_joined', 'profile_picture')  # written by the picture workers
+    raw_id_fields = ('referred_by',)
+
+    # Balance edits are posted to the ledger as adjustments instead of being saved directly
+    def save_model(self, request, obj, form, change):
+        balance = obj.balance
+        obj.balance = form.initial['balance'] if change else 0
+        super().save_model(request, obj, form, change)
+        if 'balance' in form.changed_data:
+            obj.balance = set_balance(obj.pk, balance, reference=f'admin:{request.user.username}').balance_after
 
 # UserProfile Admin (unchanged)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -129,6 +169,7 @@ class UserProfileAdmin(admin.ModelAdmin):
     list_filter = ('created_at', 'updated_at')
     search_fields = ('user__username', 'user__email', 'user__full_name', 'location')
     readonly_fields = ('created_at', 'updated_at')
+    list_select_related = ('user',)
 
     def get_username(self, obj):
         return obj.user.username
@@ -149,6 +190,12 @@ class WithdrawalAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'user__email', 'wallet_address')
     actions = [approve_withdrawals, reject_withdrawals]
     list_per_page = 25
+    list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # skips a second COUNT(*) of the whole table when filtering
+
+    def get_search_results(self, request, queryset, search_term):
+        return search_payments(queryset, search_term), False
 
     def save_model(self, request, obj, form, change):
         if obj.status in ['completed', 'rejected'] and not obj.processed_at:
@@ -161,6 +208,9 @@ class InvitationAdmin(admin.ModelAdmin):
     list_filter = ('status', 'created_at')
     search_fields = ('referrer__username', 'referrer__email', 'referee_email', 'referee_name')
     list_per_page = 25
+    list_select_related = ('referrer',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 # Task Admin (unchanged)
 class TaskAdmin(admin.ModelAdmin):
@@ -168,6 +218,9 @@ class TaskAdmin(admin.ModelAdmin):
     list_filter = ('status', 'task_type', 'created_at')
     search_fields = ('user__username', 'user__email')
     list_per_page = 25
+    list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 # UPDATED: Deposit Admin (enhanced for auto-balance and bulk confirm)
 class DepositAdmin(admin.ModelAdmin):
@@ -176,10 +229,16 @@ class DepositAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'user__email', 'wallet_address')
     actions = [confirm_deposits]  # Add the new bulk confirm action
     list_per_page = 25
+    list_select_related = ('user',)  # user_link and user_balance_after read the user
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        return search_payments(queryset, search_term), False
 
     # NEW: Clickable user link
     def user_link(self, obj):
-        url = reverse('admin:accounts_user_change', args=[obj.user.id])
+        url = reverse('admin:accounts_user_change', args=[obj.user_id])
         return format_html('<a href="{}">{}</a>', url, obj.user.username)
     user_link.short_description = 'User'
 
@@ -218,6 +277,7 @@ class PortfolioAdmin(admin.ModelAdmin):
     list_filter = ('updated_at',)
     search_fields = ('user__username', 'user__email')
     list_per_page = 25
+    list_select_related = ('user',)
 
 # SupportTicket Admin (unchanged)
 class SupportTicketAdmin(admin.ModelAdmin):
@@ -225,6 +285,7 @@ class SupportTicketAdmin(admin.ModelAdmin):
     list_filter = ('priority', 'status', 'created_at')
     search_fields = ('user__username', 'user__email', 'subject', 'message')
     list_per_page = 25
+    list_select_related = ('user',)
 
 # Product Admin (unchanged from your version)
 class ProductAdmin(admin.ModelAdmin):
@@ -239,6 +300,39 @@ class ProductAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         return True
 
+# Ledger Admin (read-only: entries are only written through ledger.py)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'entry_type', 'amount', 'balance_after', 'reference', 'created_at')
+    list_filter = ('entry_type', 'created_at')
+    search_fields = ('user__username', 'user__email', 'reference')
+    list_select_related = ('user',)
+    list_per_page = 25
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+# Email outbox (delivery state is managed by outbox.py)
+@admin.action(description='Retry selected emails now')
+def retry_emails(modeladmin, request, queryset):
+    retried = queryset.exclude(status='sent').update(status='pending', next_attempt_at=timezone.now())
+    modeladmin.message_user(request, f'Queued {retried} emails for another attempt.', level='success')
+
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('subject', 'last_error')
+    readonly_fields = ('attempts', 'last_error', 'created_at', 'sent_at')
+    actions = [retry_emails]
+    list_per_page = 25
+
 # Register models (unchanged)
 admin.site.register(User, UserAdmin)
 admin.site.register(UserProfile, UserProfileAdmin)
@@ -249,4 +343,6 @@ admin.site.register(Invitation, InvitationAdmin)
 admin.site.register(TermsAndConditions, TermsAndConditionsAdmin)
 admin.site.register(Portfolio, PortfolioAdmin)
 admin.site.register(SupportTicket, SupportTicketAdmin)
-admin.site.register(Product, ProductAdmin)
\ No newline at end of file
+admin.site.register(Product, ProductAdmin)
+admin.site.register(LedgerEntry, LedgerEntryAdmin)
+admin.site.register(EmailOutbox, EmailOutboxAdmin)
\ No newline at end of file
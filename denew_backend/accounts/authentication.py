@@ -0,0 +1,116 @@
+"""
+JWT authentication with a short-lived, per-process cache of user rows.
+
+Polled read endpoints (balance, VIP level, current task) otherwise cost one
+SELECT on accounts_user per request just to authenticate. For GET/HEAD/OPTIONS
+requests CachedJWTAuthentication serves the row from an in-process LRU; each
+entry expires after AUTH_USER_CACHE_TTL seconds and is also refused as soon as
+the row's version stamp (caching.user_version) moves on, which User saves,
+ledger postings and admin bulk updates bump after commit. Every request gets
+its own User instance, so views may still modify request.user. The volatile
+columns those endpoints answer with are still read fresh, by
+conditional.user_columns(), so a stale entry never produces a stale 304.
+
+With the default per-process LocMemCache the version stamp only covers writes
+made by the same worker; other workers see them within the TTL. Point the
+default cache at a shared backend to make invalidation immediate everywhere.
+
+Unsafe methods always load the row fresh. Views that read-modify-write the
+user call lock_user() inside transaction.atomic() to re-read it FOR UPDATE.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .caching import user_version
+from .models import User
+
+
+class UserRowCache:
+    """Thread-safe LRU of {user id: (version, expires, field values)}."""
+
+    def __init__(self):
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        self._fields = [field.attname for field in User._meta.concrete_fields]
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AUTH_USER_CACHE_TTL', 5)
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'AUTH_USER_CACHE_SIZE', 2048)
+
+    def get(self, user_id, version):
+        """A new User instance built from the cached row, or None on a miss or stale entry."""
+        with self._lock:
+            entry = self._rows.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] != version or entry[1] < time.monotonic():
+                del self._rows[user_id]
+                return None
+            self._rows.move_to_end(user_id)
+        return User.from_db(DEFAULT_DB_ALIAS, self._fields, entry[2])
+
+    def put(self, user_id, user, version):
+        if self.ttl <= 0:
+            return
+        values = tuple(getattr(user, name) for name in self._fields)
+        with self._lock:
+            self._rows[user_id] = (version, time.monotonic() + self.ttl, values)
+            self._rows.move_to_end(user_id)
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+
+user_rows = UserRowCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        if request.method not in SAFE_METHODS:
+            return super().authenticate(request)
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_cached_user(validated_token), validated_token
+
+    def get_cached_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return self.get_user(validated_token)
+        # Read the stamp before the row, so a save committed in between leaves
+        # the new entry already stale instead of caching the old row as current
+        version = user_version(user_id)
+        user = user_rows.get(user_id, version)
+        if user is None:
+            user = self.get_user(validated_token)
+            user_rows.put(user_id, user, version)
+        elif api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
+
+
+def lock_user(request):
+    """Re-read request.user with SELECT ... FOR UPDATE. Call inside transaction.atomic()."""
+    request.user = User.objects.select_for_update().get(pk=request.user.pk)
+    return request.user
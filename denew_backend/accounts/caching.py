@@ -0,0 +1,121 @@
+"""
+Cache helpers for read endpoints.
+
+The dashboard payload is cached per user and dropped whenever one of its inputs
+changes: the model save paths are covered by receivers in signals.py, and code
+that writes with queryset.update()/F() (which sends no signals) calls
+invalidate_dashboard() itself. Deletion is deferred to transaction commit so a
+concurrent reader cannot re-cache the pre-commit state.
+
+User rows cached by the authentication class carry a version stamp kept in the
+same cache; invalidate_user() bumps it after commit so every cached copy of
+that row is refused on its next use.
+
+Shared content (terms, campaigns) is cached as pre-rendered JSON bytes under
+versioned keys. Receivers in signals.py bump the version after a commit, so
+with a shared cache every worker moves to a new key at once and old entries
+simply expire. With the per-worker LocMemCache only the saving worker sees the
+bump; the others pick the edit up when their entry expires, which is why
+CONTENT_CACHE_TIMEOUT defaults to a minute there.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+
+def dashboard_cache_key(user_id):
+    return f'accounts:dashboard:{user_id}'
+
+
+def get_dashboard(user_id):
+    return cache.get(dashboard_cache_key(user_id))
+
+
+def set_dashboard(user_id, payload):
+    cache.set(dashboard_cache_key(user_id), payload, getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300))
+
+
+def invalidate_dashboard(*user_ids):
+    keys = [dashboard_cache_key(user_id) for user_id in user_ids if user_id]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def user_version_key(user_id):
+    return f'accounts:user:{user_id}:version'
+
+
+def user_version(user_id):
+    """Version stamp of a user row, read by the authentication cache before it loads the row."""
+    return cache.get_or_set(user_version_key(user_id), new_version, None)
+
+
+def invalidate_user(*user_ids):
+    """Bump the version stamp of user rows once the transaction that changed them commits."""
+    keys = [user_version_key(user_id) for user_id in user_ids if user_id]
+
+    def bump():
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, new_version(), None)
+    if keys:
+        transaction.on_commit(bump)
+
+
+def content_version_key(name):
+    return f'accounts:content:{name}:version'
+
+
+def new_version():
+    """Starting value for a version counter; time based so a counter that was evicted never restarts at an old value."""
+    return time.time_ns() // 1000
+
+
+def content_version(name):
+    return cache.get_or_set(content_version_key(name), new_version, None)
+
+
+def bump_content_version(name):
+    def bump():
+        try:
+            cache.incr(content_version_key(name))
+        except ValueError:
+            cache.set(content_version_key(name), new_version(), None)
+    transaction.on_commit(bump)
+
+
+def content_key(name):
+    return f'accounts:content:{name}:v{content_version(name)}'
+
+
+def cached_json(name, build):
+    """
+    Return the rendered JSON bytes for a piece of shared content, calling
+    build() on a miss. build() returns (payload, timeout), where timeout may
+    shorten CONTENT_CACHE_TIMEOUT (None keeps it), or None if there is nothing
+    to serve (not cached).
+    """
+    key = content_key(name)
+    entry = cache.get(key)
+    if entry is None:
+        built = build()
+        if built is None:
+            return None
+        payload, timeout = built
+        body = JSONRenderer().render(payload)
+        entry = (hashlib.md5(body).hexdigest(), body)
+        default_timeout = getattr(settings, 'CONTENT_CACHE_TIMEOUT', 86400)
+        cache.set(key, entry, min(timeout, default_timeout) if timeout else default_timeout)
+    return entry[1]
+
+
+def cached_json_etag(name):
+    """ETag of the currently cached body, or None if it is not cached yet."""
+    entry = cache.get(content_key(name))
+    return f'{name}-{entry[0]}' if entry else None
@@ -0,0 +1,149 @@
+"""
+In-process product catalog snapshot.
+
+Task generation samples products on every set start and task submit. Rather than
+loading every Product row for each request, each worker keeps one compact
+snapshot of the catalog (parallel tuples of ids and serialized payloads) and
+samples positions from it, so the hot path never touches the database.
+
+The snapshot is rebuilt lazily when:
+- a Product is saved or deleted in this process (see signals.py),
+- the shared catalog version in the cache changes, or
+- it is older than PRODUCT_CATALOG_TTL seconds (covers changes made by other
+  processes, e.g. the create_products management commands).
+
+Serialized payloads are also kept in the shared cache under the catalog
+version, so after a change only the first worker reads the Product table.
+Each payload is kept pre-rendered as JSON too, so get_products just joins
+four of them.
+"""
+import random
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from .caching import new_version
+from .models import Product, Task
+
+CATALOG_VERSION_KEY = 'accounts:product_catalog:version'
+
+CatalogSnapshot = namedtuple('CatalogSnapshot', ['ids', 'payloads', 'rendered', 'positions', 'version', 'loaded_at'])
+
+
+class ProductCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'PRODUCT_CATALOG_TTL', 300)
+
+    def invalidate(self):
+        """
+        Drop the local snapshot and, once the change commits, bump the shared
+        version for other workers (bumping earlier could let a reader cache the
+        pre-commit catalog under the new version).
+        """
+        self._snapshot = None
+        transaction.on_commit(self._bump_version)
+
+    def _bump_version(self):
+        self._snapshot = None
+        try:
+            cache.incr(CATALOG_VERSION_KEY)
+        except ValueError:
+            cache.set(CATALOG_VERSION_KEY, new_version(), None)
+
+    def _is_fresh(self, snapshot):
+        if snapshot is None:
+            return False
+        if time.monotonic() - snapshot.loaded_at > self.ttl:
+            return False
+        return cache.get(CATALOG_VERSION_KEY) == snapshot.version
+
+    def _load(self, fresh=False):
+        # Imported here to avoid a circular import (serializers -> models)
+        from .serializers import ProductSerializer
+
+        version = cache.get_or_set(CATALOG_VERSION_KEY, new_version, None)
+        payloads_key = f'accounts:product_catalog:v{version}:payloads'
+        payloads = None if fresh else cache.get(payloads_key)
+        if payloads is None:
+            products = Product.objects.order_by('id')
+            payloads = [dict(payload) for payload in ProductSerializer(products, many=True).data]
+            cache.set(payloads_key, payloads, getattr(settings, 'CONTENT_CACHE_TIMEOUT', 86400))
+        ids = tuple(payload['id'] for payload in payloads)
+        return CatalogSnapshot(
+            ids=ids,
+            payloads=tuple(payloads),
+            rendered=tuple(JSONRenderer().render(payload) for payload in payloads),
+            positions={product_id: i for i, product_id in enumerate(ids)},
+            version=version,
+            loaded_at=time.monotonic(),
+        )
+
+    def snapshot(self):
+        """Return the current snapshot, reloading it first if it is stale."""
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if not self._is_fresh(snapshot):
+                snapshot = self._snapshot = self._load()
+        return snapshot
+
+    def __len__(self):
+        return len(self.snapshot().ids)
+
+    def sample_ids(self, k):
+        """Return up to k distinct random product ids."""
+        ids = self.snapshot().ids
+        return [ids[i] for i in random.sample(range(len(ids)), min(k, len(ids)))]
+
+    def sample_payloads(self, k):
+        """Return up to k distinct random serialized products."""
+        payloads = self.snapshot().payloads
+        return [payloads[i] for i in random.sample(range(len(payloads)), min(k, len(payloads)))]
+
+    def sample_json(self, k):
+        """Return the body of get_products, {"products": [...]} with up to k random products, as bytes."""
+        rendered = self.snapshot().rendered
+        sample = random.sample(range(len(rendered)), min(k, len(rendered)))
+        return b'{"products":[' + b','.join(rendered[i] for i in sample) + b']}'
+
+    def get_payloads(self, product_ids):
+        """Return serialized products for the given ids, skipping unknown ids."""
+        snapshot = self.snapshot()
+        if any(pid not in snapshot.positions for pid in product_ids):
+            # A product newer than this worker's snapshot: reload once from the database
+            with self._lock:
+                snapshot = self._snapshot = self._load(fresh=True)
+        return [snapshot.payloads[snapshot.positions[pid]] for pid in product_ids if pid in snapshot.positions]
+
+    def attach_to_tasks(self, tasks):
+        """
+        Resolve the products of a page of tasks with one through-table query and
+        the in-memory payloads, instead of one products query per task. The
+        payloads are read by TaskSerializer/CurrentTaskSerializer.
+        """
+        tasks = [task for task in tasks if task is not None]
+        product_ids = {task.id: [] for task in tasks}
+        rows = Task.products.through.objects.filter(task_id__in=product_ids).order_by('id').values_list('task_id', 'product_id')
+        for task_id, product_id in rows:
+            product_ids[task_id].append(product_id)
+        all_ids = [pid for ids in product_ids.values() for pid in ids]
+        if all_ids:
+            self.get_payloads(all_ids)
+        for task in tasks:
+            task._product_payloads = self.get_payloads(product_ids[task.id])
+        return tasks
+
+
+product_catalog = ProductCatalog()
@@ -0,0 +1,84 @@
+"""
+Conditional GET for polled read endpoints.
+
+Each validator below is computed from a cache entry or from a single indexed
+query, so a client revalidating with If-None-Match gets a 304 without the view
+building, serializing or sending the body.
+
+request.user may come from the per-worker authentication cache and lag behind
+the database by up to AUTH_USER_CACHE_TTL, so the user validators (and the
+views they guard) read balance, vip_level and current_set with user_columns().
+"""
+from functools import wraps
+
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .caching import cached_json_etag
+from .models import Task, User
+
+
+def conditional_get(etag_func):
+    """
+    django.views.decorators.http.condition() for @api_view functions. Put it
+    below @api_view/@permission_classes so authentication and permission
+    checks run before the validator. Responses are marked private/no-cache so
+    clients always revalidate instead of reusing them blindly.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func)(view)
+
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                patch_cache_control(response, private=True, no_cache=True)
+                patch_vary_headers(response, ['Authorization'])
+            return response
+        return inner
+    return decorator
+
+
+def user_columns(request):
+    """
+    The user's balance, vip_level and current_set read from the database with
+    one primary key lookup, shared by the validator and the view of a request.
+    """
+    columns = getattr(request, '_user_columns', None)
+    if columns is None:
+        columns = request._user_columns = (
+            User.objects.filter(pk=request.user.pk).values('balance', 'vip_level', 'current_set').get()
+        )
+    return columns
+
+
+def balance_etag(request):
+    return f'"balance-{request.user.pk}-{user_columns(request)["balance"]}"'
+
+
+def vip_level_etag(request):
+    return f'"vip-{request.user.pk}-{user_columns(request)["vip_level"].replace(" ", "_")}"'
+
+
+def current_task_etag(request):
+    user = request.user
+    current_set = user_columns(request)['current_set']
+    if not current_set:
+        return f'"task-{user.pk}-none"'
+    # Task type, earnings and products are fixed when the task is created;
+    # created_at is reset when a queued task is released
+    task = (
+        Task.objects.filter(user=user, set_number=current_set, status__in=['pending', 'in-progress'])
+        .order_by('task_number').values_list('id', 'status', 'created_at').first()
+    )
+    if not task:
+        return f'"task-{user.pk}-{current_set}-none"'
+    task_id, task_status, created_at = task
+    return f'"task-{user.pk}-{task_id}-{task_status}-{created_at.timestamp()}"'
+
+
+def content_etag(name):
+    def etag(request):
+        value = cached_json_etag(name)
+        return f'"{value}"' if value else None
+    return etag
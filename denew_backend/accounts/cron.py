@@ -1,17 +1,64 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
 from django_cron import CronJobBase, Schedule
-from django.db.models import Sum
-from .models import Invitation, Task, User
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from .ledger import post_entries
+from .models import JobWatermark, Task
 
 class CalculateCommissions(CronJobBase):
+    """
+    Credit referrers 20% of what their referees earned from tasks since the last run.
+
+    Work is driven by a persisted watermark on Task.completed_at: each window
+    (watermark, watermark + WINDOW] is aggregated per referrer in one joined
+    query, credited with one batched ledger posting, and the watermark is
+    advanced in the same transaction. A crashed or repeated run therefore never
+    credits the same task twice, and locks are held for one window at a time.
+    """
     RUN_EVERY_MINS = 1440  # Run daily
     schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
     code = 'accounts.calculate_commissions'
 
+    COMMISSION_RATE = Decimal('0.20')
+    WINDOW = timedelta(hours=1)
+    # Tasks completed in still-open transactions may commit with an older completed_at
+    SETTLE_LAG = timedelta(minutes=5)
+
+    def referrer_totals(self, start, end):
+        """(referrer_id, earnings, task_count) for referee tasks completed in (start, end]."""
+        return (
+            Task.objects.filter(status='completed', completed_at__gt=start, completed_at__lte=end, user__referred_by__isnull=False)
+            .values('user__referred_by')
+            .annotate(earnings=Sum('earnings'), tasks=Count('id'))
+            .values_list('user__referred_by', 'earnings', 'tasks')
+        )
+
     def do(self):
-        for invitation in Invitation.objects.all():
-            referee = User.objects.filter(email=invitation.referee_email).first()
-            if referee:
-                earnings = Task.objects.filter(user=referee, status='completed').aggregate(total=Sum('earnings'))['total'] or 0
-                commission = earnings * 0.2
-                invitation.referrer.balance += commission
-                invitation.referrer.save()
\ No newline at end of file
+        started = time.perf_counter()
+        end = timezone.now() - self.SETTLE_LAG
+        watermark, _ = JobWatermark.objects.get_or_create(
+            code=self.code, defaults={'value': end - timedelta(minutes=self.RUN_EVERY_MINS)}
+        )
+        window_start = watermark.value
+        tasks_processed = referrers_credited = 0
+        while window_start < end:
+            window_end = min(window_start + self.WINDOW, end)
+            with transaction.atomic():
+                # Re-read under lock: a concurrent run that already moved the watermark wins
+                if JobWatermark.objects.select_for_update().get(code=self.code).value != window_start:
+                    break
+                credits = []
+                for referrer_id, earnings, tasks in self.referrer_totals(window_start, window_end):
+                    credits.append((referrer_id, earnings * self.COMMISSION_RATE, f'commission:{window_end.isoformat()}'))
+                    tasks_processed += tasks
+                credited = post_entries('commission', credits)
+                JobWatermark.objects.filter(code=self.code).update(value=window_end, updated_at=timezone.now())
+            referrers_credited += len(credited)
+            window_start = window_end
+        return (
+            f'Processed {tasks_processed} tasks, made {referrers_credited} referrer credits '
+            f'up to {window_start.isoformat()} in {time.perf_counter() - started:.2f}s'
+        )
\ No newline at end of file
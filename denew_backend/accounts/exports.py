@@ -0,0 +1,121 @@
+"""
+Streaming exports of deposits, withdrawals and tasks for operations staff
+(api/ops/exports/<kind>/ and `manage.py export_data`).
+
+Rows are read with a values_list projection through .iterator(chunk_size=...),
+which uses a server-side cursor on PostgreSQL, and rendered chunk by chunk as
+CSV or NDJSON, so neither the queryset cache nor the response body ever holds
+more than one chunk whatever the size of the export.
+"""
+import csv
+import datetime
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Deposit, Task, Withdrawal
+
+# kind -> (model, exported columns, column the date range applies to)
+EXPORTS = {
+    'deposits': (
+        Deposit,
+        ('id', 'user_id', 'user__username', 'amount', 'payment_method', 'wallet_address', 'status', 'created_at'),
+        'created_at',
+    ),
+    'withdrawals': (
+        Withdrawal,
+        ('id', 'user_id', 'user__username', 'amount', 'payment_method', 'wallet_address', 'status', 'created_at', 'processed_at'),
+        'created_at',
+    ),
+    'tasks': (
+        Task,
+        ('id', 'user_id', 'user__username', 'set_number', 'task_number', 'task_type', 'status', 'earnings', 'created_at', 'completed_at'),
+        'created_at',
+    ),
+}
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _parse_bound(value, name, end=False):
+    """A datetime, or a date meaning the start (end=False) or the end of that day."""
+    if not value:
+        return None
+    try:
+        # Dates first: parse_datetime also accepts a bare date (as midnight) on Python 3.11+
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:  # well formed but out of range, e.g. 2026-02-30
+        day = moment = None
+    if day:
+        moment = datetime.datetime.combine(day + datetime.timedelta(days=1) if end else day, datetime.time.min)
+    elif moment is None:
+        raise ExportError(f'{name}: expected YYYY-MM-DD or an ISO datetime')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_rows(kind, since=None, until=None, statuses=None):
+    """
+    Returns (columns, row iterator) for one export. since/until are ISO dates
+    or datetimes (a date for until includes that whole day), statuses a list of
+    status values. Raises ExportError on bad arguments.
+    """
+    if kind not in EXPORTS:
+        raise ExportError(f'Unknown export {kind!r}; choose from {", ".join(EXPORTS)}')
+    model, columns, date_field = EXPORTS[kind]
+    queryset = model.objects.all()
+    since, until = _parse_bound(since, 'since'), _parse_bound(until, 'until', end=True)
+    if since:
+        queryset = queryset.filter(**{f'{date_field}__gte': since})
+    if until:
+        queryset = queryset.filter(**{f'{date_field}__lt': until})
+    if statuses:
+        allowed = {value for value, _ in model._meta.get_field('status').choices}
+        unknown = set(statuses) - allowed
+        if unknown:
+            raise ExportError(f'Unknown status {", ".join(sorted(unknown))}; choose from {", ".join(sorted(allowed))}')
+        queryset = queryset.filter(status__in=statuses)
+    rows = queryset.order_by('id').values_list(*columns).iterator(chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', 2000))
+    return columns, rows
+
+
+class _Echo:
+    """File-like object handing csv.writer's output straight back."""
+
+    def write(self, value):
+        return value
+
+
+def render(columns, rows, output='csv', lines_per_chunk=500):
+    """Returns an iterator of str chunks of up to lines_per_chunk rows. Raises ExportError for an unknown format."""
+    if output == 'csv':
+        writer = csv.writer(_Echo())
+        encode = writer.writerow
+        header = [encode(columns)]
+    elif output == 'ndjson':
+        encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+        def encode(row):
+            return encoder.encode(dict(zip(columns, row))) + '\n'
+        header = []
+    else:
+        raise ExportError(f'Unknown format {output!r}; choose from {", ".join(FORMATS)}')
+
+    def chunks():
+        chunk = header
+        for row in rows:
+            chunk.append(encode(row))
+            if len(chunk) >= lines_per_chunk:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+    return chunks()
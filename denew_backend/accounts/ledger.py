@@ -0,0 +1,125 @@
+"""
+The balance ledger.
+
+Every change to User.balance goes through post_entry()/post_entries(): the
+balance column is moved with an F() UPDATE (no read-modify-write, no full-row
+save) and a LedgerEntry carrying the resulting balance is appended in the same
+transaction. The UPDATE holds the user row lock until commit, so the balance
+read back right after it is exactly the one this entry produced.
+
+For users created after the ledger, balance == sum(LedgerEntry.amount);
+older users' entries start from whatever balance they had at that point.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, When
+from django.utils import timezone
+
+from .caching import invalidate_dashboard, invalidate_user
+from .models import LedgerEntry, User
+
+SIGNUP_BONUS = Decimal('10.00')
+REFERRAL_BONUS_RATE = Decimal('0.10')
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+def post_entry(user_id, entry_type, amount, reference='', require_funds=False, **user_updates):
+    """
+    Add amount (negative for debits) to the user's balance and record it.
+    Extra keyword arguments are written in the same UPDATE, e.g. the task
+    counters on a task completion. With require_funds the UPDATE only applies
+    while the balance covers the debit; otherwise InsufficientFunds is raised
+    and the surrounding transaction should be rolled back.
+    Returns the new LedgerEntry.
+    """
+    amount = Decimal(amount).quantize(Decimal('0.01'))
+    users = User.objects.filter(pk=user_id)
+    with transaction.atomic():
+        guarded = users.filter(balance__gte=-amount) if require_funds and amount < 0 else users
+        if not guarded.update(balance=F('balance') + amount, **user_updates):
+            if require_funds and users.exists():
+                raise InsufficientFunds(f'Balance does not cover {-amount}')
+            raise User.DoesNotExist(f'User {user_id} not found')
+        balance_after = users.values_list('balance', flat=True).get()
+        entry = LedgerEntry.objects.create(
+            user_id=user_id, entry_type=entry_type, amount=amount,
+            balance_after=balance_after, reference=reference,
+        )
+        invalidate_dashboard(user_id)
+        invalidate_user(user_id)
+    return entry
+
+
+def post_entries(entry_type, entries):
+    """
+    Post many (user_id, amount, reference) entries of one type at once: one
+    CASE UPDATE for all balances, one read-back and one bulk INSERT. A user
+    may appear several times; their entries get consecutive running balances
+    in the order given.
+    """
+    per_user = defaultdict(Decimal)
+    entries = [(user_id, Decimal(amount).quantize(Decimal('0.01')), reference) for user_id, amount, reference in entries]
+    for user_id, amount, _ in entries:
+        per_user[user_id] += amount
+    if not per_user:
+        return []
+    whens = [When(pk=user_id, then=F('balance') + total) for user_id, total in per_user.items()]
+    with transaction.atomic():
+        User.objects.filter(pk__in=list(per_user)).update(
+            balance=Case(*whens, default=F('balance'), output_field=DecimalField(max_digits=10, decimal_places=2))
+        )
+        balances = dict(User.objects.filter(pk__in=list(per_user)).values_list('id', 'balance'))
+        # Walk each user's entries forward from the balance before this batch
+        running = {user_id: balances[user_id] - total for user_id, total in per_user.items() if user_id in balances}
+        now = timezone.now()
+        rows = []
+        for user_id, amount, reference in entries:
+            if user_id not in running:
+                continue
+            running[user_id] += amount
+            rows.append(LedgerEntry(
+                user_id=user_id, entry_type=entry_type, amount=amount,
+                balance_after=running[user_id], reference=reference, created_at=now,
+            ))
+        created = LedgerEntry.objects.bulk_create(rows)
+        invalidate_dashboard(*running)
+        invalidate_user(*running)
+    return created
+
+
+def set_balance(user_id, target, reference=''):
+    """Move the user's balance to target with an 'adjustment' entry (reset_account, admin edits)."""
+    with transaction.atomic():
+        current = User.objects.select_for_update().filter(pk=user_id).values_list('balance', flat=True).get()
+        return post_entry(user_id, 'adjustment', Decimal(target) - current, reference=reference)
+
+
+def current_balance(user_id):
+    """
+    The balance after the user's newest entry (one seek on ledger_user_page_idx),
+    read from the database rather than a cached user row. Falls back to the
+    balance column for users without entries.
+    """
+    balance = (
+        LedgerEntry.objects.filter(user_id=user_id)
+        .order_by('-created_at', '-id').values_list('balance_after', flat=True).first()
+    )
+    if balance is None:
+        balance = User.objects.filter(pk=user_id).values_list('balance', flat=True).get()
+    return balance
+
+
+def balance_at(user_id, when):
+    """
+    The user's balance at a point in time: one seek on ledger_user_page_idx.
+    None if the user has no entry at or before it.
+    """
+    return (
+        LedgerEntry.objects.filter(user_id=user_id, created_at__lte=when)
+        .order_by('-created_at', '-id').values_list('balance_after', flat=True).first()
+    )
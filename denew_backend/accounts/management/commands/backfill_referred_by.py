@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, Max, Min, OuterRef, Subquery
+from denew_backend.accounts.models import User
+from denew_backend.accounts.referrals import invitations_to
+
+
+class Command(BaseCommand):
+    help = 'Set User.referred_by for existing users from the invitations sent to their email, in id-range chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='User id range per UPDATE')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the users that would be linked')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        bounds = User.objects.filter(referred_by__isnull=True).aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            self.stdout.write('No users to backfill')
+            return
+        # Same rule as registration (referrals.invited_by): accepted invitations
+        # only, the earliest first; nobody refers themselves
+        invitations = invitations_to(OuterRef('email')).exclude(referrer_id=OuterRef('pk'))
+        started = time.perf_counter()
+        linked = 0
+        for start in range(bounds['first'], bounds['last'] + 1, chunk_size):
+            # One UPDATE per chunk; rows without an invitation are not touched
+            pending = User.objects.filter(
+                Exists(invitations), id__gte=start, id__lt=start + chunk_size, referred_by__isnull=True,
+            )
+            if options['dry_run']:
+                linked += pending.count()
+            else:
+                linked += pending.update(referred_by=Subquery(invitations[:1]))
+            self.stdout.write(f'users {start}-{min(start + chunk_size - 1, bounds["last"])}: {linked} linked so far')
+        verb = 'Would link' if options['dry_run'] else 'Linked'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {linked} users in {time.perf_counter() - started:.1f}s'))
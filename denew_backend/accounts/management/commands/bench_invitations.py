@@ -0,0 +1,100 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from denew_backend.accounts.ledger import REFERRAL_BONUS_RATE
+from denew_backend.accounts.models import Deposit, Invitation, User, UserStats
+from denew_backend.accounts.referrals import ACTIVE_DAYS, referral_stats
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the get_invitations referral statistics for a referrer with many invitees'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invitees', type=int, default=10000, help='Invitations sent by the benchmark referrer')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per implementation')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark users afterwards')
+
+    def handle(self, *args, **options):
+        referrer = self.create_team(options['invitees'])
+        try:
+            legacy = self.measure('per-referee loop', lambda: self.loop_stats(referrer.pk), options['repeat'])
+            single = self.measure('single query', lambda: referral_stats(referrer.pk), options['repeat'])
+            if legacy == single:
+                self.stdout.write(self.style.SUCCESS(f'  results match: {single}'))
+            else:
+                self.stdout.write(self.style.ERROR(f'  results differ: loop {legacy}, single query {single}'))
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith='bench_invite_').delete()
+
+    def create_team(self, count):
+        User.objects.filter(username__startswith='bench_invite_').delete()
+        referrer = User.objects.create(username='bench_invite_referrer', email='bench_invite_referrer@example.com')
+        now = timezone.now()
+        # Every other invitee registered; a third of those logged in recently
+        referees = User.objects.bulk_create([
+            User(username=f'bench_invite_{i}', email=f'bench_invite_{i}@example.com', referral_code=f'binv{i}', referred_by=referrer,
+                 last_login=now - timedelta(days=1 if i % 3 == 0 else ACTIVE_DAYS + 1))
+            for i in range(0, count, 2)
+        ], batch_size=1000)
+        Invitation.objects.bulk_create([
+            Invitation(referrer=referrer, referee_email=f'bench_invite_{i}@example.com', status='accepted' if i % 2 == 0 else 'pending')
+            for i in range(count)
+        ], batch_size=1000)
+        # Half the referees have their totals in UserStats, the rest only in deposits
+        Deposit.objects.bulk_create([
+            Deposit(user=referee, amount=Decimal('25.00'), wallet_address='bench', status='confirmed')
+            for referee in referees[1::2]
+        ], batch_size=1000)
+        UserStats.objects.bulk_create([
+            UserStats(user=referee, deposits_confirmed=Decimal('50.00')) for referee in referees[::2]
+        ], batch_size=1000)
+        return referrer
+
+    def loop_stats(self, referrer_id):
+        """The original implementation: matches referees by invitation email, several queries per invitation."""
+        invitations = Invitation.objects.filter(referrer_id=referrer_id)
+        active_since = timezone.now() - timedelta(days=ACTIVE_DAYS)
+        active_members = 0
+        referee_deposits = Decimal('0')
+        for invitation in invitations:
+            referee = User.objects.filter(email=invitation.referee_email).first()
+            if referee is None:
+                continue
+            if referee.last_login and referee.last_login >= active_since:
+                active_members += 1
+            stats = UserStats.objects.filter(user=referee).values_list('deposits_confirmed', flat=True).first()
+            if stats is None:
+                stats = Deposit.objects.filter(user=referee, status='confirmed').values_list('amount', flat=True)
+                stats = sum(stats, Decimal('0'))
+            referee_deposits += stats
+        return {
+            'team_size': invitations.count(),
+            'active_members': active_members,
+            'referral_earnings': (referee_deposits * REFERRAL_BONUS_RATE).quantize(Decimal('0.01')),
+        }
+
+    def measure(self, label, run, repeat):
+        timings = []
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        for _ in range(repeat):
+            queries[0] = 0
+            with connection.execute_wrapper(count):
+                started = time.perf_counter()
+                result = run()
+                timings.append(time.perf_counter() - started)
+        timings.sort()
+        self.stdout.write(
+            f'{label}: median {timings[len(timings) // 2] * 1000:.1f}ms, '
+            f'best {timings[0] * 1000:.1f}ms, {queries[0]} queries per run'
+        )
+        return result
@@ -0,0 +1,114 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+from denew_backend.accounts.models import User, Task
+from denew_backend.accounts.task_sets import TASKS_PER_SET, complete_task, generate_task_set
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent task submission against the same and different users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=8, help='Number of benchmark users (one task set each)')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads per scenario')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark users afterwards')
+
+    def handle(self, *args, **options):
+        users = self.create_users(options['users'])
+        try:
+            self.same_user_scenario(users[0], options['threads'])
+            self.different_users_scenario(users, options['threads'])
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith='bench_submit_').delete()
+
+    def create_users(self, count):
+        User.objects.filter(username__startswith='bench_submit_').delete()
+        users = User.objects.bulk_create([
+            User(username=f'bench_submit_{i}', email=f'bench_submit_{i}@example.com',
+                 referral_code=f'bsub{i}', balance=Decimal('1000.00'), current_set=1)
+            for i in range(count)
+        ])
+        for user in users:
+            generate_task_set(user, 1)
+        Task.objects.filter(user__in=users).update(status='in-progress')
+        return users
+
+    def run_threads(self, count, target):
+        results = {'ok': 0, 'conflict': 0, 'error': 0}
+        lock = threading.Lock()
+
+        def worker(index):
+            try:
+                for outcome in target(index):
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    def submit(self, user, task):
+        try:
+            return 'ok' if complete_task(user, task) else 'conflict'
+        except Exception as e:  # e.g. "database is locked" on SQLite
+            self.stderr.write(f'submit failed: {e}')
+            return 'error'
+
+    def same_user_scenario(self, user, thread_count):
+        """Every thread double-submits every task of one user; each task must be credited once."""
+        tasks = list(Task.objects.filter(user=user).order_by('task_number'))
+        balance_before = User.objects.get(pk=user.pk).balance
+        results, elapsed = self.run_threads(thread_count, lambda i: (self.submit(user, task) for task in tasks))
+        user.refresh_from_db()
+        expected = balance_before + sum(task.earnings for task in tasks)
+        self.report('same user', results, elapsed)
+        self.verify(user.balance == expected and user.tasks_completed == len(tasks),
+                   f'balance {user.balance} (expected {expected}), tasks_completed {user.tasks_completed}')
+
+    def different_users_scenario(self, users, thread_count):
+        """Threads submit disjoint users' tasks in parallel."""
+        others = users[1:]
+        if not others:
+            return
+        tasks = list(Task.objects.filter(user__in=others).order_by('task_number'))
+        by_thread = [[] for _ in range(thread_count)]
+        for task in tasks:
+            by_thread[task.user_id % thread_count].append(task)
+        users_by_id = {user.id: user for user in others}
+        balances_before = dict(User.objects.filter(pk__in=users_by_id).values_list('id', 'balance'))
+        results, elapsed = self.run_threads(
+            thread_count, lambda i: (self.submit(users_by_id[task.user_id], task) for task in by_thread[i])
+        )
+        self.report('different users', results, elapsed)
+        earned = dict(
+            Task.objects.filter(user__in=others, status='completed').values('user').annotate(total=Sum('earnings')).values_list('user', 'total')
+        )
+        mismatched = [
+            user.username for user in User.objects.filter(pk__in=users_by_id)
+            if user.balance != balances_before[user.id] + earned.get(user.id, 0) or user.tasks_completed != TASKS_PER_SET
+        ]
+        self.verify(not mismatched, f'mismatched users: {mismatched}')
+
+    def report(self, label, results, elapsed):
+        submits = sum(results.values())
+        self.stdout.write(
+            f'{label}: {submits} submits in {elapsed:.3f}s ({submits / elapsed:.0f}/s) - '
+            f'{results["ok"]} credited, {results["conflict"]} rejected as duplicates, {results["error"]} errors'
+        )
+
+    def verify(self, ok, detail):
+        if ok:
+            self.stdout.write(self.style.SUCCESS('  balances consistent'))
+        else:
+            self.stdout.write(self.style.ERROR(f'  inconsistent: {detail}'))
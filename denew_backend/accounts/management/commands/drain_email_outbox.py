@@ -0,0 +1,33 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from denew_backend.accounts.outbox import drain
+from denew_backend.accounts.verification import get_code_store
+
+
+class Command(BaseCommand):
+    help = 'Send queued outbox emails (once, or continuously with --loop) and purge expired verification codes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.EMAIL_DISPATCH_WORKERS, help='Sender threads (one SMTP connection each per batch)')
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_BATCH_SIZE, help='Messages claimed per batch')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new and retried messages')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        codes = get_code_store()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email-send') as pool:
+            while True:
+                started = time.perf_counter()
+                claimed, sent = drain(pool, workers, options['batch_size'])
+                if claimed or not options['loop']:
+                    self.stdout.write(f'Sent {sent} of {claimed} messages in {time.perf_counter() - started:.1f}s')
+                purged = codes.purge_expired()
+                if purged:
+                    self.stdout.write(f'Purged {purged} expired verification codes')
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,91 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from denew_backend.accounts.models import User, Task
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic Task table and report EXPLAIN plans and timings for the hot Task queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help='Synthetic users to create')
+        parser.add_argument('--sets', type=int, default=5, help='Task sets (40 tasks each) per user')
+        parser.add_argument('--repeat', type=int, default=50, help='Executions per query when timing')
+        parser.add_argument('--compare', action='store_true',
+                            help='Also measure with the Task indexes dropped (they are recreated afterwards). '
+                                 'Do not use against a live database.')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic rows afterwards')
+
+    def handle(self, *args, **options):
+        user = self.seed(options['users'], options['sets'])
+        try:
+            if options['compare']:
+                indexes = Task._meta.indexes
+                with connection.schema_editor() as editor:
+                    for index in indexes:
+                        editor.remove_index(Task, index)
+                try:
+                    self.analyze()
+                    self.report('without indexes', user, options['repeat'])
+                finally:
+                    with connection.schema_editor() as editor:
+                        for index in indexes:
+                            editor.add_index(Task, index)
+            self.analyze()
+            self.report('with indexes', user, options['repeat'])
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith='explain_').delete()
+
+    def seed(self, user_count, set_count):
+        User.objects.filter(username__startswith='explain_').delete()
+        self.stdout.write(f'Seeding {user_count} users x {set_count * 40} tasks...')
+        users = User.objects.bulk_create([
+            User(username=f'explain_{i}', email=f'explain_{i}@example.com', referral_code=f'expl{i}',
+                 current_set=set_count)
+            for i in range(user_count)
+        ], batch_size=1000)
+        now = timezone.now()
+        batch = []
+        for user in users:
+            for set_number in range(1, set_count + 1):
+                open_from = random.randint(1, 40) if set_number == set_count else 41
+                for task_number in range(1, 41):
+                    if task_number < open_from:
+                        status, completed_at = 'completed', now
+                    else:
+                        status, completed_at = ('pending' if task_number == open_from else 'queued'), None
+                    batch.append(Task(user=user, set_number=set_number, task_number=task_number,
+                                      status=status, earnings=Decimal('1.00'), completed_at=completed_at))
+            if len(batch) >= 10000:
+                Task.objects.bulk_create(batch, batch_size=2000)
+                batch = []
+        Task.objects.bulk_create(batch, batch_size=2000)
+        return random.choice(users)
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE accounts_task' if connection.vendor == 'postgresql' else 'ANALYZE')
+
+    def queries(self, user):
+        return [
+            ('get_current_task', Task.objects.filter(user=user, set_number=user.current_set, status__in=['pending', 'in-progress']).order_by('task_number')[:1]),
+            ('dashboard_data', Task.objects.filter(user=user, status='completed').order_by('-completed_at')[:3]),
+            ('list_tasks', Task.objects.filter(user=user).exclude(status='queued').order_by('-created_at', '-id')[:50]),
+        ]
+
+    def report(self, label, user, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'== {label} ({connection.vendor}) =='))
+        explain_options = {'analyze': True} if connection.vendor == 'postgresql' else {}
+        for name, queryset in self.queries(user):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                list(queryset.all())
+            elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+            self.stdout.write(f'{name}: {elapsed_ms:.3f} ms/query')
+            for line in queryset.explain(**explain_options).splitlines():
+                self.stdout.write(f'    {line}')
@@ -0,0 +1,34 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from denew_backend.accounts.exports import EXPORTS, FORMATS, ExportError, export_rows, render
+
+
+class Command(BaseCommand):
+    help = 'Stream deposits, withdrawals or tasks to a file (or stdout) as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--format', dest='output', choices=list(FORMATS), default='csv')
+        parser.add_argument('--since', help='Rows created on or after this date/datetime')
+        parser.add_argument('--until', help='Rows created up to this date (inclusive) or datetime')
+        parser.add_argument('--status', action='append', default=[], help='Only rows with this status (repeatable)')
+        parser.add_argument('--output', dest='path', help='File to write (default: stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            columns, rows = export_rows(options['kind'], options['since'], options['until'], options['status'])
+            chunks = render(columns, rows, options['output'])
+        except ExportError as e:
+            raise CommandError(str(e))
+        started = time.perf_counter()
+        out = open(options['path'], 'w', newline='', encoding='utf-8') if options['path'] else sys.stdout
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if options['path']:
+                out.close()
+        if options['path']:
+            self.stderr.write(f'Exported {options["kind"]} to {options["path"]} in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,20 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from denew_backend.accounts.pictures import prune
+
+
+class Command(BaseCommand):
+    help = 'Delete stored profile pictures that no user shows or is waiting for'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list the pictures that would be deleted')
+
+    def handle(self, *args, **options):
+        try:
+            removed = prune(dry_run=options['dry_run'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        for digest in removed:
+            self.stdout.write(digest)
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(removed)} pictures'))
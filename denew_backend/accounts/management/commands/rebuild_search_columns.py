@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from denew_backend.accounts.models import Deposit, User, Withdrawal
+from denew_backend.accounts.search import rebuild_search_columns
+
+
+class Command(BaseCommand):
+    help = 'Recompute the normalized search columns (needed after bulk_create/update() writes, which skip save())'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows rewritten per UPDATE')
+
+    def handle(self, *args, **options):
+        for model in (User, Deposit, Withdrawal):
+            rewritten = rebuild_search_columns(model, chunk_size=options['chunk_size'])
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {rewritten} rows')
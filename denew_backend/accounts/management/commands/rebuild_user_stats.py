@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from denew_backend.accounts.models import User, UserStats
+from denew_backend.accounts.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute UserStats totals from tasks, deposits and withdrawals in user-id chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Users per chunk (one transaction each)')
+        parser.add_argument('--missing', action='store_true', help='Only build rows for users that have none')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        users = User.objects.order_by('id')
+        if options['missing']:
+            users = users.exclude(pk__in=UserStats.objects.values('user_id'))
+        started = time.perf_counter()
+        processed = 0
+        last_id = 0
+        while True:
+            user_ids = list(users.filter(id__gt=last_id).values_list('id', flat=True)[:chunk_size])
+            if not user_ids:
+                break
+            with transaction.atomic():
+                rebuild_stats(user_ids)
+            processed += len(user_ids)
+            last_id = user_ids[-1]
+            self.stdout.write(f'Rebuilt {processed} users (up to id {last_id})')
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt stats for {processed} users in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,75 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+from denew_backend.accounts.models import User
+from denew_backend.accounts.reconciliation import reconcile_range
+
+
+def _init_worker():
+    # Forked workers must not share the parent's database connections
+    django.setup()
+    connections.close_all()
+
+
+def _reconcile(bounds):
+    return reconcile_range(*bounds)
+
+
+class Command(BaseCommand):
+    help = 'Check user balances against the ledger and source tables in id-range chunks across worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='User id range per chunk')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes (1 runs inline)')
+        parser.add_argument('--show', type=int, default=50, help='Mismatches to list in the report')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        bounds = User.objects.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            self.stdout.write('No users to reconcile')
+            return
+        ranges = [
+            (start, min(start + chunk_size - 1, bounds['last']))
+            for start in range(bounds['first'], bounds['last'] + 1, chunk_size)
+        ]
+        started = time.perf_counter()
+        checked = 0
+        mismatches = []
+        if options['workers'] > 1 and len(ranges) > 1:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+                results = pool.map(_reconcile, ranges)
+                checked, mismatches, skipped = self.collect(results, len(ranges))
+        else:
+            checked, mismatches, skipped = self.collect(map(_reconcile, ranges), len(ranges))
+
+        mismatches.sort(key=lambda row: abs(row[2] - row[3]), reverse=True)
+        for user_id, username, balance, expected, basis in mismatches[:options['show']]:
+            self.stdout.write(f'{user_id}\t{username}\tbalance={balance}\texpected={expected}\tdiff={balance - expected}\t{basis}')
+        if len(mismatches) > options['show']:
+            self.stdout.write(f'... {len(mismatches) - options["show"]} more')
+        drift = sum((balance - expected for _, _, balance, expected, _ in mismatches), Decimal('0'))
+        summary = (
+            f'Checked {checked} users in {len(ranges)} chunks in {time.perf_counter() - started:.1f}s: '
+            f'{len(mismatches)} mismatched, net drift {drift}; '
+            f'{skipped} pre-ledger referrers skipped (their commissions were never recorded)'
+        )
+        self.stdout.write(self.style.ERROR(summary) if mismatches else self.style.SUCCESS(summary))
+
+    def collect(self, results, total_chunks):
+        checked = skipped = 0
+        mismatches = []
+        for done, (count, chunk_mismatches, chunk_skipped) in enumerate(results, 1):
+            checked += count
+            skipped += chunk_skipped
+            mismatches.extend(chunk_mismatches)
+            if done % 100 == 0:
+                self.stdout.write(f'{done}/{total_chunks} chunks, {checked} users, {len(mismatches)} mismatched')
+        return checked, mismatches, skipped
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_task_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('task_earnings', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('tasks_completed', models.IntegerField(default=0)),
+                ('deposits_confirmed', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('withdrawals_completed', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('withdrawals_pending', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'accounts_userstats',
+            },
+        ),
+    ]
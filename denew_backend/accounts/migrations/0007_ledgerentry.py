@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_jobwatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('signup_bonus', 'Signup Bonus'), ('deposit', 'Deposit'), ('deposit_reversal', 'Deposit Reversal'), ('task_earning', 'Task Earning'), ('referral_bonus', 'Referral Bonus'), ('commission', 'Commission'), ('withdrawal', 'Withdrawal'), ('withdrawal_refund', 'Withdrawal Refund'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'accounts_ledgerentry',
+                'indexes': [models.Index(fields=['user', '-created_at', '-id'], name='ledger_user_page_idx')],
+            },
+        ),
+    ]
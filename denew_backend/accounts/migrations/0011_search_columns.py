@@ -0,0 +1,136 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:42
+
+import re
+
+from django.db import migrations, models
+
+# Frozen copies of the models' SEARCH_COLUMNS and of search.py's normalizers,
+# so later changes to the app code cannot change what this migration does
+NORMALIZERS = {
+    'text': lambda value: (value or '').strip().lower(),
+    'phone': lambda value: re.sub(r'\D', '', value or ''),
+}
+
+USER_COLUMNS = {
+    'username_search': ('username', 'text'),
+    'email_search': ('email', 'text'),
+    'full_name_search': ('full_name', 'text'),
+    'phone_search': ('phone_number', 'phone'),
+}
+WALLET_COLUMNS = {'wallet_search': ('wallet_address', 'text')}
+
+TRIGRAM_INDEXES = [
+    ('user_username_search_trgm', 'accounts_user', 'username_search'),
+    ('user_email_search_trgm', 'accounts_user', 'email_search'),
+    ('user_full_name_search_trgm', 'accounts_user', 'full_name_search'),
+    ('user_phone_search_trgm', 'accounts_user', 'phone_search'),
+    ('deposit_wallet_search_trgm', 'accounts_deposit', 'wallet_search'),
+    ('withdrawal_wallet_search_trgm', 'accounts_withdrawal', 'wallet_search'),
+]
+
+
+def rebuild_search_columns(model, columns, chunk_size=2000):
+    """Fill columns for every row of model in primary key chunks."""
+    sources = [source for source, _ in columns.values()]
+    last_pk = 0
+    while True:
+        rows = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', *sources)[:chunk_size])
+        if not rows:
+            return
+        objects = []
+        for pk, *values in rows:
+            source_values = dict(zip(sources, values))
+            objects.append(model(pk=pk, **{
+                column: NORMALIZERS[kind](source_values[source]) for column, (source, kind) in columns.items()
+            }))
+        model.objects.bulk_update(objects, list(columns))
+        last_pk = rows[-1][0]
+
+
+def fill_search_columns(apps, schema_editor):
+    rebuild_search_columns(apps.get_model('accounts', 'User'), USER_COLUMNS)
+    rebuild_search_columns(apps.get_model('accounts', 'Deposit'), WALLET_COLUMNS)
+    rebuild_search_columns(apps.get_model('accounts', 'Withdrawal'), WALLET_COLUMNS)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Substring search indexes exist on PostgreSQL only; elsewhere search.py
+    # runs the same LIKE predicates on the shadow columns without them
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_user_referred_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deposit',
+            name='wallet_search',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='email_search',
+            field=models.CharField(blank=True, editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='full_name_search',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='phone_search',
+            field=models.CharField(blank=True, editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='username_search',
+            field=models.CharField(blank=True, editable=False, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='withdrawal',
+            name='wallet_search',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='deposit',
+            index=models.Index(fields=['wallet_search'], name='deposit_wallet_search_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['username_search'], name='user_username_search_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['email_search'], name='user_email_search_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['full_name_search'], name='user_full_name_search_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['phone_search'], name='user_phone_search_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawal',
+            index=models.Index(fields=['wallet_search'], name='withdrawal_wallet_search_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(fill_search_columns, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_search_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='profile_picture_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='profile_picture_pending',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
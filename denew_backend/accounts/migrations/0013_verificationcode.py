@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_user_profile_picture_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VerificationCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email_digest', models.CharField(max_length=64, unique=True)),
+                ('code', models.CharField(max_length=6)),
+                ('verified', models.BooleanField(default=False)),
+                ('attempts', models.IntegerField(default=0)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'db_table': 'accounts_verificationcode',
+            },
+        ),
+    ]
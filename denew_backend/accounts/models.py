@@ -1,10 +1,10 @@
-from django.db import models, transaction
+from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
-from django.db.models.signals import post_save
-from django.dispatch import receiver
 import uuid
 
+from .search import refresh_search_columns
+
 class User(AbstractUser):
     full_name = models.CharField(max_length=255, blank=True)
     phone_number = models.CharField(max_length=20, blank=True)
@@ -23,15 +23,65 @@ class User(AbstractUser):
     sms_notifications = models.BooleanField(default=False)
     twofa_enabled = models.BooleanField(default=False)
     profile_picture = models.CharField(max_length=255, blank=True)
+    # sha256 of the picture shown and of an upload still being processed (pictures.py)
+    profile_picture_hash = models.CharField(max_length=64, blank=True, editable=False)
+    profile_picture_pending = models.CharField(max_length=64, blank=True, editable=False)
     is_verified = models.BooleanField(default=False)
     withdrawal_password = models.CharField(max_length=4, blank=True)
+    # Set at registration (referral code or invitation); manage.py backfill_referred_by for older users
+    referred_by = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='referees')
+    # Normalized copies for indexed admin/support search (search.py), kept current by save()
+    username_search = models.CharField(max_length=150, blank=True, editable=False)
+    email_search = models.CharField(max_length=254, blank=True, editable=False)
+    full_name_search = models.CharField(max_length=255, blank=True, editable=False)
+    phone_search = models.CharField(max_length=20, blank=True, editable=False)
+
+    EXTERNALLY_WRITTEN = {'balance', 'profile_picture', 'profile_picture_hash', 'profile_picture_pending'}
+
+    SEARCH_COLUMNS = {
+        'username_search': ('username', 'text'),
+        'email_search': ('email', 'text'),
+        'full_name_search': ('full_name', 'text'),
+        'phone_search': ('phone_number', 'phone'),
+    }
 
     class Meta:
         db_table = 'accounts_user'
+        indexes = [
+            models.Index(fields=['email'], name='user_email_idx'),  # referees are matched to invitations by email
+            # Prefix search; trigram indexes for substring search are added on PostgreSQL by migration 0011
+            models.Index(fields=['username_search'], name='user_username_search_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['email_search'], name='user_email_search_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['full_name_search'], name='user_full_name_search_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['phone_search'], name='user_phone_search_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loaded_balance = self.__dict__.get('balance')
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None or 'balance' in fields:
+            self._loaded_balance = self.__dict__.get('balance')
 
     def save(self, *args, **kwargs):
         if not self.referral_code:
             self.referral_code = str(uuid.uuid4())[:8]
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # balance is only written through the ledger (ledger.post_entry) and the
+            # picture fields by the picture workers, so a full save of a stale
+            # instance cannot overwrite a concurrent credit or a processed upload
+            if self.__dict__.get('balance') != self._loaded_balance:
+                stored = User.objects.filter(pk=self.pk).values_list('balance', flat=True).first()
+                if stored != self.balance:
+                    raise ValueError('User.balance is changed through the ledger (ledger.post_entry, set_balance), not save()')
+                self._loaded_balance = stored
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.EXTERNALLY_WRITTEN
+            ]
+        kwargs['update_fields'] = refresh_search_columns(self, kwargs.get('update_fields'))
         super().save(*args, **kwargs)
 
 class UserProfile(models.Model):
@@ -72,7 +122,7 @@ class Task(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     status = models.CharField(
         max_length=20,
-        choices=[('pending', 'Pending'), ('in-progress', 'In Progress'), ('completed', 'Completed')],
+        choices=[('queued', 'Queued'), ('pending', 'Pending'), ('in-progress', 'In Progress'), ('completed', 'Completed')],
         default='pending'
     )
     task_type = models.CharField(
@@ -91,6 +141,112 @@ class Task(models.Model):
     class Meta:
         db_table = 'accounts_task'
         unique_together = ('user', 'set_number', 'task_number')
+        indexes = [
+            # get_current_task / start_task_set: open tasks of the current set by task_number
+            models.Index(
+                fields=['user', 'set_number', 'task_number'],
+                condition=models.Q(status__in=['pending', 'in-progress']),
+                name='task_open_by_set_idx',
+            ),
+            # dashboard_data: completed tasks by completion time
+            models.Index(fields=['user', 'status', '-completed_at'], name='task_user_status_done_idx'),
+            # list_tasks: newest first, keyset paginated on (created_at, id)
+            models.Index(fields=['user', '-created_at', '-id'], name='task_user_created_idx'),
+        ]
+
+class UserStats(models.Model):
+    """
+    Running per-user totals, updated with F() deltas where tasks complete,
+    deposits confirm and withdrawals change state (see stats.py).
+    rebuild_user_stats recomputes them from the source tables.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    task_earnings = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tasks_completed = models.IntegerField(default=0)
+    deposits_confirmed = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    withdrawals_completed = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    withdrawals_pending = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'accounts_userstats'
+
+class JobWatermark(models.Model):
+    """High-water mark of an incremental background job (e.g. the commissions cron)."""
+    code = models.CharField(max_length=100, unique=True)
+    value = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'accounts_jobwatermark'
+
+class LedgerEntry(models.Model):
+    """
+    Append-only record of every change to User.balance (see ledger.py).
+    balance_after is the user's balance once the entry was applied, so the
+    latest entry at or before a point in time gives the balance at that time.
+    """
+    ENTRY_TYPES = [
+        ('signup_bonus', 'Signup Bonus'),
+        ('deposit', 'Deposit'),
+        ('deposit_reversal', 'Deposit Reversal'),
+        ('task_earning', 'Task Earning'),
+        ('referral_bonus', 'Referral Bonus'),
+        ('commission', 'Commission'),
+        ('withdrawal', 'Withdrawal'),
+        ('withdrawal_refund', 'Withdrawal Refund'),
+        ('adjustment', 'Adjustment'),
+    ]
+    user = models.ForeignKey(User, related_name='ledger_entries', on_delete=models.CASCADE)
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    balance_after = models.DecimalField(max_digits=14, decimal_places=2)
+    reference = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'accounts_ledgerentry'
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='ledger_user_page_idx'),
+        ]
+
+class VerificationCode(models.Model):
+    """Pending PIN-reset code of one email (see verification.py)."""
+    email_digest = models.CharField(max_length=64, unique=True)  # sha256 of the normalized email
+    code = models.CharField(max_length=6)
+    verified = models.BooleanField(default=False)
+    attempts = models.IntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'accounts_verificationcode'
+
+class EmailOutbox(models.Model):
+    """Outbound email waiting for (or done with) delivery by the dispatcher in outbox.py."""
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(
+        max_length=20,
+        choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')],
+        default='pending'
+    )
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'accounts_emailoutbox'
+        indexes = [
+            # The dispatcher's claim query: due rows that are not sent or failed
+            models.Index(
+                fields=['next_attempt_at', 'id'], name='emailoutbox_due_idx',
+                condition=models.Q(status__in=['pending', 'sending']),
+            ),
+        ]
 
 class Invitation(models.Model):
     referrer = models.ForeignKey(User, related_name='invitations_sent', on_delete=models.CASCADE)
@@ -105,12 +261,17 @@ class Invitation(models.Model):
 
     class Meta:
         db_table = 'accounts_invitation'
+        indexes = [
+            models.Index(fields=['referrer', '-created_at', '-id'], name='invitation_referrer_page_idx'),
+            models.Index(fields=['referee_email'], name='invitation_referee_email_idx'),
+        ]
 
 class Deposit(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     payment_method = models.CharField(max_length=50, default='usdt')
     wallet_address = models.CharField(max_length=100)
+    wallet_search = models.CharField(max_length=100, blank=True, editable=False)  # normalized copy for search.py
     status = models.CharField(
         max_length=20,
         choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('rejected', 'Rejected')],
@@ -118,14 +279,25 @@ class Deposit(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    SEARCH_COLUMNS = {'wallet_search': ('wallet_address', 'text')}
+
     class Meta:
         db_table = 'accounts_deposit'
+        indexes = [
+            models.Index(fields=['wallet_search'], name='deposit_wallet_search_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['user', '-created_at', '-id'], name='deposit_user_page_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        kwargs['update_fields'] = refresh_search_columns(self, kwargs.get('update_fields'))
+        super().save(*args, **kwargs)
 
 class Withdrawal(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     payment_method = models.CharField(max_length=50, default='usdt')
     wallet_address = models.CharField(max_length=100)
+    wallet_search = models.CharField(max_length=100, blank=True, editable=False)  # normalized copy for search.py
     status = models.CharField(
         max_length=20,
         choices=[('pending', 'Pending'), ('completed', 'Completed'), ('rejected', 'Rejected')],
@@ -134,8 +306,20 @@ class Withdrawal(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(null=True, blank=True)
 
+    SEARCH_COLUMNS = {'wallet_search': ('wallet_address', 'text')}
+
     class Meta:
         db_table = 'accounts_withdrawal'
+        indexes = [
+            models.Index(fields=['wallet_search'], name='withdrawal_wallet_search_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['user', '-created_at', '-id'], name='withdrawal_user_page_idx'),
+            # list_all_withdrawals for staff pages across every user
+            models.Index(fields=['-created_at', '-id'], name='withdrawal_page_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        kwargs['update_fields'] = refresh_search_columns(self, kwargs.get('update_fields'))
+        super().save(*args, **kwargs)
 
 class TermsAndConditions(models.Model):
     content = models.TextField()
@@ -174,31 +358,4 @@ class SupportTicket(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        db_table = 'accounts_supportticket'
-
-# NEW: Signal to auto-update user balance on deposit creation/update (add this at the end)
-@receiver(post_save, sender=Deposit)
-def update_user_balance_on_deposit(sender, instance, created, **kwargs):
-    """
-    Automatically update user balance when a deposit is created or status changes to 'confirmed'.
-    - On create: If status='confirmed', add amount to balance.
-    - On update: If status changed to 'confirmed', add amount (avoids double-adding).
-    """
-    if instance.status != 'confirmed':
-        return  # Skip if not confirmed
-
-    user = instance.user
-    with transaction.atomic():
-        if created:
-            # New deposit: Add if confirmed
-            user.balance += instance.amount
-        else:
-            # Existing deposit: Check if status just changed to confirmed
-            try:
-                old_instance = sender.objects.get(id=instance.id)
-                if old_instance.status != 'confirmed':
-                    user.balance += instance.amount
-            except sender.DoesNotExist:
-                pass  # Rare case, skip
-        
-        user.save(update_fields=['balance'])  # Efficient update, only changes balance
\ No newline at end of file
+        db_table = 'accounts_supportticket'
\ No newline at end of file
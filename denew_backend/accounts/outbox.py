@@ -0,0 +1,165 @@
+"""
+Outbound email, sent off the request path.
+
+Views call enqueue_email(), which only inserts an EmailOutbox row; once the
+transaction commits the in-process dispatcher thread is woken to deliver it.
+The dispatcher claims due rows in batches (SELECT ... FOR UPDATE SKIP LOCKED,
+so several processes can drain the same outbox), splits each batch across a
+bounded thread pool and sends every group over a single SMTP connection.
+Failures are retried with exponential backoff up to EMAIL_MAX_ATTEMPTS.
+
+`manage.py drain_email_outbox` runs the same loop from the command line or as
+a dedicated worker (set EMAIL_DISPATCH_IN_PROCESS=False on the web workers then).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+# A claimed row whose sender died is picked up again after this long
+SENDING_TIMEOUT = timedelta(minutes=10)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue_email(subject, body, recipients, from_email=None):
+    """Queue a message for delivery. Returns the EmailOutbox row."""
+    message = EmailOutbox.objects.create(
+        subject=subject, body=body, recipients=list(recipients),
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+    )
+    transaction.on_commit(dispatcher.wake)
+    return message
+
+
+def claim_batch(batch_size):
+    """Mark up to batch_size due messages as 'sending' and return them."""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status__in=['pending', 'sending'], next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size]
+        )
+        EmailOutbox.objects.filter(id__in=ids).update(
+            status='sending', attempts=F('attempts') + 1, next_attempt_at=now + SENDING_TIMEOUT,
+        )
+    return list(EmailOutbox.objects.filter(id__in=ids).order_by('id'))
+
+
+def send_group(messages):
+    """
+    Send messages over one connection. Runs on pool threads, so it only talks
+    to the mail backend, never the database. Returns {id: error or None}.
+    """
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        return {message.id: str(e) for message in messages}
+    results = {}
+    try:
+        for message in messages:
+            email = EmailMessage(message.subject, message.body, message.from_email, message.recipients, connection=connection)
+            try:
+                email.send()
+                results[message.id] = None
+            except Exception as e:
+                results[message.id] = str(e)
+    finally:
+        connection.close()
+    return results
+
+
+def record_results(messages, results):
+    now = timezone.now()
+    sent = [message_id for message_id, error in results.items() if error is None]
+    EmailOutbox.objects.filter(id__in=sent).update(status='sent', sent_at=now, last_error='')
+    max_attempts = _setting('EMAIL_MAX_ATTEMPTS', 5)
+    retry_base = _setting('EMAIL_RETRY_BASE_SECONDS', 30)
+    for message in messages:
+        error = results.get(message.id)
+        if error is None:
+            continue
+        if message.attempts >= max_attempts:
+            EmailOutbox.objects.filter(id=message.id).update(status='failed', last_error=error)
+            logger.error(f"Email {message.id} to {message.recipients} failed after {message.attempts} attempts: {error}")
+        else:
+            delay = timedelta(seconds=retry_base * 2 ** (message.attempts - 1))
+            EmailOutbox.objects.filter(id=message.id).update(status='pending', next_attempt_at=now + delay, last_error=error)
+    return len(sent)
+
+
+def dispatch_batch(pool=None, workers=1, batch_size=None):
+    """
+    Claim one batch and deliver it, split into one group (one connection) per
+    pool worker. Returns (claimed, sent).
+    """
+    messages = claim_batch(batch_size or _setting('EMAIL_BATCH_SIZE', 50))
+    if not messages:
+        return 0, 0
+    groups = [messages[i::workers] for i in range(workers) if messages[i::workers]]
+    results = {}
+    for group_results in (pool.map(send_group, groups) if pool else map(send_group, groups)):
+        results.update(group_results)
+    return len(messages), record_results(messages, results)
+
+
+def drain(pool=None, workers=1, batch_size=None):
+    """Dispatch batches until nothing is due. Returns (claimed, sent) totals."""
+    claimed = sent = 0
+    while True:
+        batch_claimed, batch_sent = dispatch_batch(pool, workers, batch_size)
+        if not batch_claimed:
+            return claimed, sent
+        claimed += batch_claimed
+        sent += batch_sent
+
+
+class EmailDispatcher:
+    """
+    Daemon thread that drains the outbox whenever a message is enqueued, and
+    every EMAIL_DISPATCH_POLL_SECONDS to pick up retries. Started on first use.
+    """
+
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wake(self):
+        if not _setting('EMAIL_DISPATCH_IN_PROCESS', True):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='email-dispatcher', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        workers = _setting('EMAIL_DISPATCH_WORKERS', 4)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email-send') as pool:
+            while True:
+                self._wakeup.wait(timeout=_setting('EMAIL_DISPATCH_POLL_SECONDS', 60))
+                self._wakeup.clear()
+                try:
+                    drain(pool, workers)
+                except Exception as e:
+                    logger.error(f"Email dispatch error: {str(e)}", exc_info=True)
+                finally:
+                    close_old_connections()
+
+
+dispatcher = EmailDispatcher()
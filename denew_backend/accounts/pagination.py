@@ -0,0 +1,68 @@
+"""
+Keyset (cursor) pagination on (created_at, id), newest first.
+
+A page is fetched with `WHERE (created_at, id) < cursor ORDER BY created_at DESC,
+id DESC LIMIT n + 1`, which stays an index range scan however deep the client
+pages, unlike OFFSET. Cursors are opaque url-safe tokens.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(created_at, pk, *extra):
+    raw = json.dumps([created_at.isoformat(), pk, *extra]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, extra=0):
+    """Returns (created_at, pk), followed by `extra` further values if the cursor carries them."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk, *rest = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = parse_datetime(created_at)
+        if created_at is None or not isinstance(pk, int) or len(rest) != extra:
+            raise ValueError
+    except (ValueError, TypeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return (created_at, pk, *rest)
+
+
+def get_page_size(request):
+    default = getattr(settings, 'API_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'API_MAX_PAGE_SIZE', 200)
+    try:
+        page_size = int(request.query_params.get('page_size', default))
+    except (TypeError, ValueError):
+        raise ValidationError({'page_size': 'Must be an integer'})
+    return max(1, min(page_size, maximum))
+
+
+def paginate_keyset(queryset, request, cursor_param='cursor'):
+    """
+    Return (items, next_cursor) for one page of the queryset, newest first.
+    next_cursor is None on the last page.
+    """
+    page_size = get_page_size(request)
+    cursor = request.query_params.get(cursor_param)
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    items = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+    if len(items) <= page_size:
+        return items, None
+    items = items[:page_size]
+    return items, encode_cursor(items[-1].created_at, items[-1].id)
+
+
+def with_next_cursor(response, next_cursor):
+    """Attach the next cursor to a response whose body is a bare list."""
+    if next_cursor:
+        response[NEXT_CURSOR_HEADER] = next_cursor
+    return response
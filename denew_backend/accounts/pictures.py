@@ -0,0 +1,216 @@
+"""
+Profile picture uploads.
+
+update_user_profile only streams the upload to a temporary file, hashing it on
+the way (stage_upload), checks that Pillow recognises it as an image and, once
+the profile is saved, records the digest as the user's pending picture
+(queue_processing). The rest runs on a small thread pool off the
+request thread: the original is stored content-addressed under
+profile_pictures/<aa>/<sha256>/ (an identical re-upload reuses what is already
+there), the resized WebP variants in VARIANTS are rendered next to it, and the
+user row is pointed at them. That last UPDATE only applies while the digest is
+still the pending one, so a slower earlier upload never overwrites a newer one.
+
+`manage.py prune_profile_pictures` deletes directories no user refers to,
+through the storage API, re-checking each one just before deleting it.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .caching import invalidate_dashboard, invalidate_user
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+ROOT = 'profile_pictures'
+
+# name -> longest side in pixels; profile_picture points at DISPLAY_VARIANT
+VARIANTS = {'thumbnail': 64, 'display': 256}
+DISPLAY_VARIANT = 'display'
+
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+
+
+class InvalidPicture(ValueError):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def picture_dir(digest):
+    return f'{ROOT}/{digest[:2]}/{digest}'
+
+
+def variant_path(digest, variant):
+    return f'{picture_dir(digest)}/{variant}.webp'
+
+
+def variant_url(digest, variant):
+    return default_storage.url(variant_path(digest, variant)) if digest else ''
+
+
+def stage_upload(uploaded_file):
+    """
+    Copy an UploadedFile to a temporary file chunk by chunk while hashing it.
+    Returns (temp path, sha256 hex digest, Pillow format). Raises InvalidPicture.
+    """
+    max_bytes = _setting('PROFILE_PICTURE_MAX_BYTES', 10 * 1024 * 1024)
+    digest = hashlib.sha256()
+    size = 0
+    handle = tempfile.NamedTemporaryFile(prefix='picture-', dir=settings.FILE_UPLOAD_TEMP_DIR, delete=False)
+    try:
+        with handle:
+            for chunk in uploaded_file.chunks():
+                size += len(chunk)
+                if size > max_bytes:
+                    raise InvalidPicture(f'Profile picture must be under {max_bytes // (1024 * 1024)} MB')
+                digest.update(chunk)
+                handle.write(chunk)
+        try:
+            with Image.open(handle.name) as image:  # reads the header only
+                image_format = image.format
+        except (UnidentifiedImageError, OSError):
+            raise InvalidPicture('Profile picture must be a JPEG, PNG, GIF or WebP image')
+        if image_format not in ALLOWED_FORMATS:
+            raise InvalidPicture('Profile picture must be a JPEG, PNG, GIF or WebP image')
+    except Exception:
+        os.unlink(handle.name)
+        raise
+    return handle.name, digest.hexdigest(), image_format
+
+
+def render_variants(source_path, digest):
+    """Write the variants of one picture that do not exist yet."""
+    missing = {name: size for name, size in VARIANTS.items() if not default_storage.exists(variant_path(digest, name))}
+    if not missing:
+        return
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+        for name, size in sorted(missing.items(), key=lambda item: -item[1]):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)  # largest first, each from the previous
+            with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as buffer:
+                image.save(buffer, 'WEBP', quality=_setting('PROFILE_PICTURE_QUALITY', 82), method=4)
+                buffer.seek(0)
+                default_storage.save(variant_path(digest, name), File(buffer))
+
+
+def process_picture(user_id, temp_path, digest, image_format):
+    """Store the original and its variants, then point the user at them."""
+    try:
+        original = f'{picture_dir(digest)}/original.{image_format.lower()}'
+        if not default_storage.exists(original):
+            with open(temp_path, 'rb') as source:
+                default_storage.save(original, File(source))
+        render_variants(temp_path, digest)
+        updated = User.objects.filter(pk=user_id, profile_picture_pending=digest).update(
+            profile_picture=variant_url(digest, DISPLAY_VARIANT), profile_picture_hash=digest, profile_picture_pending='',
+        )
+        if updated:
+            invalidate_user(user_id)
+            invalidate_dashboard(user_id)
+    except Exception as e:
+        logger.error(f'Profile picture {digest} for user {user_id} failed: {str(e)}', exc_info=True)
+        User.objects.filter(pk=user_id, profile_picture_pending=digest).update(profile_picture_pending='')
+    finally:
+        os.unlink(temp_path)
+
+
+class PicturePool:
+    """Lazily started thread pool; PROFILE_PICTURE_WORKERS = 0 processes inline (tests, management shells)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, *args):
+        workers = _setting('PROFILE_PICTURE_WORKERS', 2)
+        if workers <= 0:
+            process_picture(*args)
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='profile-picture')
+        self._executor.submit(self._run, *args)
+
+    def _run(self, *args):
+        try:
+            process_picture(*args)
+        finally:
+            close_old_connections()
+
+
+pool = PicturePool()
+
+
+def discard(staged):
+    """Remove a staged upload that will not be processed."""
+    os.unlink(staged[0])
+
+
+def queue_processing(user, staged):
+    """
+    Record staged (from stage_upload) as user's pending picture and process it
+    once the current transaction commits. Returns the digest.
+    """
+    temp_path, digest, image_format = staged
+    User.objects.filter(pk=user.pk).update(profile_picture_pending=digest)
+    user.profile_picture_pending = digest
+    invalidate_user(user.pk)
+    transaction.on_commit(lambda: pool.submit(user.pk, temp_path, digest, image_format))
+    return digest
+
+
+def is_referenced(digest):
+    return User.objects.filter(Q(profile_picture_hash=digest) | Q(profile_picture_pending=digest)).exists()
+
+
+def _delete_tree(path):
+    """Delete everything under path through the storage API."""
+    directories, files = default_storage.listdir(path)
+    for name in files:
+        default_storage.delete(f'{path}/{name}')
+    for name in directories:
+        _delete_tree(f'{path}/{name}')
+    default_storage.delete(path)  # removes the emptied directory on FileSystemStorage
+
+
+def prune(dry_run=False):
+    """
+    Delete stored pictures no user currently shows or is waiting for. Returns
+    the digests removed. Raises ImproperlyConfigured if the storage cannot
+    list its contents.
+    """
+    referenced = set(User.objects.exclude(profile_picture_hash='').values_list('profile_picture_hash', flat=True))
+    referenced |= set(User.objects.exclude(profile_picture_pending='').values_list('profile_picture_pending', flat=True))
+    removed = []
+    try:
+        if not default_storage.exists(ROOT):
+            return removed
+        prefixes = default_storage.listdir(ROOT)[0]
+    except NotImplementedError:
+        raise ImproperlyConfigured(f'{type(default_storage).__name__} cannot list files, so profile pictures cannot be pruned')
+    for prefix in prefixes:
+        for digest in default_storage.listdir(f'{ROOT}/{prefix}')[0]:
+            if digest in referenced:
+                continue
+            if dry_run:
+                removed.append(digest)
+            elif not is_referenced(digest):  # re-checked: the same picture may have been uploaded again meanwhile
+                _delete_tree(picture_dir(digest))
+                removed.append(digest)
+    return removed
@@ -0,0 +1,78 @@
+"""
+Referral links and statistics.
+
+A user's referrer is User.referred_by, set at registration from the referral
+code they entered or, failing that, from the accepted invitations sent to
+their email (invited_by()); backfill_referred_by applies the same rule to
+existing users. Deposit bonuses, commissions and the statistics below trust
+that indexed foreign key instead of matching invitation emails.
+
+referral_stats() computes the team size, the referees active in the last
+ACTIVE_DAYS days and the referral earnings (REFERRAL_BONUS_RATE of their
+confirmed deposits) as three scalar subqueries of one SELECT, so the cost does
+not grow with the number of invitees on the Python side. Deposits come from
+UserStats; referees without a stats row fall back to summing their confirmed
+deposits.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import DecimalField, F, Func, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .ledger import REFERRAL_BONUS_RATE
+from .models import Deposit, Invitation, User
+
+ACTIVE_DAYS = 30
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def invitations_to(email):
+    """
+    referrer_id values of the accepted invitations sent to email, earliest
+    first. Pending and rejected invitations never make a referral.
+    """
+    return (
+        Invitation.objects.filter(referee_email=email, status='accepted')
+        .order_by('created_at', 'id')
+        .values('referrer_id')
+    )
+
+
+def invited_by(email):
+    """Id of the user who invited email, or None."""
+    return invitations_to(email).values_list('referrer_id', flat=True).first()
+
+
+def _scalar(queryset, function, expression, output_field):
+    """Subquery yielding function(expression) over the whole queryset, without a GROUP BY."""
+    return Subquery(
+        queryset.order_by().annotate(value=Func(expression, function=function, output_field=output_field)).values('value')[:1],
+        output_field=output_field,
+    )
+
+
+def referral_stats(user_id):
+    """Returns {'team_size', 'active_members', 'referral_earnings'} for one referrer."""
+    referees = User.objects.filter(referred_by_id=OuterRef('pk'))
+    confirmed_deposits = Deposit.objects.filter(user_id=OuterRef('pk'), status='confirmed')
+    deposits = Coalesce(
+        F('stats__deposits_confirmed'),
+        _scalar(confirmed_deposits, 'SUM', F('amount'), MONEY),
+        Value(Decimal('0')),
+        output_field=MONEY,
+    )
+    row = User.objects.filter(pk=user_id).annotate(
+        team_size=_scalar(Invitation.objects.filter(referrer_id=OuterRef('pk')), 'COUNT', F('id'), IntegerField()),
+        active_members=_scalar(
+            referees.filter(last_login__gte=timezone.now() - timedelta(days=ACTIVE_DAYS)), 'COUNT', F('id'), IntegerField(),
+        ),
+        referee_deposits=_scalar(referees, 'SUM', deposits, MONEY),
+    ).values('team_size', 'active_members', 'referee_deposits').get()
+    return {
+        'team_size': row['team_size'] or 0,
+        'active_members': row['active_members'] or 0,
+        'referral_earnings': ((row['referee_deposits'] or Decimal('0')) * REFERRAL_BONUS_RATE).quantize(Decimal('0.01')),
+    }
@@ -0,0 +1,111 @@
+"""
+Indexed lookups for admin and support search.
+
+Searchable values are copied into normalized shadow columns when a row is
+saved (lowercased and trimmed; phone numbers reduced to their digits), see
+SEARCH_COLUMNS on the models and refresh_search_columns(). Each column has a
+prefix index (varchar_pattern_ops on PostgreSQL) and, on PostgreSQL, a pg_trgm
+GIN index created by migration 0011. Terms of MIN_SUBSTRING_LENGTH characters
+or more are matched anywhere in the value, which the trigram index serves;
+shorter terms only match as a prefix, which the btree index serves. SQLite runs
+the same predicates on the narrow shadow columns, so results do not depend on
+the database.
+
+Users are matched without joining: payment rows are filtered on user_id IN
+(matching users), which keeps each side on its own indexes.
+"""
+import re
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+MIN_SUBSTRING_LENGTH = 3  # pg_trgm cannot use its index for shorter patterns
+
+
+def normalize_text(value):
+    return (value or '').strip().lower()
+
+
+def normalize_phone(value):
+    return re.sub(r'\D', '', value or '')
+
+
+NORMALIZERS = {'text': normalize_text, 'phone': normalize_phone}
+
+
+def refresh_search_columns(instance, update_fields=None):
+    """
+    Recompute instance's shadow columns from their sources. Returns
+    update_fields with the columns of any updated source added (None, meaning
+    every field, is returned unchanged).
+    """
+    touched = []
+    for column, (source, kind) in instance.SEARCH_COLUMNS.items():
+        setattr(instance, column, NORMALIZERS[kind](getattr(instance, source)))
+        if update_fields is not None and source in update_fields:
+            touched.append(column)
+    if update_fields is None:
+        return None
+    return list(update_fields) + [column for column in touched if column not in update_fields]
+
+
+def rebuild_search_columns(model, columns=None, chunk_size=2000):
+    """
+    Recompute the shadow columns of every row of model in primary key chunks
+    (rows written with bulk_create or update() skip save()). columns defaults
+    to model.SEARCH_COLUMNS. Returns the number of rows rewritten.
+    """
+    columns = columns or model.SEARCH_COLUMNS
+    sources = [source for source, _ in columns.values()]
+    rewritten = 0
+    last_pk = None
+    while True:
+        rows = model.objects.order_by('pk')
+        if last_pk is not None:
+            rows = rows.filter(pk__gt=last_pk)
+        rows = list(rows.values_list('pk', *sources)[:chunk_size])
+        if not rows:
+            return rewritten
+        objects = []
+        for pk, *values in rows:
+            source_values = dict(zip(sources, values))
+            objects.append(model(pk=pk, **{
+                column: NORMALIZERS[kind](source_values[source]) for column, (source, kind) in columns.items()
+            }))
+        model.objects.bulk_update(objects, list(columns))
+        rewritten += len(objects)
+        last_pk = rows[-1][0]
+
+
+def _match(column, term):
+    lookup = 'contains' if len(term) >= MIN_SUBSTRING_LENGTH else 'startswith'
+    return Q(**{f'{column}__{lookup}': term})
+
+
+def user_filter(term):
+    """Q over User matching username, email, full name, phone digits or an exact referral code."""
+    text, digits = normalize_text(term), normalize_phone(term)
+    if not text:
+        return Q()
+    condition = (
+        _match('username_search', text) | _match('email_search', text)
+        | _match('full_name_search', text) | Q(referral_code=term.strip())
+    )
+    # Only look at phone numbers for terms made of digits and phone punctuation
+    if digits and re.fullmatch(r'[\d\s()+.-]+', term.strip()):
+        condition |= _match('phone_search', digits)
+    return condition
+
+
+def search_users(queryset, term):
+    condition = user_filter(term)
+    return queryset.filter(condition) if condition else queryset
+
+
+def search_payments(queryset, term):
+    """Deposits or withdrawals by wallet address or by their user's username/email/name/phone."""
+    condition = user_filter(term)
+    if not condition:
+        return queryset
+    users = get_user_model().objects.filter(condition).values('id')
+    return queryset.filter(_match('wallet_search', normalize_text(term)) | Q(user_id__in=users))
@@ -1,9 +1,10 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model, authenticate
 from django.utils import timezone
-from decimal import Decimal
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Task, Deposit, Withdrawal, Invitation, TermsAndConditions, UserProfile, Portfolio, SupportTicket, Product, Campaign
+from .pictures import variant_url
+from .referrals import invited_by
+from .models import Task, Deposit, Withdrawal, Invitation, TermsAndConditions, UserProfile, Portfolio, SupportTicket, Product, Campaign, LedgerEntry
 
 User = get_user_model()
 
@@ -33,6 +34,14 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({'email': 'Email already exists'})
         if User.objects.filter(username=data['username']).exists():
             raise serializers.ValidationError({'username': 'Username already exists'})
+        # referral_code is the referrer's code; the new user gets their own in User.save()
+        code = data.pop('referral_code', '')
+        if code:
+            data['referred_by_id'] = User.objects.filter(referral_code=code).values_list('id', flat=True).first()
+            if data['referred_by_id'] is None:
+                raise serializers.ValidationError({'referral_code': 'Invalid referral code'})
+        else:
+            data['referred_by_id'] = invited_by(data['email'])
         return data
 
     def create(self, validated_data):
@@ -42,11 +51,11 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             password=validated_data['password'],
             full_name=validated_data.get('full_name', ''),
             phone_number=validated_data.get('phone_number', ''),
-            referral_code=validated_data.get('referral_code', ''),
+            referred_by_id=validated_data['referred_by_id'],
             withdrawal_password=validated_data.get('withdrawal_password', ''),
-            balance=Decimal('10.00')  # $10 bonus
         )
         UserProfile.objects.create(user=user)
+        user.refresh_from_db(fields=['balance'])  # $10 bonus posted by the give_signup_bonus signal
         return user
 
     def to_representation(self, instance):
@@ -72,13 +81,22 @@ class UserLoginSerializer(serializers.Serializer):
 
 class UserSerializer(serializers.ModelSerializer):
     profile = UserProfileSerializer(read_only=True)
+    profile_picture_thumbnail = serializers.SerializerMethodField()
+    profile_picture_processing = serializers.SerializerMethodField()
 
     class Meta:
         model = User
         fields = ['username', 'email', 'full_name', 'phone_number', 'balance', 'vip_level',
                  'referral_code', 'date_joined', 'last_login', 'email_notifications',
-                 'sms_notifications', 'twofa_enabled', 'profile_picture', 'is_verified',
-                 'profile', 'withdrawal_password']
+                 'sms_notifications', 'twofa_enabled', 'profile_picture', 'profile_picture_thumbnail',
+                 'profile_picture_processing', 'is_verified', 'profile', 'withdrawal_password']
+        read_only_fields = ['profile_picture']
+
+    def get_profile_picture_thumbnail(self, obj):
+        return variant_url(obj.profile_picture_hash, 'thumbnail')
+
+    def get_profile_picture_processing(self, obj):
+        return bool(obj.profile_picture_pending)
 
     def update(self, instance, validated_data):
         withdrawal_password = validated_data.pop('withdrawal_password', None)
@@ -123,15 +141,32 @@ class ProductSerializer(serializers.ModelSerializer):
         representation['price'] = f"{instance.price:.2f}"
         return representation
 
+class TaskProductsField(serializers.Field):
+    """
+    Read-only list of a task's products. Uses payloads attached by
+    product_catalog.attach_to_tasks() when present (no per-task query),
+    otherwise falls back to task.products.
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, task):
+        payloads = getattr(task, '_product_payloads', None)
+        if payloads is None:
+            payloads = ProductSerializer(task.products.all(), many=True).data
+        return payloads
+
 class TaskSerializer(serializers.ModelSerializer):
-    products = ProductSerializer(many=True)
+    products = TaskProductsField()
 
     class Meta:
         model = Task
         fields = ['id', 'task_type', 'set_number', 'task_number', 'earnings', 'status', 'products']
         
 class CurrentTaskSerializer(serializers.ModelSerializer):
-    products = ProductSerializer(many=True)
+    products = TaskProductsField()
 
     class Meta:
         model = Task
@@ -242,6 +277,11 @@ class EnhancedTransactionHistorySerializer(serializers.Serializer):
     def update(self, instance, validated_data):
         raise NotImplementedError("TransactionHistorySerializer is read-only")
 
+class LedgerEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LedgerEntry
+        fields = ['id', 'entry_type', 'amount', 'balance_after', 'reference', 'created_at']
+
 class TransactionHistorySerializer(serializers.Serializer):
     deposits = DepositSerializer(many=True)
     withdrawals = WithdrawalSerializer(many=True)
@@ -0,0 +1,78 @@
+"""
+Batched withdrawal settlement.
+
+Used by complete_withdrawal, bulk_complete_withdrawals and the withdrawal admin
+actions. Each chunk of ids is settled in one transaction:
+1. lock the still-pending rows (SELECT ... FOR UPDATE SKIP LOCKED, so two
+   admins settling overlapping batches never block or double-settle),
+2. flip their status with one UPDATE,
+3. post the refunds to the ledger and apply the per-user UserStats moves with
+   one CASE UPDATE per table.
+
+The amount is already taken from the balance when the withdrawal is requested,
+so approving only changes the status; rejecting refunds it.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, When
+from django.utils import timezone
+
+from .caching import invalidate_dashboard
+from .ledger import post_entries
+from .models import UserStats, Withdrawal
+from .stats import rebuild_stats
+
+SETTLEMENT_ACTIONS = {'approve': 'completed', 'reject': 'rejected'}
+SETTLEMENT_CHUNK_SIZE = 1000
+
+
+def _add_per_user(model, field, deltas):
+    """UPDATE model SET field = field + CASE user_id ... END for every user in deltas. Returns rows updated."""
+    whens = [When(user_id=user_id, then=F(field) + amount) for user_id, amount in deltas.items()]
+    return model.objects.filter(user_id__in=list(deltas)).update(
+        **{field: Case(*whens, default=F(field), output_field=DecimalField(max_digits=14, decimal_places=2))}
+    )
+
+
+def _settle_chunk(withdrawal_ids, new_status):
+    with transaction.atomic():
+        rows = list(
+            Withdrawal.objects.select_for_update(skip_locked=True)
+            .filter(id__in=withdrawal_ids, status='pending')
+            .values_list('id', 'user_id', 'amount')
+        )
+        if not rows:
+            return 0
+        per_user = defaultdict(Decimal)
+        for _, user_id, amount in rows:
+            per_user[user_id] += amount
+
+        Withdrawal.objects.filter(id__in=[row[0] for row in rows]).update(status=new_status, processed_at=timezone.now())
+        if new_status == 'rejected':
+            post_entries('withdrawal_refund', [(user_id, amount, f'withdrawal:{pk}') for pk, user_id, amount in rows])
+
+        stats_rows = _add_per_user(UserStats, 'withdrawals_pending', {user_id: -amount for user_id, amount in per_user.items()})
+        if new_status == 'completed':
+            _add_per_user(UserStats, 'withdrawals_completed', per_user)
+        if stats_rows < len(per_user):
+            # Users without a stats row yet get one built from the (already updated) source tables
+            missing = set(per_user) - set(UserStats.objects.filter(user_id__in=list(per_user)).values_list('user_id', flat=True))
+            rebuild_stats(list(missing))
+        invalidate_dashboard(*per_user)
+    return len(rows)
+
+
+def settle_withdrawals(withdrawal_ids, action):
+    """
+    Approve or reject the pending withdrawals among withdrawal_ids.
+    Returns the number settled; rows already settled or locked by a
+    concurrent settlement are skipped.
+    """
+    new_status = SETTLEMENT_ACTIONS[action]
+    withdrawal_ids = list(withdrawal_ids)
+    settled = 0
+    for i in range(0, len(withdrawal_ids), SETTLEMENT_CHUNK_SIZE):
+        settled += _settle_chunk(withdrawal_ids[i:i + SETTLEMENT_CHUNK_SIZE], new_status)
+    return settled
@@ -1,21 +1,20 @@
 # Create this file: accounts/signals.py
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
-from django.db import transaction
-from decimal import Decimal
-from .models import User, Deposit
+from .models import User, Deposit, Product, Task, Withdrawal, Invitation, UserProfile, TermsAndConditions, Campaign
+from .caching import bump_content_version, invalidate_dashboard, invalidate_user
+from .ledger import SIGNUP_BONUS, post_entry
+from .stats import apply_stats_delta, move_withdrawal
+from .catalog import product_catalog
 
 @receiver(post_save, sender=User)
 def give_signup_bonus(sender, instance, created, **kwargs):
     """
     Give one-time $10 signup bonus to new users.
-    Only triggers on user creation and if bonus hasn't been received yet.
+    Only triggers on user creation; posted to the ledger like any other credit.
     """
-    if created and not getattr(instance, 'signup_bonus_received', False):
-        with transaction.atomic():
-            instance.balance += Decimal('10.00')
-            instance.signup_bonus_received = True
-            instance.save(update_fields=['balance', 'signup_bonus_received'])
+    if created:
+        post_entry(instance.pk, 'signup_bonus', SIGNUP_BONUS, reference='signup')
 
 @receiver(pre_save, sender=Deposit)
 def track_deposit_status_change(sender, instance, **kwargs):
@@ -35,28 +34,121 @@ def track_deposit_status_change(sender, instance, **kwargs):
 @receiver(post_save, sender=Deposit)
 def update_user_balance_on_deposit(sender, instance, created, **kwargs):
     """
-    Update user balance when:
-    1. New deposit is created with status='confirmed'
-    2. Existing deposit status changes from non-confirmed to 'confirmed'
-    
-    This prevents double-adding balance on repeated saves.
+    Credit the user when a deposit is created as or changes to 'confirmed',
+    and reverse the credit if a confirmed deposit is moved back out of it.
+    Repeated saves in the same status post nothing.
     """
-    if instance.status != 'confirmed':
-        return  # Only process confirmed deposits
+    old_status = None if created else getattr(instance, '_old_status', None)
+    was_confirmed = old_status == 'confirmed'
+    is_confirmed = instance.status == 'confirmed'
+    if is_confirmed and not was_confirmed:
+        post_entry(instance.user_id, 'deposit', instance.amount, reference=f'deposit:{instance.pk}')
+    elif was_confirmed and not is_confirmed:
+        post_entry(instance.user_id, 'deposit_reversal', -instance.amount, reference=f'deposit:{instance.pk}')
 
-    should_add_balance = False
-    
-    if created:
-        # New deposit created as confirmed
-        should_add_balance = True
-    else:
-        # Existing deposit - check if status just changed to confirmed
-        old_status = getattr(instance, '_old_status', None)
-        if old_status and old_status != 'confirmed':
-            should_add_balance = True
-    
-    if should_add_balance:
-        with transaction.atomic():
-            user = instance.user
-            user.balance += instance.amount
-            user.save(update_fields=['balance'])
\ No newline at end of file
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_catalog(sender, instance, **kwargs):
+    """
+    Reload the in-process product catalog after any product change
+    (ProductAdmin, create_products/create_mockup_products commands, shell).
+    """
+    product_catalog.invalidate()
+
+
+@receiver(post_save, sender=TermsAndConditions)
+@receiver(post_delete, sender=TermsAndConditions)
+def invalidate_cached_terms(sender, instance, **kwargs):
+    bump_content_version('terms')
+
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+def invalidate_cached_campaigns(sender, instance, **kwargs):
+    bump_content_version('campaigns')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserProfile)
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=Deposit)
+@receiver(post_save, sender=Withdrawal)
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=Deposit)
+@receiver(post_delete, sender=Withdrawal)
+def invalidate_user_dashboard(sender, instance, **kwargs):
+    """Drop the cached dashboard of the user a saved row belongs to."""
+    invalidate_dashboard(instance.pk if sender is User else instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Cached authentication rows of this user are refused after the save commits."""
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Invitation)
+@receiver(post_delete, sender=Invitation)
+def invalidate_referrer_dashboard(sender, instance, **kwargs):
+    """Team size on the referrer's dashboard counts invitations."""
+    invalidate_dashboard(instance.referrer_id)
+
+
+@receiver(post_save, sender=Deposit)
+def track_deposit_stats(sender, instance, created, **kwargs):
+    """Keep UserStats.deposits_confirmed in step with deposits entering or leaving 'confirmed'."""
+    old_status = None if created else getattr(instance, '_old_status', None)
+    was_confirmed = old_status == 'confirmed'
+    is_confirmed = instance.status == 'confirmed'
+    if is_confirmed != was_confirmed:
+        apply_stats_delta(instance.user_id, deposits_confirmed=instance.amount if is_confirmed else -instance.amount)
+
+@receiver(post_delete, sender=Deposit)
+def untrack_deleted_deposit(sender, instance, **kwargs):
+    if instance.status == 'confirmed':
+        apply_stats_delta(instance.user_id, build_missing=False, deposits_confirmed=-instance.amount)
+
+@receiver(pre_save, sender=Withdrawal)
+def track_withdrawal_status_change(sender, instance, **kwargs):
+    """Capture the previous status so post_save can move the amount between UserStats buckets."""
+    instance._old_status = None
+    if instance.pk:
+        instance._old_status = Withdrawal.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+@receiver(post_save, sender=Withdrawal)
+def track_withdrawal_stats(sender, instance, created, **kwargs):
+    old_status = None if created else getattr(instance, '_old_status', None)
+    if old_status != instance.status:
+        move_withdrawal(instance.user_id, instance.amount, old_status, instance.status)
+
+@receiver(post_delete, sender=Withdrawal)
+def untrack_deleted_withdrawal(sender, instance, **kwargs):
+    move_withdrawal(instance.user_id, instance.amount, instance.status, None, build_missing=False)
+
+@receiver(pre_save, sender=Task)
+def track_task_status_change(sender, instance, **kwargs):
+    """Capture the previous status and earnings so post_save can correct the task totals."""
+    instance._old_state = None
+    if instance.pk:
+        instance._old_state = Task.objects.filter(pk=instance.pk).values_list('status', 'earnings').first()
+
+@receiver(post_save, sender=Task)
+def track_task_stats(sender, instance, created, **kwargs):
+    """
+    Tasks completed, reopened or re-priced through save() (the admin, the shell).
+    submit_task completes tasks with an UPDATE and records its own delta.
+    """
+    old_status, old_earnings = (None if created else getattr(instance, '_old_state', None)) or (None, 0)
+    was_completed = old_status == 'completed'
+    is_completed = instance.status == 'completed'
+    apply_stats_delta(
+        instance.user_id,
+        task_earnings=(instance.earnings if is_completed else 0) - (old_earnings if was_completed else 0),
+        tasks_completed=int(is_completed) - int(was_completed),
+    )
+
+@receiver(post_delete, sender=Task)
+def untrack_deleted_task(sender, instance, **kwargs):
+    if instance.status == 'completed':
+        apply_stats_delta(instance.user_id, build_missing=False, task_earnings=-instance.earnings, tasks_completed=-1)
@@ -0,0 +1,106 @@
+"""
+Maintenance of the denormalized UserStats totals.
+
+Writers call apply_stats_delta() in the same transaction as the change they
+record, and the signals in signals.py cover rows saved or deleted elsewhere
+(the admin, the shell); readers call get_stats(). Rows missing for users that predate the table
+are computed from the source tables on first read (or in bulk by
+`manage.py rebuild_user_stats`).
+"""
+from decimal import Decimal
+
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import Deposit, Task, UserStats, Withdrawal
+
+STAT_FIELDS = ['task_earnings', 'tasks_completed', 'deposits_confirmed', 'withdrawals_completed', 'withdrawals_pending']
+
+# Withdrawal status -> UserStats column holding its amount ('rejected' is not counted)
+WITHDRAWAL_BUCKETS = {
+    'pending': 'withdrawals_pending',
+    'completed': 'withdrawals_completed',
+}
+
+
+def compute_stats(user_ids):
+    """Compute totals from the source tables for the given users. Returns {user_id: {field: value}}."""
+    totals = {user_id: {field: 0 for field in STAT_FIELDS} for user_id in user_ids}
+    task_rows = (
+        Task.objects.filter(user_id__in=user_ids, status='completed')
+        .values('user_id').annotate(earnings=Sum('earnings'), count=Count('id'))
+    )
+    for row in task_rows:
+        totals[row['user_id']].update(task_earnings=row['earnings'], tasks_completed=row['count'])
+    deposit_rows = (
+        Deposit.objects.filter(user_id__in=user_ids, status='confirmed')
+        .values('user_id').annotate(total=Sum('amount'))
+    )
+    for row in deposit_rows:
+        totals[row['user_id']]['deposits_confirmed'] = row['total']
+    withdrawal_rows = (
+        Withdrawal.objects.filter(user_id__in=user_ids)
+        .values('user_id').annotate(
+            completed=Sum('amount', filter=Q(status='completed')),
+            pending=Sum('amount', filter=Q(status='pending')),
+        )
+    )
+    for row in withdrawal_rows:
+        totals[row['user_id']].update(
+            withdrawals_completed=row['completed'] or 0,
+            withdrawals_pending=row['pending'] or 0,
+        )
+    return totals
+
+
+def rebuild_stats(user_ids):
+    """Recompute and upsert the UserStats rows of the given users."""
+    totals = compute_stats(user_ids)
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user_id, **values) for user_id, values in totals.items()],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=STAT_FIELDS + ['updated_at'],
+    )
+
+
+def get_stats(user_id):
+    """Return the user's UserStats row, building it from source tables if it is missing."""
+    try:
+        return UserStats.objects.get(user_id=user_id)
+    except UserStats.DoesNotExist:
+        rebuild_stats([user_id])
+        return UserStats.objects.get(user_id=user_id)
+
+
+def apply_stats_delta(user_id, build_missing=True, **deltas):
+    """
+    Add deltas to the user's totals with a single F() UPDATE, e.g.
+    apply_stats_delta(user.pk, task_earnings=task.earnings, tasks_completed=1).
+    Delete paths pass build_missing=False: the row may be gone because the
+    user itself is being deleted.
+    """
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if not updates:
+        return
+    updated = UserStats.objects.filter(user_id=user_id).update(**updates, updated_at=timezone.now())
+    if not updated and build_missing:
+        # First write for this user: the new row is built from the source
+        # tables, which already include the change being recorded.
+        get_stats(user_id)
+
+
+def move_withdrawal(user_id, amount, old_status, new_status, build_missing=True):
+    """Move a withdrawal's amount between the pending/completed buckets."""
+    deltas = {}
+    if old_status in WITHDRAWAL_BUCKETS:
+        deltas[WITHDRAWAL_BUCKETS[old_status]] = -Decimal(amount)
+    if new_status in WITHDRAWAL_BUCKETS:
+        field = WITHDRAWAL_BUCKETS[new_status]
+        deltas[field] = deltas.get(field, 0) + Decimal(amount)
+    apply_stats_delta(user_id, build_missing=build_missing, **deltas)
+
+
+def reset_task_stats(user_id):
+    """Clear task totals after a user's tasks are deleted (reset_account)."""
+    UserStats.objects.filter(user_id=user_id).update(task_earnings=0, tasks_completed=0, updated_at=timezone.now())
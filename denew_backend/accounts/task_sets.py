@@ -0,0 +1,122 @@
+"""
+Task set generation.
+
+A set holds TASKS_PER_SET tasks. With TASK_SET_PREGENERATE enabled the whole set
+is written up front by start_task_set: one bulk insert into accounts_task and one
+into the Task.products through-table. Task 1 starts as 'pending' and the rest as
+'queued'; submit_task releases the next queued task instead of building a new one.
+Sets started before pre-generation existed fall back to create_next_task().
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, F, Q
+from django.utils import timezone
+
+from .catalog import product_catalog
+from .ledger import post_entry
+from .models import Task
+from .stats import apply_stats_delta
+
+TASKS_PER_SET = 40
+
+EARNINGS_RATES = {
+    'VIP 0': Decimal('0.005'),
+    'VIP 1': Decimal('0.005'),
+    'VIP 2': Decimal('0.01'),
+    'VIP 3': Decimal('0.015'),
+    'VIP 4': Decimal('0.02'),
+}
+
+
+def pregenerate_enabled():
+    return getattr(settings, 'TASK_SET_PREGENERATE', True)
+
+
+def task_plan(user):
+    """Return (task_type, earnings, product_count) for the user's next task."""
+    task_type = 'combined' if user.balance > 500 else 'normal'
+    earnings = user.balance * EARNINGS_RATES.get(user.vip_level, Decimal('0.005')) * (5 if task_type == 'combined' else 1)
+    return task_type, earnings, 4 if task_type == 'combined' else 1
+
+
+def _attach_products(tasks, product_count):
+    through = Task.products.through
+    through.objects.bulk_create([
+        through(task_id=task.id, product_id=product_id)
+        for task in tasks
+        for product_id in product_catalog.sample_ids(product_count)
+    ])
+
+
+def generate_task_set(user, set_number):
+    """Create every task of a set with one insert per table. Returns the tasks."""
+    task_type, earnings, product_count = task_plan(user)
+    with transaction.atomic():
+        tasks = Task.objects.bulk_create([
+            Task(
+                user=user,
+                task_type=task_type,
+                set_number=set_number,
+                task_number=task_number,
+                earnings=earnings,
+                status='pending' if task_number == 1 else 'queued',
+            )
+            for task_number in range(1, TASKS_PER_SET + 1)
+        ])
+        _attach_products(tasks, product_count)
+    return tasks
+
+
+def create_next_task(user, set_number, task_number):
+    """Create a single pending task (sets that were not pre-generated)."""
+    task_type, earnings, product_count = task_plan(user)
+    task = Task.objects.create(
+        user=user,
+        task_type=task_type,
+        set_number=set_number,
+        task_number=task_number,
+        earnings=earnings,
+        status='pending'
+    )
+    task.products.set(product_catalog.sample_ids(product_count))
+    return task
+
+
+def release_next_task(user, set_number, task_number):
+    """
+    Flip the queued task to pending with a single UPDATE. created_at restarts
+    the 2-hour window so it runs from release, not from set start.
+    Returns True if a queued task was released.
+    """
+    return Task.objects.filter(
+        user=user, set_number=set_number, task_number=task_number, status='queued'
+    ).update(status='pending', created_at=timezone.now()) > 0
+
+
+def complete_task(user, task):
+    """
+    Complete an in-progress task and credit the user in one short transaction.
+
+    The task row is flipped with a conditional UPDATE (status='in-progress'), so
+    of several concurrent submits exactly one wins and the others see 0 rows.
+    The earnings are posted to the ledger, whose F() UPDATE of the user row also
+    carries the counters, so there is no read-modify-write race and no full-row save.
+    Returns False if the task was no longer in progress.
+    """
+    set_complete = ExpressionWrapper(Q(tasks_completed__gte=TASKS_PER_SET - 1), output_field=BooleanField())
+    with transaction.atomic():
+        completed = Task.objects.filter(pk=task.pk, status='in-progress').update(
+            status='completed', completed_at=timezone.now()
+        )
+        if not completed:
+            return False
+        post_entry(
+            user.pk, 'task_earning', task.earnings, reference=f'task:{task.pk}',
+            tasks_completed=F('tasks_completed') + 1,
+            can_invite=set_complete,
+            tasks_reset_required=set_complete,
+        )
+        apply_stats_delta(user.pk, task_earnings=task.earnings, tasks_completed=1)
+    return True
@@ -1,3 +1,938 @@
-from django.test import TestCase
+import csv
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from smtplib import SMTPException
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.files.storage import Storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from denew_backend.middleware import AdmissionControlMiddleware, admission_counters
+
+from .authentication import user_rows
+from .caching import dashboard_cache_key
+from .catalog import product_catalog
+from .ledger import InsufficientFunds, balance_at, current_balance, post_entries, post_entry, set_balance
+from .models import (
+    Deposit, EmailOutbox, Invitation, JobWatermark, LedgerEntry, Product, Task, User, UserStats, VerificationCode, Withdrawal,
+)
+from .outbox import drain, enqueue_email
+from . import pictures
+from .pictures import picture_dir, prune, variant_path
+from .reconciliation import reconcile_range
+from .search import search_payments, search_users
+from .settlement import settle_withdrawals
+from .stats import STAT_FIELDS, get_stats, rebuild_stats
+from .task_sets import complete_task, generate_task_set
+from .verification import INVALID, LOCKED, MISSING, VERIFIED, DatabaseCodeStore
+
+
+class ListTasksQueryCountTests(TestCase):
+    def setUp(self):
+        Product.objects.bulk_create([
+            Product(name=f'Product {i}', price=Decimal('10.00') + i) for i in range(8)
+        ])
+        product_catalog.invalidate()
+        self.user = User.objects.create_user(username='tasker', email='tasker@example.com', password='secret123')
+        User.objects.filter(pk=self.user.pk).update(balance=Decimal('1000.00'), current_set=1)
+        self.user.refresh_from_db()
+        generate_task_set(self.user, 1)
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+        product_catalog.snapshot()  # warm the per-process catalog
+
+    def list_tasks_queries(self, visible):
+        Task.objects.filter(user=self.user).update(status='queued')
+        Task.objects.filter(user=self.user, task_number__lte=visible).update(status='completed')
+        with self.assertNumQueries(2):  # the page of tasks + their product ids
+            response = self.client.get('/api/tasks/', {'page_size': 50})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_query_count_is_independent_of_task_count(self):
+        self.assertEqual(len(self.list_tasks_queries(1)), 1)
+        tasks = self.list_tasks_queries(40)
+        self.assertEqual(len(tasks), 40)
+        self.assertTrue(all(len(task['products']) == 4 for task in tasks))
+
+    def test_products_match_the_database(self):
+        task = self.list_tasks_queries(1)[0]
+        expected = set(Task.objects.get(pk=task['id']).products.values_list('id', flat=True))
+        self.assertEqual({product['id'] for product in task['products']}, expected)
+
+
+class TaskCompletionTests(TestCase):
+    def setUp(self):
+        Product.objects.bulk_create([Product(name=f'Product {i}', price=Decimal('10.00') + i) for i in range(4)])
+        with self.captureOnCommitCallbacks(execute=True):
+            product_catalog.invalidate()  # also drop payloads other tests left in the shared cache
+        self.user = User.objects.create_user(username='worker', email='worker@example.com', password='secret123')
+        User.objects.filter(pk=self.user.pk).update(current_set=1, tasks_completed=39)
+        self.user.refresh_from_db()
+        generate_task_set(self.user, 1)
+        Task.objects.filter(user=self.user, task_number__lt=40).update(status='completed')
+        self.task = Task.objects.get(user=self.user, task_number=40)
+        Task.objects.filter(pk=self.task.pk).update(status='in-progress')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def test_registration_credits_the_bonus_once(self):
+        response = APIClient(SERVER_NAME='localhost').post('/api/register/', {
+            'username': 'newcomer', 'email': 'newcomer@example.com', 'password': 'secret123', 'withdrawal_password': '1234',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['balance'], '10.00')
+        user = User.objects.get(username='newcomer')
+        self.assertEqual(user.balance, Decimal('10.00'))
+        self.assertEqual(list(user.ledger_entries.values_list('entry_type', 'amount')), [('signup_bonus', Decimal('10.00'))])
+
+    def test_duplicate_submit_credits_once(self):
+        def racing(user, task):
+            self.assertTrue(complete_task(user, task))  # a concurrent submit of the same task got there first
+            return complete_task(user, task)
+
+        with patch('denew_backend.accounts.views.complete_task', side_effect=racing):
+            response = self.client.post('/api/tasks/complete/', {'task_id': self.task.pk}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.post('/api/tasks/complete/', {'task_id': self.task.pk}, format='json').status_code, 404)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('10.00') + self.task.earnings)
+        self.assertEqual(LedgerEntry.objects.filter(reference=f'task:{self.task.pk}').count(), 1)
+        self.assertEqual((self.user.tasks_completed, self.user.tasks_reset_required, self.user.can_invite), (40, True, True))
+
+    def test_set_is_not_complete_before_task_40(self):
+        User.objects.filter(pk=self.user.pk).update(tasks_completed=38)
+        response = self.client.post('/api/tasks/complete/', {'task_id': self.task.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.tasks_completed, self.user.tasks_reset_required), (39, False))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')  # no collectstatic manifest in tests
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='dash', email='dash@example.com', password='secret123')
+        cache.delete(dashboard_cache_key(self.user.pk))  # ids are reused across tests
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def test_recent_activity_keeps_each_kind(self):
+        now = timezone.now()
+        Deposit.objects.bulk_create([Deposit(user=self.user, amount=Decimal('20.00'), wallet_address='w', status='confirmed')])
+        Withdrawal.objects.bulk_create([Withdrawal(user=self.user, amount=Decimal('5.00'), wallet_address='w', status='pending')])
+        Deposit.objects.update(created_at=now - timedelta(days=2))
+        Withdrawal.objects.update(created_at=now - timedelta(days=1))
+        Task.objects.bulk_create([
+            Task(user=self.user, task_number=i + 1, status='completed', earnings=Decimal('1.00'), completed_at=now - timedelta(minutes=i))
+            for i in range(6)
+        ])
+        response = self.client.get('/api/dashboard/')
+        self.assertEqual(
+            [activity['type'] for activity in response.data['recent_activities']], ['task', 'task', 'task', 'withdrawal', 'deposit'],
+        )
+
+    def test_admin_verification_refreshes_the_cached_dashboard(self):
+        self.assertFalse(self.client.get('/api/dashboard/').data['user']['is_verified'])
+        admin = Client(SERVER_NAME='localhost')
+        admin.force_login(User.objects.create_superuser(username='verifier', email='verifier@example.com', password='secret123'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = admin.post('/admin/accounts/user/', {'action': 'make_verified', '_selected_action': [self.user.pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(self.client.get('/api/dashboard/').data['user']['is_verified'])
+
+
+class UserStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='counted', email='counted@example.com', password='secret123')
+
+    def totals(self):
+        return UserStats.objects.filter(user=self.user).values(*STAT_FIELDS).get()
+
+    def test_missing_row_is_built_and_drift_is_rebuilt(self):
+        Task.objects.bulk_create([Task(user=self.user, task_number=i + 1, status='completed', earnings=Decimal('1.50')) for i in range(2)])
+        Deposit.objects.bulk_create([Deposit(user=self.user, amount=Decimal('40.00'), wallet_address='w', status='confirmed')])
+        Withdrawal.objects.bulk_create([
+            Withdrawal(user=self.user, amount=Decimal('5.00'), wallet_address='w', status='pending'),
+            Withdrawal(user=self.user, amount=Decimal('7.00'), wallet_address='w', status='completed'),
+        ])
+        expected = {
+            'task_earnings': Decimal('3.00'), 'tasks_completed': 2, 'deposits_confirmed': Decimal('40.00'),
+            'withdrawals_completed': Decimal('7.00'), 'withdrawals_pending': Decimal('5.00'),
+        }
+        UserStats.objects.filter(user=self.user).delete()
+        stats = get_stats(self.user.pk)
+        self.assertEqual({field: getattr(stats, field) for field in STAT_FIELDS}, expected)
+
+        UserStats.objects.filter(user=self.user).update(task_earnings=99, tasks_completed=99, withdrawals_pending=0)
+        rebuild_stats([self.user.pk])
+        self.assertEqual(self.totals(), expected)
+
+    def test_saved_and_deleted_rows_move_the_totals(self):
+        task = Task.objects.create(user=self.user, task_number=1, status='pending', earnings=Decimal('2.00'))
+        get_stats(self.user.pk)
+        task.status = 'completed'  # e.g. marked completed in the admin
+        task.save()
+        self.assertEqual((self.totals()['task_earnings'], self.totals()['tasks_completed']), (Decimal('2.00'), 1))
+        task.earnings = Decimal('3.00')
+        task.save()
+        self.assertEqual((self.totals()['task_earnings'], self.totals()['tasks_completed']), (Decimal('3.00'), 1))
+        task.delete()
+        self.assertEqual((self.totals()['task_earnings'], self.totals()['tasks_completed']), (Decimal('0.00'), 0))
+
+        deposit = Deposit.objects.create(user=self.user, amount=Decimal('25.00'), wallet_address='w', status='pending')
+        deposit.status = 'confirmed'
+        deposit.save()
+        self.assertEqual(self.totals()['deposits_confirmed'], Decimal('25.00'))
+        deposit.delete()
+        self.assertEqual(self.totals()['deposits_confirmed'], Decimal('0.00'))
+
+        withdrawal = Withdrawal.objects.create(user=self.user, amount=Decimal('4.00'), wallet_address='w')
+        self.assertEqual(self.totals()['withdrawals_pending'], Decimal('4.00'))
+        withdrawal.status = 'completed'
+        withdrawal.save()
+        self.assertEqual((self.totals()['withdrawals_pending'], self.totals()['withdrawals_completed']), (Decimal('0.00'), Decimal('4.00')))
+
+
+@skipUnless(importlib.util.find_spec('django_cron'), 'django_cron is not installed')
+class CommissionJobTests(TestCase):
+    def setUp(self):
+        from .cron import CalculateCommissions
+
+        self.job = CalculateCommissions()
+        self.now = timezone.now()
+        self.referrer = User.objects.create_user(username='upline', email='upline@example.com', password='secret123')
+        referee = User.objects.create_user(username='downline', email='downline@example.com', password='secret123', referred_by=self.referrer)
+        Task.objects.bulk_create([
+            Task(user=referee, task_number=i + 1, status='completed', earnings=earnings, completed_at=self.now - ago)
+            for i, (earnings, ago) in enumerate([
+                (Decimal('10.00'), timedelta(hours=2)),
+                (Decimal('5.00'), timedelta(minutes=30)),
+                (Decimal('20.00'), timedelta(minutes=2)),  # inside SETTLE_LAG
+            ])
+        ])
+        JobWatermark.objects.create(code=self.job.code, value=self.now - timedelta(hours=3))
+
+    def run_at(self, moment):
+        with patch('denew_backend.accounts.cron.timezone.now', return_value=moment):
+            self.job.do()
+        self.referrer.refresh_from_db(fields=['balance'])
+        return self.referrer.balance
+
+    def test_windows_are_paid_once_and_lagging_tasks_later(self):
+        self.assertEqual(self.run_at(self.now), Decimal('13.00'))  # $10 signup + 20% of 15.00
+        self.assertEqual(JobWatermark.objects.get(code=self.job.code).value, self.now - self.job.SETTLE_LAG)
+        self.assertEqual(self.run_at(self.now), Decimal('13.00'))
+        self.assertEqual(self.run_at(self.now + timedelta(minutes=10)), Decimal('17.00'))  # the deferred task
+        self.assertEqual(self.run_at(self.now + timedelta(minutes=20)), Decimal('17.00'))
+        self.assertEqual(sum(self.referrer.ledger_entries.filter(entry_type='commission').values_list('amount', flat=True)), Decimal('7.00'))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')  # no collectstatic manifest in tests
+class SettlementTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='payee', email='payee@example.com', password='secret123')
+        post_entry(self.user.pk, 'deposit', Decimal('90.00'))  # balance 100.00 with the signup bonus
+        self.admin = User.objects.create_superuser(username='settler', email='settler@example.com', password='secret123')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.admin)
+
+    def withdraw(self, amount):
+        """A requested withdrawal: the amount leaves the balance when it is created (request_withdrawal)."""
+        withdrawal = Withdrawal.objects.create(user=self.user, amount=Decimal(amount), wallet_address='w')
+        post_entry(self.user.pk, 'withdrawal', -withdrawal.amount, reference=f'withdrawal:{withdrawal.pk}', require_funds=True)
+        return withdrawal
+
+    def state(self):
+        self.user.refresh_from_db(fields=['balance'])
+        stats = UserStats.objects.get(user=self.user)
+        refunds = self.user.ledger_entries.filter(entry_type='withdrawal_refund').count()
+        return self.user.balance, stats.withdrawals_pending, stats.withdrawals_completed, refunds
+
+    def complete(self, withdrawal, action):
+        return self.client.post(f'/api/withdrawals/{withdrawal.pk}/complete/', {'action': action}, format='json')
+
+    def test_approve_does_not_deduct_again(self):
+        withdrawal = self.withdraw('30.00')
+        self.assertEqual(self.complete(withdrawal, 'approve').status_code, 200)
+        self.assertEqual(self.state(), (Decimal('70.00'), Decimal('0.00'), Decimal('30.00'), 0))
+        withdrawal.refresh_from_db()
+        self.assertEqual(withdrawal.status, 'completed')
+        self.assertIsNotNone(withdrawal.processed_at)
+
+    def test_reject_refunds_once(self):
+        withdrawal = self.withdraw('30.00')
+        self.assertEqual(self.complete(withdrawal, 'reject').status_code, 200)
+        self.assertEqual(self.state(), (Decimal('100.00'), Decimal('0.00'), Decimal('0.00'), 1))
+
+    def test_settled_withdrawals_do_not_move_money_again(self):
+        withdrawal = self.withdraw('30.00')
+        self.assertEqual(settle_withdrawals([withdrawal.pk], 'reject'), 1)
+        settled = self.state()
+        self.assertEqual(settle_withdrawals([withdrawal.pk], 'reject'), 0)
+        self.assertEqual(settle_withdrawals([withdrawal.pk], 'approve'), 0)
+        self.assertEqual(self.complete(withdrawal, 'approve').status_code, 400)
+        self.assertEqual(self.state(), settled)
+
+        # Two admins settling the same pending withdrawal: the second gets 409
+        racing = self.withdraw('20.00')
+
+        def settle_twice(ids, action):
+            self.assertEqual(settle_withdrawals(ids, action), 1)
+            return settle_withdrawals(ids, action)
+
+        with patch('denew_backend.accounts.views.settle_withdrawals', side_effect=settle_twice):
+            self.assertEqual(self.complete(racing, 'reject').status_code, 409)
+        self.assertEqual(self.state(), (settled[0], Decimal('0.00'), Decimal('0.00'), 2))
+
+    def test_bulk_endpoint_and_admin_actions(self):
+        first, second, third, fourth = (self.withdraw('10.00') for _ in range(4))
+        response = self.client.post('/api/withdrawals/bulk-complete/', {'withdrawal_ids': [first.pk, second.pk], 'action': 'reject'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.state(), (Decimal('80.00'), Decimal('20.00'), Decimal('0.00'), 2))
+        response = self.client.post('/api/withdrawals/bulk-complete/', {'withdrawal_ids': [first.pk], 'action': 'approve'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+        admin = Client(SERVER_NAME='localhost')
+        admin.force_login(self.admin)
+        for action, withdrawal in [('approve_withdrawals', third), ('reject_withdrawals', fourth), ('reject_withdrawals', third)]:
+            response = admin.post('/admin/accounts/withdrawal/', {'action': action, '_selected_action': [withdrawal.pk]})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.state(), (Decimal('90.00'), Decimal('0.00'), Decimal('10.00'), 3))
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='holder', email='holder@example.com', password='secret123', withdrawal_password='1234')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='secret123')
+
+    def balance(self, user=None):
+        return User.objects.filter(pk=(user or self.user).pk).values_list('balance', flat=True).get()
+
+    def test_post_entry_moves_balance_and_records_it(self):
+        entry = post_entry(self.user.pk, 'task_earning', '2.50', reference='task:1', tasks_completed=F('tasks_completed') + 1)
+        self.assertEqual((entry.amount, entry.balance_after, entry.reference), (Decimal('2.50'), Decimal('12.50'), 'task:1'))
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.balance, self.user.tasks_completed), (Decimal('12.50'), 1))
+        self.assertEqual(current_balance(self.user.pk), Decimal('12.50'))
+        with self.assertRaises(User.DoesNotExist):
+            post_entry(0, 'adjustment', 1)
+
+    def test_require_funds_refuses_overdrafts(self):
+        with self.assertRaises(InsufficientFunds):
+            post_entry(self.user.pk, 'withdrawal', '-10.01', require_funds=True)
+        self.assertEqual((self.balance(), self.user.ledger_entries.count()), (Decimal('10.00'), 1))
+        post_entry(self.user.pk, 'withdrawal', '-10.00', require_funds=True)
+        self.assertEqual(self.balance(), Decimal('0.00'))
+
+    def test_concurrent_withdrawals_cannot_overdraw(self):
+        post_entry(self.user.pk, 'deposit', '90.00')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.user.refresh_from_db()
+        self.client.force_authenticate(self.user)  # both requests see the balance before either debit
+        request = {'amount': '70.00', 'wallet_address': 'w', 'withdrawal_password': '1234'}
+        self.assertEqual(self.client.post('/api/withdrawal/', request, format='json').status_code, 201)
+        response = self.client.post('/api/withdrawal/', request, format='json')
+        self.assertEqual((response.status_code, response.data['error']), (400, 'Insufficient balance'))
+        self.assertEqual(self.balance(), Decimal('30.00'))
+        self.assertEqual(Withdrawal.objects.filter(user=self.user).count(), 1)  # rolled back with the refused debit
+
+    def test_post_entries_keeps_running_balances(self):
+        entries = post_entries('commission', [(self.user.pk, '1.00', 'a'), (self.other.pk, '5.00', 'b'), (self.user.pk, '2.00', 'c'), (0, '9.00', 'gone')])
+        self.assertEqual([(e.user_id, e.balance_after) for e in entries], [
+            (self.user.pk, Decimal('11.00')), (self.other.pk, Decimal('15.00')), (self.user.pk, Decimal('13.00')),
+        ])
+        self.assertEqual((self.balance(), self.balance(self.other)), (Decimal('13.00'), Decimal('15.00')))
+        self.assertEqual(post_entries('commission', []), [])
+
+    def test_set_balance_and_balance_at(self):
+        signup = self.user.ledger_entries.get()
+        entry = set_balance(self.user.pk, '4.00', reference='admin:test')
+        self.assertEqual((entry.entry_type, entry.amount, entry.balance_after), ('adjustment', Decimal('-6.00'), Decimal('4.00')))
+        LedgerEntry.objects.filter(pk=entry.pk).update(created_at=signup.created_at + timedelta(hours=1))
+        self.assertIsNone(balance_at(self.user.pk, signup.created_at - timedelta(seconds=1)))
+        self.assertEqual(balance_at(self.user.pk, signup.created_at + timedelta(minutes=30)), Decimal('10.00'))
+        self.assertEqual(balance_at(self.user.pk, signup.created_at + timedelta(hours=2)), Decimal('4.00'))
+
+    def test_deposit_confirmation_and_reversal_are_posted(self):
+        deposit = Deposit.objects.create(user=self.user, amount=Decimal('25.00'), wallet_address='w', status='pending')
+        self.assertEqual(self.balance(), Decimal('10.00'))
+        deposit.status = 'confirmed'
+        deposit.save()
+        deposit.save()  # saving again in the same status posts nothing
+        deposit.status = 'rejected'
+        deposit.save()
+        self.assertEqual(
+            list(self.user.ledger_entries.order_by('id').values_list('entry_type', 'amount')),
+            [('signup_bonus', Decimal('10.00')), ('deposit', Decimal('25.00')), ('deposit_reversal', Decimal('-25.00'))],
+        )
+        self.assertEqual(self.balance(), Decimal('10.00'))
+
+    def test_full_save_refuses_balance_changes(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.balance = Decimal('500.00')
+        with self.assertRaises(ValueError):
+            user.save()
+        user.balance = Decimal('10.00')
+        user.full_name = 'Saved'
+        user.save()
+        post_entry(self.user.pk, 'deposit', '5.00')
+        user.refresh_from_db(fields=['balance'])
+        user.save()  # a balance read back from the database is not a change
+        self.assertEqual((self.balance(), User.objects.get(pk=user.pk).full_name), (Decimal('15.00'), 'Saved'))
+
+    def test_ledger_endpoint_reports_the_newest_balance(self):
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(self.user)  # a user row from before the credit below
+        post_entry(self.user.pk, 'deposit', '5.00')
+        response = client.get('/api/transactions/ledger/')
+        self.assertEqual((response.data['balance'], len(response.data['entries'])), ('15.00', 2))
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        user_rows.clear()
+        self.user = User.objects.create_user(username='poller', email='poller@example.com', password='secret123')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def test_ledger_posting_invalidates_the_cached_user(self):
+        self.assertEqual(self.client.get('/api/profile/').data['user']['balance'], '10.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            post_entry(self.user.pk, 'deposit', '5.00')
+        self.assertEqual(self.client.get('/api/profile/').data['user']['balance'], '15.00')
+
+    def test_balance_etag_follows_the_database_not_the_cached_user(self):
+        response = self.client.get('/api/balance/')
+        etag = response['ETag']
+        self.assertEqual(response.data['balance'], '10.00')
+        self.assertEqual(self.client.get('/api/balance/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        User.objects.filter(pk=self.user.pk).update(balance=Decimal('12.00'))  # no invalidation: the row stays cached
+        response = self.client.get('/api/balance/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data['balance']), (200, '12.00'))
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ReconciliationTests(TestCase):
+    def legacy_user(self, username, balance, **fields):
+        """A user from before the ledger: no entries, balance written directly."""
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='secret123', **fields)
+        LedgerEntry.objects.filter(user=user).delete()
+        User.objects.filter(pk=user.pk).update(balance=Decimal(balance))
+        return user
+
+    def test_ledger_and_legacy_users(self):
+        matching = self.legacy_user('legacy_ok', '50.00')
+        Deposit.objects.bulk_create([Deposit(user=matching, amount=Decimal('40.00'), wallet_address='w', status='confirmed')])
+        drifted = self.legacy_user('legacy_off', '99.00')
+        referrer = self.legacy_user('legacy_referrer', '75.00')  # earned unrecorded commissions
+        self.legacy_user('legacy_referee', '10.00', referred_by=referrer)
+        on_ledger = User.objects.create_user(username='ledger_ok', email='ledger_ok@example.com', password='secret123')
+        post_entry(on_ledger.pk, 'deposit', '5.00')
+        bypassed = User.objects.create_user(username='ledger_off', email='ledger_off@example.com', password='secret123')
+        User.objects.filter(pk=bypassed.pk).update(balance=F('balance') + 1)
+
+        checked, mismatches, skipped = reconcile_range(matching.pk, bypassed.pk)
+        self.assertEqual((checked, skipped), (5, 1))
+        self.assertEqual(
+            sorted((username, balance, Decimal(expected), basis) for _, username, balance, expected, basis in mismatches),
+            [('ledger_off', Decimal('11.00'), Decimal('10.00'), 'ledger'), ('legacy_off', Decimal('99.00'), Decimal('10.00'), 'sources')],
+        )
+
+
+class InvitationStatsTests(TestCase):
+    def setUp(self):
+        self.referrer = User.objects.create_user(username='referrer', email='referrer@example.com', password='secret123')
+        active = User.objects.create_user(username='active', email='active@example.com', password='secret123', referred_by=self.referrer)
+        idle = User.objects.create_user(username='idle', email='idle@example.com', password='secret123', referred_by=self.referrer)
+        User.objects.filter(pk=active.pk).update(last_login=timezone.now() - timedelta(days=1))
+        User.objects.filter(pk=idle.pk).update(last_login=timezone.now() - timedelta(days=45))
+        Deposit.objects.create(user=active, amount=Decimal('100.00'), wallet_address='w', status='confirmed')
+        Deposit.objects.create(user=idle, amount=Decimal('50.00'), wallet_address='w', status='confirmed')
+        Invitation.objects.bulk_create([
+            Invitation(referrer=self.referrer, referee_email=email)
+            for email in ['active@example.com', 'idle@example.com', 'unregistered@example.com']
+        ])
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.referrer)
+
+    def test_stats_in_constant_queries(self):
+        with self.assertNumQueries(2):  # the page of invitations + one query for all statistics
+            response = self.client.get('/api/invitations/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['invitations']), 3)
+        self.assertEqual((data['team_size'], data['active_members'], data['referral_earnings']), (3, 1, '15.00'))
+
+
+class ReferralTests(TestCase):
+    def setUp(self):
+        self.referrer = User.objects.create_user(username='referrer', email='referrer@example.com', password='secret123')
+        self.client = APIClient(SERVER_NAME='localhost')
+
+    def deposit(self, user, amount):
+        self.client.force_authenticate(user)
+        response = self.client.post('/api/deposit/', {'amount': amount, 'wallet_address': 'w', 'status': 'confirmed'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def bonuses(self):
+        return list(self.referrer.ledger_entries.filter(entry_type='referral_bonus').values_list('amount', flat=True))
+
+    def register(self, username, **fields):
+        response = APIClient(SERVER_NAME='localhost').post('/api/register/', {
+            'username': username, 'email': f'{username}@example.com', 'password': 'secret123', 'withdrawal_password': '1234', **fields,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return User.objects.get(username=username)
+
+    def test_only_accepted_invitations_make_a_referral(self):
+        Invitation.objects.bulk_create([
+            Invitation(referrer=self.referrer, referee_email='invited@example.com'),
+            Invitation(referrer=self.referrer, referee_email='accepted@example.com', status='accepted'),
+        ])
+        invited, accepted = self.register('invited'), self.register('accepted')
+        coded = self.register('coded', referral_code=self.referrer.referral_code)
+        self.assertEqual(
+            (invited.referred_by_id, accepted.referred_by_id, coded.referred_by_id), (None, self.referrer.pk, self.referrer.pk),
+        )
+
+        self.deposit(invited, '50.00')
+        self.deposit(accepted, '40.00')
+        self.deposit(coded, '20.00')
+        self.deposit(self.referrer, '40.00')  # no referrer of their own
+        self.assertEqual(sorted(self.bonuses()), [Decimal('2.00'), Decimal('4.00')])
+
+    def test_backfill_referred_by(self):
+        pending = User.objects.create_user(username='pending', email='pending@example.com', password='secret123')
+        accepted = User.objects.create_user(username='accepted', email='accepted@example.com', password='secret123')
+        other = User.objects.create_user(username='other', email='other@example.com', password='secret123')
+        Invitation.objects.bulk_create([
+            Invitation(referrer=self.referrer, referee_email='pending@example.com'),
+            Invitation(referrer=other, referee_email='accepted@example.com'),
+            Invitation(referrer=self.referrer, referee_email='accepted@example.com', status='accepted'),
+            Invitation(referrer=self.referrer, referee_email='referrer@example.com', status='accepted'),  # self-referral
+        ])
+
+        def referrers():
+            return dict(User.objects.values_list('username', 'referred_by__username'))
+
+        out = io.StringIO()
+        call_command('backfill_referred_by', '--dry-run', '--chunk-size', '2', stdout=out)
+        self.assertIn('Would link 1 users', out.getvalue())
+        self.assertEqual(set(referrers().values()), {None})
+
+        call_command('backfill_referred_by', '--chunk-size', '2', stdout=io.StringIO())
+        self.assertEqual(referrers(), {'referrer': None, 'pending': None, 'accepted': 'referrer', 'other': None})
+        out = io.StringIO()
+        call_command('backfill_referred_by', stdout=out)
+        self.assertIn('Linked 0 users', out.getvalue())
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='ops', email='ops@example.com', password='secret123', is_staff=True)
+        self.user = User.objects.create_user(username='payer', email='payer@example.com', password='secret123')
+        deposits = Deposit.objects.bulk_create([
+            Deposit(user=self.user, amount=Decimal(amount), wallet_address=wallet, status=state)
+            for amount, wallet, state in [('10.00', 'w,1', 'confirmed'), ('20.00', 'w2', 'pending'), ('30.00', 'w3', 'confirmed')]
+        ])
+        for deposit, moment in zip(deposits, [datetime(2026, 1, 1, 9), datetime(2026, 1, 2, 23, 59), datetime(2026, 1, 3)]):
+            Deposit.objects.filter(pk=deposit.pk).update(created_at=timezone.make_aware(moment))
+        self.deposits = deposits
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.staff)
+
+    def export(self, **params):
+        response = self.client.get('/api/ops/exports/deposits/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_until_is_inclusive(self):
+        response, body = self.export(until='2026-01-02')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0][:4], ['id', 'user_id', 'user__username', 'amount'])
+        self.assertEqual([(row[3], row[5]) for row in rows[1:]], [('10.00', 'w,1'), ('20.00', 'w2')])
+
+    def test_ndjson_with_status_and_since(self):
+        response, body = self.export(output='ndjson', status='confirmed', since='2026-01-02')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([(row['id'], row['user__username'], row['amount']) for row in rows], [(self.deposits[2].pk, 'payer', '30.00')])
+
+    def test_bad_arguments_and_non_staff(self):
+        for params in [{'status': 'confirmed,lost'}, {'output': 'xml'}, {'since': 'yesterday'}, {'until': '2026-02-30'}]:
+            self.assertEqual(self.client.get('/api/ops/exports/deposits/', params).status_code, 400)
+        self.assertEqual(self.client.get('/api/ops/exports/users/').status_code, 400)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/ops/exports/deposits/').status_code, 403)
+
+    def test_command_writes_to_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'deposits.ndjson')
+            call_command('export_data', 'deposits', '--format', 'ndjson', '--status', 'pending', '--output', path, stderr=io.StringIO())
+            with open(path, encoding='utf-8') as exported:
+                rows = [json.loads(line) for line in exported]
+        self.assertEqual([row['amount'] for row in rows], ['20.00'])
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'deposits', '--until', 'someday', stdout=io.StringIO())
+
+
+class TransactionStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='streamer', email='streamer@example.com', password='secret123')
+        now = timezone.now()
+        Deposit.objects.bulk_create([Deposit(user=self.user, amount=i + 1, wallet_address='w', status='confirmed') for i in range(4)])
+        Withdrawal.objects.bulk_create([Withdrawal(user=self.user, amount=i + 1, wallet_address='w') for i in range(3)])
+        Task.objects.bulk_create([
+            Task(user=self.user, task_number=i + 1, status='completed', earnings=1, completed_at=now) for i in range(3)
+        ])
+        # Rows of different kinds at the same instant, with overlapping ids
+        Deposit.objects.filter(user=self.user).update(created_at=now)
+        Withdrawal.objects.filter(user=self.user).update(created_at=now - timedelta(seconds=1))
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def test_pages_cover_every_row_once_in_order(self):
+        seen = []
+        params = {'page_size': 3, 'include_tasks': 'true'}
+        response = self.client.get('/api/transactions/stream/', params)
+        self.assertIn('totals', response.json())
+        while True:
+            data = response.json()
+            seen += [(row['type'], row['id'], row['created_at']) for row in data['transactions']]
+            if not data['next_cursor']:
+                break
+            with self.assertNumQueries(1):  # one UNION ALL per page after the first
+                response = self.client.get('/api/transactions/stream/', {**params, 'cursor': data['next_cursor']})
+            self.assertNotIn('totals', response.json())
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(len(set(seen)), 10)
+        self.assertEqual([row[2] for row in seen], sorted((row[2] for row in seen), reverse=True))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')  # no collectstatic manifest in tests
+class AdminChangelistQueryTests(TestCase):
+    CHANGELISTS = ['deposit', 'withdrawal', 'task', 'invitation', 'ledgerentry']
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='secret123')
+        self.client = Client(SERVER_NAME='localhost')
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        for i in range(count):
+            user = User.objects.create_user(username=f'row{User.objects.count()}', password='secret123')
+            Deposit.objects.create(user=user, amount=Decimal('5.00'), wallet_address='w', status='confirmed')
+            Withdrawal.objects.create(user=user, amount=Decimal('1.00'), wallet_address='w')
+            Task.objects.create(user=user, status='completed', earnings=Decimal('1.00'))
+            Invitation.objects.create(referrer=user, referee_email=f'friend{i}@example.com')
+
+    def changelist_queries(self, model):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/admin/accounts/{model}/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_is_independent_of_row_count(self):
+        self.add_rows(2)
+        few = {model: self.changelist_queries(model) for model in self.CHANGELISTS}
+        self.add_rows(10)
+        many = {model: self.changelist_queries(model) for model in self.CHANGELISTS}
+        self.assertEqual(many, few)
+        self.assertTrue(all(count <= 8 for count in many.values()), many)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='CarolS', email='Carol@Example.com', password='secret123', phone_number='+44 (20) 7946-0018',
+        )
+        Deposit.objects.create(user=self.user, amount=Decimal('5.00'), wallet_address='TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE')
+
+    def test_search_columns_follow_saves(self):
+        self.user.email = 'Carol.New@Example.com'
+        self.user.save(update_fields=['email'])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email_search, 'carol.new@example.com')
+        self.assertEqual(self.user.phone_search, '442079460018')
+
+    def test_matches_are_case_and_format_insensitive(self):
+        for term in ['carols', 'CAROL@example', 'ca', '7946-0018', self.user.referral_code]:
+            self.assertEqual(list(search_users(User.objects.all(), term)), [self.user], term)
+        self.assertFalse(search_users(User.objects.all(), 'arol@x').exists())
+        self.assertFalse(search_users(User.objects.all(), 'ar').exists())  # short terms only match a prefix
+        for term in ['tqn9y2khesljw1chvwfmsmerdow5kcblse', 'W1ChVW', 'carols']:
+            self.assertEqual(search_payments(Deposit.objects.all(), term).count(), 1, term)
+
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='denew-media-')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, PROFILE_PICTURE_WORKERS=0)
+class ProfilePictureTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, user, content, name='me.png'):
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return client.post('/api/profile/update/', {'profile_picture': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def png(self, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (600, 400), color).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_upload_is_resized_and_deduplicated(self):
+        first = User.objects.create_user(username='pic1', email='pic1@example.com', password='secret123')
+        second = User.objects.create_user(username='pic2', email='pic2@example.com', password='secret123')
+        content = self.png('red')
+        response = self.upload(first, content)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['user']['profile_picture_processing'])
+        self.assertEqual(self.upload(second, content, name='other.png').status_code, 200)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        digest = first.profile_picture_hash
+        self.assertEqual(len(digest), 64)
+        self.assertEqual((second.profile_picture_hash, first.profile_picture_pending), (digest, ''))
+        self.assertEqual(first.profile_picture, f'/media/{variant_path(digest, "display")}')
+        with Image.open(f'{MEDIA_ROOT}/{variant_path(digest, "thumbnail")}') as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (64, 43)))
+        # One stored copy for both users
+        self.assertEqual(len(os.listdir(f'{MEDIA_ROOT}/{picture_dir(digest)}')), 3)
+
+        # A full save of a stale instance keeps the processed picture
+        stale = User.objects.get(pk=first.pk)
+        self.upload(first, self.png('blue'))
+        stale.full_name = 'Stale'
+        stale.save()
+        first.refresh_from_db()
+        self.assertNotEqual(first.profile_picture_hash, digest)
+        self.assertEqual(prune(dry_run=True), [])
+
+    def test_prune_skips_pictures_uploaded_again(self):
+        self.addCleanup(shutil.rmtree, MEDIA_ROOT, ignore_errors=True)
+        user = User.objects.create_user(username='pic4', email='pic4@example.com', password='secret123')
+        other = User.objects.create_user(username='pic5', email='pic5@example.com', password='secret123')
+        self.upload(user, self.png('green'))
+        user.refresh_from_db()
+        old = user.profile_picture_hash
+        self.upload(user, self.png('yellow'))
+        user.refresh_from_db()
+        self.assertIn(old, prune(dry_run=True))
+
+        real_check = pictures.is_referenced
+
+        def uploaded_meanwhile(digest):
+            User.objects.filter(pk=other.pk).update(profile_picture_pending=digest)
+            return real_check(digest)
+        with patch('denew_backend.accounts.pictures.is_referenced', side_effect=uploaded_meanwhile):
+            self.assertNotIn(old, prune())
+        self.assertTrue(os.path.isdir(f'{MEDIA_ROOT}/{picture_dir(old)}'))
+
+        User.objects.filter(pk=other.pk).update(profile_picture_pending='')
+        out = io.StringIO()
+        call_command('prune_profile_pictures', stdout=out)
+        self.assertIn(old, out.getvalue())
+        self.assertFalse(os.path.exists(f'{MEDIA_ROOT}/{picture_dir(old)}'))
+        self.assertTrue(os.path.isdir(f'{MEDIA_ROOT}/{picture_dir(user.profile_picture_hash)}'))
+
+        with patch('denew_backend.accounts.pictures.default_storage', Storage()):
+            with self.assertRaises(CommandError):
+                call_command('prune_profile_pictures', stdout=io.StringIO())
+
+    def test_rejects_non_images(self):
+        user = User.objects.create_user(username='pic3', email='pic3@example.com', password='secret123')
+        response = self.upload(user, b'not an image', name='me.png')
+        self.assertEqual(response.status_code, 400)
+        user.refresh_from_db()
+        self.assertEqual((user.profile_picture, user.profile_picture_pending), ('', ''))
+
+
+class VerificationCodeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='forgetful', email='forgetful@example.com', password='secret123', withdrawal_password='1111')
+        self.store = DatabaseCodeStore(max_attempts=3)
+        self.client = APIClient(SERVER_NAME='localhost')
+
+    def reset_pin(self):
+        return self.client.post('/api/reset-pin/', {'email': self.user.email, 'pin': '4321'}, format='json')
+
+    def test_reset_pin_needs_a_verified_code(self):
+        code = self.store.issue(self.user.email)
+        self.assertEqual(self.reset_pin().status_code, 400)
+        self.assertEqual(self.client.post('/api/verify-code/', {'email': self.user.email, 'code': 'wrong'}, format='json').status_code, 400)
+        self.assertEqual(self.reset_pin().status_code, 400)
+        self.assertEqual(self.client.post('/api/verify-code/', {'email': 'Forgetful@Example.com ', 'code': code}, format='json').status_code, 200)
+        self.assertEqual(self.reset_pin().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.withdrawal_password, '4321')
+        self.assertEqual(self.reset_pin().status_code, 400)  # the code is used up
+
+    def test_guesses_lock_the_code(self):
+        code = self.store.issue(self.user.email)
+        self.assertEqual([self.store.verify(self.user.email, '000000' if code != '000000' else '111111') for _ in range(3)], [INVALID] * 3)
+        self.assertEqual(VerificationCode.objects.get().attempts, 3)
+        self.assertEqual(self.store.verify(self.user.email, code), LOCKED)
+        self.assertEqual(self.store.verify(self.user.email, code), MISSING)
+        self.assertFalse(VerificationCode.objects.exists())
+
+        code = self.store.issue(self.user.email)  # a new code starts a new count
+        self.assertEqual(self.store.verify(self.user.email, code), VERIFIED)
+
+    def test_expired_codes_are_refused(self):
+        code = self.store.issue(self.user.email)
+        self.assertEqual(self.store.verify(self.user.email, code), VERIFIED)
+        VerificationCode.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertFalse(self.store.is_verified(self.user.email))
+        self.assertEqual(self.reset_pin().status_code, 400)
+        self.assertEqual(self.store.verify(self.user.email, code), MISSING)
+        self.store.issue('someone-else@example.com')  # issuing clears expired rows
+        self.assertEqual(VerificationCode.objects.count(), 1)
+
+    def test_outbox_drain_purges_expired_codes(self):
+        self.store.issue(self.user.email)
+        self.store.issue('someone-else@example.com')
+        VerificationCode.objects.filter(email_digest=DatabaseCodeStore._digest(self.user.email)).update(
+            expires_at=timezone.now() - timedelta(seconds=1),
+        )
+        out = io.StringIO()
+        call_command('drain_email_outbox', '--workers', '1', stdout=out)
+        self.assertIn('Purged 1 expired verification codes', out.getvalue())
+        self.assertEqual(VerificationCode.objects.count(), 1)
+
+
+@override_settings(ADMISSION_MAX_IN_FLIGHT=1, ADMISSION_PRIORITY_RESERVE=1, ADMISSION_RETRY_AFTER=7, OPERATING_HOURS_ENFORCED=False)
+class AdmissionControlTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.nested = []
+        self.baseline = admission_counters()['in_flight']
+
+    def middleware(self, view):
+        return AdmissionControlMiddleware(view)
+
+    def test_sheds_over_the_cap_and_keeps_a_reserve_for_priority_routes(self):
+        def view(request):
+            # Requests arriving while this one holds the only normal slot
+            if request.path == '/api/dashboard/':
+                self.nested.append(middleware(self.factory.get('/api/tasks/')))
+                self.nested.append(middleware(self.factory.post('/api/withdrawals/3/complete/')))
+            elif request.path == '/api/withdrawals/3/complete/':
+                self.nested.append(middleware(self.factory.get('/admin/')))  # the reserve is used up too
+            return HttpResponse('ok')
+
+        middleware = self.middleware(view)
+        self.assertEqual(middleware(self.factory.get('/api/dashboard/')).status_code, 200)
+        shed, over_reserve, priority = self.nested  # in completion order
+        self.assertEqual((shed.status_code, shed['Retry-After']), (503, '7'))
+        self.assertEqual(priority.status_code, 200)
+        self.assertEqual((over_reserve.status_code, over_reserve['Retry-After']), (503, '7'))
+        self.assertEqual(admission_counters()['in_flight'], self.baseline)
+
+    def test_streaming_responses_hold_their_slot_until_closed(self):
+        middleware = self.middleware(lambda request: StreamingHttpResponse(iter(['a', 'b'])))
+        response = middleware(self.factory.get('/api/ops/exports/deposits/'))
+        self.assertEqual(admission_counters()['in_flight'], self.baseline + 1)
+        self.assertEqual(b''.join(response.streaming_content), b'ab')
+        self.assertEqual(middleware(self.factory.get('/api/tasks/')).status_code, 503)
+        response.close()
+        response.close()
+        self.assertEqual(admission_counters()['in_flight'], self.baseline)
+
+        unread = middleware(self.factory.get('/api/ops/exports/deposits/'))  # client gone before the first chunk
+        unread.close()
+        self.assertEqual(admission_counters()['in_flight'], self.baseline)
+
+    def test_failing_views_release_their_slot(self):
+        def view(request):
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            self.middleware(view)(self.factory.get('/api/tasks/'))
+        self.assertEqual(admission_counters()['in_flight'], self.baseline)
+
+
+class CountingEmailBackend(EmailBackend):
+    opened = 0
+    fail = False
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if CountingEmailBackend.fail:
+            raise SMTPException('connection refused')
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='denew_backend.accounts.tests.CountingEmailBackend',
+    EMAIL_DISPATCH_IN_PROCESS=False, EMAIL_MAX_ATTEMPTS=3, EMAIL_RETRY_BASE_SECONDS=30,
+)
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        CountingEmailBackend.opened = 0
+        CountingEmailBackend.fail = False
+
+    def test_send_verification_code_only_enqueues(self):
+        User.objects.create_user(username='pin', email='pin@example.com', password='secret123')
+        response = APIClient(SERVER_NAME='localhost').post('/api/send-verification-code/', {'email': 'pin@example.com'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        message = EmailOutbox.objects.get()
+        self.assertEqual((message.status, message.recipients), ('pending', ['pin@example.com']))
+        self.assertEqual(drain(), (1, 1))
+        self.assertEqual(mail.outbox[0].to, ['pin@example.com'])
+        self.assertEqual(EmailOutbox.objects.get().status, 'sent')
+
+    def test_one_connection_per_batch(self):
+        for i in range(10):
+            enqueue_email('Hello', 'Body', [f'user{i}@example.com'])
+        self.assertEqual(drain(batch_size=50), (10, 10))
+        self.assertEqual(len(mail.outbox), 10)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+
+    def test_failures_back_off_then_give_up(self):
+        message = enqueue_email('Hello', 'Body', ['user@example.com'])
+        CountingEmailBackend.fail = True
+        self.assertEqual(drain(), (1, 0))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('pending', 1))
+        self.assertIn('connection refused', message.last_error)
+        self.assertGreater(message.next_attempt_at, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(drain(), (0, 0))  # not due yet
+
+        for attempt in (2, 3):
+            EmailOutbox.objects.filter(pk=message.pk).update(next_attempt_at=timezone.now())
+            drain()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('failed', 3))
+        self.assertEqual(len(mail.outbox), 0)
@@ -29,6 +29,8 @@ urlpatterns = [
     path('api/withdrawals/bulk-complete/', views.bulk_complete_withdrawals, name='bulk_complete_withdrawals'),
     path('api/transactions/', views.get_transaction_history, name='get_transaction_history'),
     path('api/transactions/enhanced/', views.get_enhanced_transaction_history, name='get_enhanced_transaction_history'),
+    path('api/transactions/ledger/', views.get_ledger, name='get_ledger'),
+    path('api/transactions/stream/', views.get_transaction_stream, name='get_transaction_stream'),
     path('api/terms/', views.get_terms, name='get_terms'),
     path('api/portfolio/', views.get_portfolio, name='get_portfolio'),
     path('api/portfolio/update/', views.update_portfolio, name='update_portfolio'),
@@ -37,6 +39,8 @@ urlpatterns = [
     path('api/vip-level/', views.get_vip_level, name='get_vip_level'),
     path('api/campaigns/', views.get_campaigns, name='get_campaigns'),
     path('api/products/', views.get_products, name='get_products'),
+    path('api/ops/admission/', views.get_admission_stats, name='get_admission_stats'),
+    path('api/ops/exports/<str:kind>/', views.export_data, name='export_data'),
     # path('create-superuser-temp/', views.create_superuser_temp, name='create_superuser_temp'),
 
 ]
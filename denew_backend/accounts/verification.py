@@ -0,0 +1,108 @@
+"""
+Storage for the PIN-reset verification codes.
+
+send_verification_code, verify_code and reset_pin may be served by different
+worker processes, so codes live in a shared store rather than process memory.
+The default DatabaseCodeStore keeps one VerificationCode row per email. Wrong
+guesses are counted with a conditional F() UPDATE (attempts < max), so parallel
+guesses cannot get past VERIFICATION_CODE_MAX_ATTEMPTS. Expired rows are
+deleted whenever a new code is issued and on every drain_email_outbox pass
+(purge_expired()), so the table holds at most the codes issued within one
+VERIFICATION_CODE_TTL. Another store can be plugged in with
+settings.VERIFICATION_CODE_STORE.
+"""
+import hashlib
+import hmac
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import VerificationCode
+
+# verify() results
+VERIFIED = 'verified'
+MISSING = 'missing'
+INVALID = 'invalid'
+LOCKED = 'locked'
+
+
+class VerificationCodeStore:
+    """Interface for code stores: one pending code per email."""
+
+    def issue(self, email):
+        """Create and store a new code for email, replacing any previous one. Returns the code."""
+        raise NotImplementedError
+
+    def verify(self, email, code):
+        """Check a submitted code. Returns VERIFIED, MISSING (none or expired), INVALID or LOCKED."""
+        raise NotImplementedError
+
+    def is_verified(self, email):
+        """True once verify() has succeeded for the current code."""
+        raise NotImplementedError
+
+    def consume(self, email):
+        """Drop the code once it has been used."""
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """Delete expired codes. Returns how many were removed; stores that expire entries themselves keep this."""
+        return 0
+
+
+class DatabaseCodeStore(VerificationCodeStore):
+    def __init__(self, ttl=None, max_attempts=None):
+        self.ttl = ttl or getattr(settings, 'VERIFICATION_CODE_TTL', 600)
+        self.max_attempts = max_attempts or getattr(settings, 'VERIFICATION_CODE_MAX_ATTEMPTS', 5)
+
+    @staticmethod
+    def _digest(email):
+        return hashlib.sha256(email.strip().lower().encode()).hexdigest()
+
+    def _live(self, email):
+        return VerificationCode.objects.filter(email_digest=self._digest(email), expires_at__gt=timezone.now())
+
+    def issue(self, email):
+        code = f'{secrets.randbelow(10 ** 6):06d}'
+        now = timezone.now()
+        self.purge_expired()
+        VerificationCode.objects.update_or_create(
+            email_digest=self._digest(email),
+            defaults={'code': code, 'verified': False, 'attempts': 0, 'expires_at': now + timedelta(seconds=self.ttl)},
+        )
+        return code
+
+    def verify(self, email, code):
+        codes = self._live(email)
+        with transaction.atomic():
+            # Count the guess only while attempts remain, in the UPDATE itself
+            if not codes.filter(attempts__lt=self.max_attempts).update(attempts=F('attempts') + 1):
+                if codes.exists():
+                    self.consume(email)
+                    return LOCKED
+                return MISSING
+            stored = codes.values_list('code', flat=True).first()
+            if stored is None:
+                return MISSING
+            if not hmac.compare_digest(stored, str(code or '')):
+                return INVALID
+            codes.update(verified=True)
+        return VERIFIED
+
+    def is_verified(self, email):
+        return self._live(email).filter(verified=True).exists()
+
+    def consume(self, email):
+        VerificationCode.objects.filter(email_digest=self._digest(email)).delete()
+
+    def purge_expired(self):
+        return VerificationCode.objects.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+def get_code_store():
+    return import_string(getattr(settings, 'VERIFICATION_CODE_STORE', 'denew_backend.accounts.verification.DatabaseCodeStore'))()
@@ -4,10 +4,10 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate, get_user_model
-from django.db.models import Sum
-from django.http import HttpResponseRedirect, JsonResponse
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.core.mail import send_mail
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 from django.db import transaction
@@ -15,21 +15,34 @@ from decimal import Decimal
 from .serializers import (
     WithdrawalCompletionSerializer, WithdrawalListSerializer, AdminWithdrawalActionSerializer,
     UserRegistrationSerializer, UserLoginSerializer, UserSerializer, TaskSerializer,
-    CurrentTaskSerializer, ProductSerializer, DepositSerializer, WithdrawalSerializer,
+    CurrentTaskSerializer, DepositSerializer, WithdrawalSerializer,
     InvitationSerializer, TermsSerializer, PortfolioSerializer, SupportTicketSerializer,
-    TransactionHistorySerializer, EnhancedTransactionHistorySerializer, CampaignSerializer
+    TransactionHistorySerializer, EnhancedTransactionHistorySerializer, CampaignSerializer, LedgerEntrySerializer
 )
-from .models import User, Task, Product, Deposit, Withdrawal, Invitation, TermsAndConditions, UserProfile, Portfolio, SupportTicket, Campaign
+from .activity import transaction_page
+from .authentication import lock_user
+from .caching import cached_json, get_dashboard, set_dashboard
+from .catalog import product_catalog
+from .conditional import balance_etag, conditional_get, content_etag, current_task_etag, user_columns, vip_level_etag
+from .exports import FORMATS, ExportError, export_rows, render
+from .ledger import REFERRAL_BONUS_RATE, InsufficientFunds, balance_at, current_balance, post_entry, set_balance
+from .outbox import enqueue_email
+from .pictures import InvalidPicture, discard, queue_processing, stage_upload
+from .pagination import paginate_keyset, with_next_cursor
+from .referrals import referral_stats
+from .settlement import SETTLEMENT_ACTIONS, settle_withdrawals
+from .stats import get_stats, reset_task_stats
+from .task_sets import TASKS_PER_SET, complete_task, create_next_task, generate_task_set, pregenerate_enabled, release_next_task
+from .verification import INVALID, LOCKED, MISSING, get_code_store
+from .models import User, Task, Deposit, Withdrawal, Invitation, TermsAndConditions, UserProfile, Portfolio, SupportTicket, Campaign, UserStats, LedgerEntry
 from django.utils import timezone
-from datetime import timedelta
-import random
-import string
-import os
+from django.utils.dateparse import parse_datetime
 import logging
 from django.conf import settings
+from denew_backend.middleware import admission_counters
 
-# NEW: Global dict for verification codes (in-memory; reset on restart. Use Redis for production)
-verification_codes = {}
+# Shared across workers; see verification.py
+verification_codes = get_code_store()
 
 logger = logging.getLogger(__name__)
 
@@ -154,14 +167,15 @@ def update_user_profile(request):
         user.sms_notifications = data['sms_notifications']
     if 'twofa_enabled' in data:
         user.twofa_enabled = data['twofa_enabled']
+    # Resizing and storage happen on the picture workers; the response reports
+    # profile_picture_processing until the new picture is in place
+    staged_picture = None
     profile_picture = request.FILES.get('profile_picture')
     if profile_picture:
-        file_path = os.path.join(settings.MEDIA_ROOT, 'profile_pictures', f'{user.username}_{profile_picture.name}')
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, 'wb+') as destination:
-            for chunk in profile_picture.chunks():
-                destination.write(chunk)
-        user.profile_picture = f'/media/profile_pictures/{user.username}_{profile_picture.name}'
+        try:
+            staged_picture = stage_upload(profile_picture)
+        except InvalidPicture as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     profile_data = data.get('profile', {})
     if profile_data:
         if 'avatar' in profile_data:
@@ -187,92 +201,79 @@ def update_user_profile(request):
     try:
         user.save()
         user_profile.save()
+        if staged_picture:
+            queue_processing(user, staged_picture)
+            staged_picture = None
         return Response({
             'message': 'Profile updated successfully',
             'user': UserSerializer(user).data
         }, status=status.HTTP_200_OK)
     except Exception as e:
+        if staged_picture:
+            discard(staged_picture)
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def dashboard_data(request):
     """Get dashboard statistics for the authenticated user"""
-    user = request.user
-    
+    cached = get_dashboard(request.user.pk)
+    if cached is not None:
+        return Response(cached, status=status.HTTP_200_OK)
+
     try:
-        # Calculate total earnings from completed tasks
-        total_earnings = Task.objects.filter(
-            user=user, 
-            status='completed'
-        ).aggregate(total=Sum('earnings'))['total'] or Decimal('0.00')
-        
-        # Get total completed tasks count
-        total_tasks = Task.objects.filter(
-            user=user, 
-            status='completed'
-        ).count()
-        
-        # Get team members count (invitations sent)
-        team_members = Invitation.objects.filter(referrer=user).count()
-        
+        # User row, profile, running totals and team size in a single statement
+        user = User.objects.select_related('profile', 'stats').annotate(
+            team_members=Subquery(
+                Invitation.objects.filter(referrer=OuterRef('pk')).values('referrer').annotate(total=Count('id')).values('total')
+            ),
+        ).get(pk=request.user.pk)
+        try:
+            stats = user.stats
+        except UserStats.DoesNotExist:
+            stats = get_stats(user.pk)
+        total_earnings = stats.task_earnings
+
         # Calculate current balance (sum of confirmed deposits + signup bonus)
-        confirmed_deposits = Deposit.objects.filter(user=user, status='confirmed')
-        deposit_total = confirmed_deposits.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        signup_bonus = Decimal('10.00') if user.date_joined and not user.signup_bonus_applied else Decimal('0.00')
-        current_balance = deposit_total + signup_bonus
-        
-        # Get recent activities (last 5 activities, including confirmed deposits)
+        current_balance = stats.deposits_confirmed + Decimal('10.00')
+
+        # Recent activities: the newest 3 completed tasks, 2 withdrawals and 2 confirmed
+        # deposits in one UNION ALL, then the newest 5 of those. Each branch is limited
+        # through a pk IN (... LIMIT n) subquery, which works on databases that cannot
+        # LIMIT the branches of a compound statement (SQLite)
+        def activity(queryset, kind, amount, timestamp, limit):
+            newest = queryset.order_by(timestamp.desc(), '-id').values('pk')[:limit]
+            return queryset.filter(pk__in=newest).annotate(
+                kind=Value(kind), amount_value=F(amount), status_value=F('status'), timestamp=timestamp
+            ).values_list('kind', 'amount_value', 'status_value', 'timestamp')
+
+        recent = activity(
+            Task.objects.filter(user=user, status='completed'), 'task', 'earnings', Coalesce('completed_at', 'created_at'), 3
+        ).union(
+            activity(Withdrawal.objects.filter(user=user), 'withdrawal', 'amount', F('created_at'), 2),
+            activity(Deposit.objects.filter(user=user, status='confirmed'), 'deposit', 'amount', F('created_at'), 2),
+            all=True,
+        ).order_by('-timestamp')[:5]
+
         recent_activities = []
-        
-        # Recent completed tasks
-        recent_tasks = Task.objects.filter(
-            user=user, 
-            status='completed'
-        ).order_by('-completed_at')[:3]
-        
-        for task in recent_tasks:
+        for kind, amount, item_status, timestamp in recent:
+            if kind == 'task':
+                description = f'You completed a task and earned ${amount}'
+            elif kind == 'withdrawal':
+                status_text = {
+                    'pending': 'requested withdrawal of',
+                    'completed': 'successfully withdrew',
+                    'rejected': 'withdrawal rejected for'
+                }.get(item_status, 'processed withdrawal of')
+                description = f'You {status_text} ${amount}'
+            else:
+                description = f'You deposited ${amount}'
             recent_activities.append({
-                'type': 'task',
-                'description': f'You completed a task and earned ${task.earnings}',
-                'timestamp': task.completed_at.isoformat() if task.completed_at else task.created_at.isoformat()
+                'type': kind,
+                'description': description,
+                'timestamp': timestamp.isoformat()
             })
-        
-        # Recent withdrawals
-        recent_withdrawals = Withdrawal.objects.filter(
-            user=user
-        ).order_by('-created_at')[:2]
-        
-        for withdrawal in recent_withdrawals:
-            status_text = {
-                'pending': 'requested withdrawal of',
-                'completed': 'successfully withdrew', 
-                'rejected': 'withdrawal rejected for'
-            }.get(withdrawal.status, 'processed withdrawal of')
-            
-            recent_activities.append({
-                'type': 'withdrawal',
-                'description': f'You {status_text} ${withdrawal.amount}',
-                'timestamp': withdrawal.created_at.isoformat()
-            })
-        
-        # Recent confirmed deposits
-        recent_deposits = Deposit.objects.filter(
-            user=user,
-            status='confirmed'
-        ).order_by('-created_at')[:2]
-        
-        for deposit in recent_deposits:
-            recent_activities.append({
-                'type': 'deposit',
-                'description': f'You deposited ${deposit.amount}',
-                'timestamp': deposit.created_at.isoformat()
-            })
-        
-        # Sort activities by timestamp and limit to 5
-        recent_activities.sort(key=lambda x: x['timestamp'], reverse=True)
-        recent_activities = recent_activities[:5]
-        
+
         # If no activities, show welcome message
         if not recent_activities:
             recent_activities = [{
@@ -280,17 +281,19 @@ def dashboard_data(request):
                 'description': 'Welcome! Start your first task or deposit to see activity here.',
                 'timestamp': user.date_joined.isoformat()
             }]
-        
-        return Response({
-            'total_earnings': str(total_earnings),
-            'total_tasks': total_tasks,
-            'team_members': team_members,
+
+        payload = {
+            'total_earnings': str(total_earnings.quantize(Decimal('0.01'))),
+            'total_tasks': stats.tasks_completed,
+            'team_members': user.team_members or 0,
             'recent_activities': recent_activities,
             'current_balance': str(current_balance.quantize(Decimal('0.01'))),  # Ensure 2 decimal places
             'vip_level': user.vip_level,
             'user': UserSerializer(user, context={'request': request}).data
-        }, status=status.HTTP_200_OK)
-        
+        }
+        set_dashboard(user.pk, payload)
+        return Response(payload, status=status.HTTP_200_OK)
+
     except Exception as e:
         logger.error(f"Dashboard data error: {str(e)}", exc_info=True)
         return Response(
@@ -301,60 +304,52 @@ def dashboard_data(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_tasks(request):
-    tasks = Task.objects.filter(user=request.user).order_by('-created_at')
+    tasks, next_cursor = paginate_keyset(Task.objects.filter(user=request.user).exclude(status='queued'), request)
+    product_catalog.attach_to_tasks(tasks)
     serializer = TaskSerializer(tasks, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return with_next_cursor(Response(serializer.data, status=status.HTTP_200_OK), next_cursor)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_get(current_task_etag)
 def get_current_task(request):
     user = request.user
-    current_set = user.current_set
+    current_set = user_columns(request)['current_set']
     if not current_set:
         return Response({'task': None}, status=status.HTTP_200_OK)
-    task = Task.objects.filter(user=user, set_number=current_set, status='pending').order_by('task_number').first()
-    if not task:
-        task = Task.objects.filter(user=user, set_number=current_set, status='in-progress').order_by('task_number').first()
+    # Only one task of a set is open at a time, so one lookup on task_open_by_set_idx is enough
+    task = Task.objects.filter(user=user, set_number=current_set, status__in=['pending', 'in-progress']).order_by('task_number').first()
     if not task:
         return Response({'task': None}, status=status.HTTP_200_OK)
+    product_catalog.attach_to_tasks([task])
     serializer = CurrentTaskSerializer(task)
     return Response({'task': serializer.data}, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_products(request):
-    products = list(Product.objects.all())
-    if len(products) < 4:
+    if len(product_catalog) < 4:
         return Response({'error': 'Not enough products available'}, status=status.HTTP_400_BAD_REQUEST)
-    selected_products = random.sample(products, 4)
-    serializer = ProductSerializer(selected_products, many=True)
-    return Response({'products': serializer.data}, status=status.HTTP_200_OK)
+    return HttpResponse(product_catalog.sample_json(4), content_type='application/json')
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def start_task_set(request):
-    user = request.user
-    if user.balance < 100:
-        return Response({'error': 'Minimum balance of 100 USDT required'}, status=status.HTTP_400_BAD_REQUEST)
-    if Task.objects.filter(user=user, status='pending').exists():
-        return Response({'error': 'Complete existing tasks before starting a new set'}, status=status.HTTP_400_BAD_REQUEST)
-    user.current_set += 1
-    user.tasks_completed = 0
-    user.tasks_reset_required = False
-    user.save()
-    task_type = 'combined' if user.balance > 500 else 'normal'
-    earnings_rate = {'VIP 0': Decimal('0.005'), 'VIP 1': Decimal('0.005'), 'VIP 2': Decimal('0.01'), 'VIP 3': Decimal('0.015'), 'VIP 4': Decimal('0.02')}
-    earnings = user.balance * earnings_rate.get(user.vip_level, Decimal('0.005')) * (5 if task_type == 'combined' else 1)
-    products = random.sample(list(Product.objects.all()), min(4 if task_type == 'combined' else 1, Product.objects.count()))
-    task = Task.objects.create(
-        user=user,
-        task_type=task_type,
-        set_number=user.current_set,
-        task_number=1,
-        earnings=earnings,
-        status='pending'
-    )
-    task.products.set(products)
+    with transaction.atomic():
+        # Locked so two concurrent starts cannot both pass the checks and open the same set number
+        user = lock_user(request)
+        if user.balance < 100:
+            return Response({'error': 'Minimum balance of 100 USDT required'}, status=status.HTTP_400_BAD_REQUEST)
+        if Task.objects.filter(user=user, status='pending').exists():
+            return Response({'error': 'Complete existing tasks before starting a new set'}, status=status.HTTP_400_BAD_REQUEST)
+        user.current_set += 1
+        user.tasks_completed = 0
+        user.tasks_reset_required = False
+        user.save()
+        if pregenerate_enabled():
+            task_type = generate_task_set(user, user.current_set)[0].task_type
+        else:
+            task_type = create_next_task(user, user.current_set, 1).task_type
     return Response({
         'message': 'Task set started',
         'task_type': task_type
@@ -391,31 +386,15 @@ def submit_task(request):
             task.merchant_complaint = True
             task.save()
             return Response({'error': 'Task expired (2-hour limit)'}, status=status.HTTP_400_BAD_REQUEST)
-        task.status = 'completed'
-        task.completed_at = timezone.now()
-        task.save()
-        user.balance += task.earnings
-        user.tasks_completed += 1
-        user.can_invite = user.tasks_completed >= 40
-        user.tasks_reset_required = user.tasks_completed >= 40
-        user.save()
-        if user.tasks_completed < 40:
-            task_type = 'combined' if user.balance > 500 else 'normal'
-            earnings_rate = {'VIP 0': Decimal('0.005'), 'VIP 1': Decimal('0.005'), 'VIP 2': Decimal('0.01'), 'VIP 3': Decimal('0.015'), 'VIP 4': Decimal('0.02')}  # FIXED: Use Decimal for consistency
-            earnings = user.balance * earnings_rate.get(user.vip_level, Decimal('0.005')) * (5 if task_type == 'combined' else 1)
-            products = random.sample(list(Product.objects.all()), min(4 if task_type == 'combined' else 1, Product.objects.count()))
-            new_task = Task.objects.create(
-                user=user,
-                task_type=task_type,
-                set_number=user.current_set,
-                task_number=task.task_number + 1,
-                earnings=earnings,
-                status='pending'
-            )
-            new_task.products.set(products)
+        if not complete_task(user, task):
+            return Response({'error': 'Task already submitted'}, status=status.HTTP_409_CONFLICT)
+        if task.task_number < TASKS_PER_SET:
+            if not release_next_task(user, task.set_number, task.task_number + 1):
+                user.refresh_from_db(fields=['balance'])
+                create_next_task(user, task.set_number, task.task_number + 1)
         return Response({
             'message': 'Task completed successfully',
-            'current_task': user.tasks_completed,
+            'current_task': task.task_number,
             'earnings': task.earnings
         }, status=status.HTTP_200_OK)
     except Task.DoesNotExist:
@@ -431,13 +410,15 @@ def reset_account(request):
         return Response({'error': 'Complete all tasks before resetting'}, status=status.HTTP_400_BAD_REQUEST)
     if Withdrawal.objects.filter(user=user, status='pending').exists():
         return Response({'error': 'Complete all withdrawals before resetting'}, status=status.HTTP_400_BAD_REQUEST)
-    user.balance = Decimal('10.00')  # FIXED: Use Decimal for consistency
     user.current_set = 0
     user.tasks_completed = 0
     user.can_invite = False
     user.tasks_reset_required = False
-    Task.objects.filter(user=user).delete()
-    user.save()
+    with transaction.atomic():
+        Task.objects.filter(user=user).delete()
+        reset_task_stats(user.pk)
+        user.save(update_fields=['current_set', 'tasks_completed', 'can_invite', 'tasks_reset_required'])
+        user.balance = set_balance(user.pk, Decimal('10.00'), reference='reset_account').balance_after
     return Response({'message': 'Account reset successfully'}, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
@@ -457,14 +438,13 @@ def send_verification_code(request):
     email = request.data.get('email')
     try:
         user = User.objects.get(email=email)
-        code = ''.join(random.choices(string.digits, k=6))
-        verification_codes[email] = {'code': code, 'expires': timezone.now() + timedelta(minutes=10)}
-        send_mail(
+        code = verification_codes.issue(email)
+        # Queued and sent by the outbox dispatcher; the request does not wait for SMTP
+        enqueue_email(
             'Denew PIN Reset Code',
-            f'Your verification code is {code}. It expires in 10 minutes.',
-            'from@denew.com',
+            f'Your verification code is {code}. It expires in {settings.VERIFICATION_CODE_TTL // 60} minutes.',
             [email],
-            fail_silently=False,
+            from_email='from@denew.com',
         )
         return Response({'message': 'Verification code sent'}, status=status.HTTP_200_OK)
     except User.DoesNotExist:
@@ -477,13 +457,14 @@ def send_verification_code(request):
 def verify_code(request):
     email = request.data.get('email')
     code = request.data.get('code')
-    if email not in verification_codes:
+    if not email:
         return Response({'error': 'No verification code sent for this email'}, status=status.HTTP_400_BAD_REQUEST)
-    stored = verification_codes[email]
-    if timezone.now() > stored['expires']:
-        del verification_codes[email]
-        return Response({'error': 'Code expired'}, status=status.HTTP_400_BAD_REQUEST)
-    if stored['code'] != code:
+    result = verification_codes.verify(email, code)
+    if result == MISSING:
+        return Response({'error': 'No verification code sent for this email, or it has expired'}, status=status.HTTP_400_BAD_REQUEST)
+    if result == LOCKED:
+        return Response({'error': 'Too many attempts, request a new code'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    if result == INVALID:
         return Response({'error': 'Invalid code'}, status=status.HTTP_400_BAD_REQUEST)
     return Response({'message': 'Code verified'}, status=status.HTTP_200_OK)
 
@@ -492,15 +473,15 @@ def verify_code(request):
 def reset_pin(request):
     email = request.data.get('email')
     pin = request.data.get('pin')
-    if email not in verification_codes:
+    if not email or not verification_codes.is_verified(email):
         return Response({'error': 'Verification code not validated'}, status=status.HTTP_400_BAD_REQUEST)
     if not pin or not pin.isdigit() or len(pin) != 4:
         return Response({'error': 'PIN must be a 4-digit number'}, status=status.HTTP_400_BAD_REQUEST)
     try:
         user = User.objects.get(email=email)
         user.withdrawal_password = pin
-        user.save()
-        del verification_codes[email]
+        user.save(update_fields=['withdrawal_password'])
+        verification_codes.consume(email)
         return Response({'message': 'PIN reset successfully'}, status=status.HTTP_200_OK)
     except User.DoesNotExist:
         return Response({'error': 'Email not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -524,14 +505,13 @@ def make_deposit(request):
     # Pass context to serializer to set status='confirmed' on save
     serializer = DepositSerializer(data=request.data, context={'status': 'confirmed'})
     if serializer.is_valid():
-        deposit = serializer.save(user=request.user)  # Saves with status='confirmed', triggers signal for user.balance += amount
-        
-        # NEW: Handle referrer bonus manually (signal doesn't cover this)
-        referrer = User.objects.filter(invitations_sent__referee_email=request.user.email, invitations_sent__status='accepted').first()
-        if referrer:
-            referrer.balance += deposit.amount * Decimal('0.10')  # Use Decimal for precision
-            referrer.save()
-        
+        with transaction.atomic():
+            deposit = serializer.save(user=request.user)  # Saves with status='confirmed', signal posts the deposit to the ledger
+
+            # NEW: Handle referrer bonus manually (signal doesn't cover this)
+            if request.user.referred_by_id:
+                post_entry(request.user.referred_by_id, 'referral_bonus', deposit.amount * REFERRAL_BONUS_RATE, reference=f'deposit:{deposit.pk}')
+
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -548,9 +528,13 @@ def request_withdrawal(request):
     if serializer.is_valid():
         if user.balance < serializer.validated_data['amount']:
             return Response({'error': 'Insufficient balance'}, status=status.HTTP_400_BAD_REQUEST)
-        withdrawal = serializer.save(user=user)
-        user.balance -= withdrawal.amount
-        user.save()
+        try:
+            with transaction.atomic():
+                withdrawal = serializer.save(user=user)
+                # Re-checked in the UPDATE itself, so concurrent requests cannot overdraw
+                post_entry(user.pk, 'withdrawal', -withdrawal.amount, reference=f'withdrawal:{withdrawal.pk}', require_funds=True)
+        except InsufficientFunds:
+            return Response({'error': 'Insufficient balance'}, status=status.HTTP_400_BAD_REQUEST)
         return Response({
             'message': 'Withdrawal request submitted successfully',
             'withdrawal': serializer.data
@@ -560,36 +544,28 @@ def request_withdrawal(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_invitations(request):
-    invitations = Invitation.objects.filter(referrer=request.user).order_by('-created_at')
-    serializer = InvitationSerializer(invitations, many=True)
-    team_size = invitations.count()
-    active_members = 0
-    referral_earnings = 0
-    for invitation in invitations:
-        try:
-            referee = User.objects.get(email=invitation.referee_email)
-            if referee.last_login and (timezone.now() - referee.last_login).days <= 30:
-                active_members += 1
-            deposits = Deposit.objects.filter(user=referee, status='confirmed').aggregate(total=Sum('amount'))['total'] or Decimal('0')
-            referral_earnings += deposits * Decimal('0.10')  # FIXED: Use Decimal for consistency
-        except User.DoesNotExist:
-            continue
+    invitations = Invitation.objects.filter(referrer=request.user)
+    page, next_cursor = paginate_keyset(invitations, request)
+    serializer = InvitationSerializer(page, many=True)
+    stats = referral_stats(request.user.pk)  # one query however many invitees
     return Response({
         'invitations': serializer.data,
-        'team_size': team_size,
-        'active_members': active_members,
-        'referral_earnings': str(referral_earnings.quantize(Decimal('0.01')))  # Round to 2 decimals
+        'next_cursor': next_cursor,
+        'team_size': stats['team_size'],
+        'active_members': stats['active_members'],
+        'referral_earnings': str(stats['referral_earnings'])
     }, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_all_withdrawals(request):
     if request.user.is_staff:
-        withdrawals = Withdrawal.objects.all().order_by('-created_at')
+        withdrawals = Withdrawal.objects.all()
     else:
-        withdrawals = Withdrawal.objects.filter(user=request.user).order_by('-created_at')
+        withdrawals = Withdrawal.objects.filter(user=request.user)
+    withdrawals, next_cursor = paginate_keyset(withdrawals.select_related('user'), request)
     serializer = WithdrawalListSerializer(withdrawals, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return with_next_cursor(Response(serializer.data, status=status.HTTP_200_OK), next_cursor)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -615,21 +591,12 @@ def complete_withdrawal(request, withdrawal_id):
             }, status=status.HTTP_400_BAD_REQUEST)
         action = request.data.get('action', 'approve')
         admin_notes = request.data.get('admin_notes', '')
-        if action == 'approve':
-            withdrawal.status = 'completed'
-            withdrawal.processed_at = timezone.now()
-            withdrawal.user.balance -= withdrawal.amount  # Manual deduct (no signal for withdrawals)
-            withdrawal.user.save()
-            message = 'Withdrawal approved successfully'
-        elif action == 'reject':
-            withdrawal.status = 'rejected'
-            withdrawal.processed_at = timezone.now()
-            withdrawal.user.balance += withdrawal.amount
-            withdrawal.user.save()
-            message = 'Withdrawal rejected and amount refunded'
-        else:
+        if action not in SETTLEMENT_ACTIONS:
             return Response({'error': 'Invalid action'}, status=status.HTTP_400_BAD_REQUEST)
-        withdrawal.save()
+        if not settle_withdrawals([withdrawal.id], action):
+            return Response({'error': 'Withdrawal is already being processed'}, status=status.HTTP_409_CONFLICT)
+        message = 'Withdrawal approved successfully' if action == 'approve' else 'Withdrawal rejected and amount refunded'
+        withdrawal.refresh_from_db()
         serializer = WithdrawalListSerializer(withdrawal)
         return Response({
             'message': message,
@@ -647,24 +614,12 @@ def bulk_complete_withdrawals(request):
     action = request.data.get('action', 'approve')
     if not withdrawal_ids:
         return Response({'error': 'No withdrawal IDs provided'}, status=status.HTTP_400_BAD_REQUEST)
+    if action not in SETTLEMENT_ACTIONS:
+        return Response({'error': 'Invalid action'}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        withdrawals = Withdrawal.objects.filter(id__in=withdrawal_ids, status='pending')
-        if not withdrawals.exists():
+        updated_count = settle_withdrawals(withdrawal_ids, action)
+        if not updated_count:
             return Response({'error': 'No pending withdrawals found'}, status=status.HTTP_404_NOT_FOUND)
-        updated_count = 0
-        for withdrawal in withdrawals:
-            if action == 'approve':
-                withdrawal.status = 'completed'
-                withdrawal.processed_at = timezone.now()
-                withdrawal.user.balance -= withdrawal.amount
-                withdrawal.user.save()
-            elif action == 'reject':
-                withdrawal.status = 'rejected'
-                withdrawal.processed_at = timezone.now()
-                withdrawal.user.balance += withdrawal.amount
-                withdrawal.user.save()
-            withdrawal.save()
-            updated_count += 1
         return Response({
             'message': f'{updated_count} withdrawals {action}d successfully'
         }, status=status.HTTP_200_OK)
@@ -675,11 +630,14 @@ def bulk_complete_withdrawals(request):
 @permission_classes([IsAuthenticated])
 def get_enhanced_transaction_history(request):
     user = request.user
-    deposits = Deposit.objects.filter(user=user).order_by('-created_at')
-    withdrawals = Withdrawal.objects.filter(user=user).order_by('-created_at')
-    total_deposits = deposits.filter(status='confirmed').aggregate(total=Sum('amount'))['total'] or Decimal('0')
-    total_withdrawals = withdrawals.filter(status='completed').aggregate(total=Sum('amount'))['total'] or Decimal('0')
-    pending_withdrawals = withdrawals.filter(status='pending').aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    deposits, next_deposits_cursor = paginate_keyset(Deposit.objects.filter(user=user), request, 'deposits_cursor')
+    withdrawals, next_withdrawals_cursor = paginate_keyset(
+        Withdrawal.objects.filter(user=user).select_related('user'), request, 'withdrawals_cursor'
+    )
+    stats = get_stats(user.pk)
+    total_deposits = stats.deposits_confirmed
+    total_withdrawals = stats.withdrawals_completed
+    pending_withdrawals = stats.withdrawals_pending
     data = {
         'deposits': deposits,
         'withdrawals': withdrawals,
@@ -688,16 +646,23 @@ def get_enhanced_transaction_history(request):
         'pending_withdrawals': str(pending_withdrawals)
     }
     serializer = EnhancedTransactionHistorySerializer(data)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return Response({
+        **serializer.data,
+        'next_deposits_cursor': next_deposits_cursor,
+        'next_withdrawals_cursor': next_withdrawals_cursor,
+    }, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@conditional_get(content_etag('terms'))
 def get_terms(request):
-    try:
-        terms = TermsAndConditions.objects.latest('created_at')
-        return Response(TermsSerializer(terms).data, status=status.HTTP_200_OK)
-    except TermsAndConditions.DoesNotExist:
+    def build():
+        terms = TermsAndConditions.objects.order_by('-created_at').first()
+        return (TermsSerializer(terms).data, None) if terms else None
+    body = cached_json('terms', build)
+    if body is None:
         return Response({'error': 'Terms not found'}, status=status.HTTP_404_NOT_FOUND)
+    return HttpResponse(body, content_type='application/json')
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -725,10 +690,74 @@ def update_portfolio(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_transaction_history(request):
-    deposits = Deposit.objects.filter(user=request.user).order_by('-created_at')
-    withdrawals = Withdrawal.objects.filter(user=request.user).order_by('-created_at')
+    deposits, next_deposits_cursor = paginate_keyset(Deposit.objects.filter(user=request.user), request, 'deposits_cursor')
+    withdrawals, next_withdrawals_cursor = paginate_keyset(Withdrawal.objects.filter(user=request.user), request, 'withdrawals_cursor')
     serializer = TransactionHistorySerializer({'deposits': deposits, 'withdrawals': withdrawals}, many=False)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return Response({
+        **serializer.data,
+        'next_deposits_cursor': next_deposits_cursor,
+        'next_withdrawals_cursor': next_withdrawals_cursor,
+    }, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_transaction_stream(request):
+    include_tasks = request.query_params.get('include_tasks', '').lower() in ('1', 'true', 'yes')
+    transactions, next_cursor, totals = transaction_page(request.user.pk, request, include_tasks)
+    data = {'transactions': transactions, 'next_cursor': next_cursor}
+    if totals is not None:
+        data['totals'] = totals  # first page only
+    return Response(data, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_data(request, kind):
+    """Stream deposits, withdrawals or tasks as CSV or NDJSON (staff only). ?since=&until=&status=a,b&output=csv|ndjson"""
+    if not request.user.is_staff:
+        return Response({'error': 'Staff only'}, status=status.HTTP_403_FORBIDDEN)
+    output = request.query_params.get('output', 'csv')
+    statuses = [value for value in request.query_params.get('status', '').split(',') if value]
+    try:
+        columns, rows = export_rows(kind, request.query_params.get('since'), request.query_params.get('until'), statuses)
+        chunks = render(columns, rows, output)
+    except ExportError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(chunks, content_type=FORMATS[output])
+    response['Content-Disposition'] = f'attachment; filename="{kind}-{timezone.now():%Y%m%d-%H%M%S}.{output}"'
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_admission_stats(request):
+    """Admission control counters of the worker that serves this request (staff only)."""
+    if not request.user.is_staff:
+        return Response({'error': 'Staff only'}, status=status.HTTP_403_FORBIDDEN)
+    return Response(admission_counters(), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_ledger(request):
+    """
+    The user's balance history, newest first and cursor paginated. Each entry
+    carries the running balance after it; ?at=<ISO datetime> also returns the
+    balance at that moment.
+    """
+    entries, next_cursor = paginate_keyset(LedgerEntry.objects.filter(user=request.user), request)
+    data = {
+        'balance': str(current_balance(request.user.pk)),
+        'entries': LedgerEntrySerializer(entries, many=True).data,
+        'next_cursor': next_cursor,
+    }
+    at = request.query_params.get('at')
+    if at:
+        when = parse_datetime(at)
+        if when is None:
+            return Response({'error': 'Invalid datetime for at'}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(when):
+            when = timezone.make_aware(when)
+        balance = balance_at(request.user.pk, when)
+        data['balance_at'] = str(balance) if balance is not None else None
+    return Response(data, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -741,17 +770,24 @@ def create_support_ticket(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_get(balance_etag)
 def get_balance(request):
-    return Response({'balance': str(request.user.balance)}, status=status.HTTP_200_OK)
+    return Response({'balance': str(user_columns(request)['balance'])}, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_get(vip_level_etag)
 def get_vip_level(request):
-    return Response({'vip_level': request.user.vip_level}, status=status.HTTP_200_OK)
+    return Response({'vip_level': user_columns(request)['vip_level']}, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_get(content_etag('campaigns'))
 def get_campaigns(request):
-    campaigns = Campaign.objects.filter(is_active=True, end_date__gte=timezone.now()).order_by('-created_at')
-    serializer = CampaignSerializer(campaigns, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+    def build():
+        now = timezone.now()
+        campaigns = list(Campaign.objects.filter(is_active=True, end_date__gte=now).order_by('-created_at'))
+        # Expire the cached list when the first of these campaigns ends
+        timeout = int((min(c.end_date for c in campaigns) - now).total_seconds()) + 1 if campaigns else None
+        return CampaignSerializer(campaigns, many=True).data, timeout
+    return HttpResponse(cached_json('campaigns', build), content_type='application/json')
\ No newline at end of file
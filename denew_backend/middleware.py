@@ -1,14 +1,136 @@
-from rest_framework.response import Response
-from rest_framework import status
-from django.utils import timezone
+import json
+import re
+import threading
+from collections import Counter
 from datetime import time
 
-class OperatingHoursMiddleware:
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+
+# Routes let through first: staff work that drains load rather than adding to it
+PRIORITY_PATHS = re.compile(r'^/(admin/|api/withdrawals/(\d+/complete|bulk-complete)/)')
+
+
+def _parse_hours(value):
+    """'09:00-21:59' -> (time(9, 0), time(21, 59))"""
+    start, end = value.split('-')
+    return time.fromisoformat(start.strip()), time.fromisoformat(end.strip())
+
+
+class AdmissionState:
+    """Per-process admission bookkeeping shared by the middleware and admission_counters()."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counters = Counter()
+
+
+state = AdmissionState()
+
+
+def _rendered(status, payload, **headers):
+    body = json.dumps(payload).encode()
+    return status, body, headers
+
+
+class AdmissionControlMiddleware:
+    """
+    Cheap admission decisions made before any view, session or database work:
+
+    1. Outside OPERATING_HOURS (when OPERATING_HOURS_ENFORCED) requests get a 403.
+    2. Each worker process admits at most ADMISSION_MAX_IN_FLIGHT requests at
+       once (threaded workers); priority routes (admin, withdrawal settlement)
+       may use ADMISSION_PRIORITY_RESERVE extra slots.
+    3. Anything over the cap is shed at once with a 503 and Retry-After.
+
+    A streaming response (the staff exports) keeps its slot until the server
+    closes it, since its body, and the database cursor behind it, is only
+    produced after the view returns.
+
+    Rejection bodies are rendered once at startup. Decisions are counted per
+    worker (see admission_counters()).
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.hours_enforced = getattr(settings, 'OPERATING_HOURS_ENFORCED', False)
+        self.opens, self.closes = _parse_hours(getattr(settings, 'OPERATING_HOURS', '09:00-21:59'))
+        self.max_in_flight = getattr(settings, 'ADMISSION_MAX_IN_FLIGHT', 64)
+        self.priority_reserve = getattr(settings, 'ADMISSION_PRIORITY_RESERVE', 8)
+        retry_after = getattr(settings, 'ADMISSION_RETRY_AFTER', 5)
+        self.closed_response = _rendered(
+            403, {'error': f'Platform is closed outside {self.opens:%H:%M}-{self.closes:%H:%M}'},
+        )
+        self.overloaded_response = _rendered(
+            503, {'error': 'Server is busy, please retry shortly'}, **{'Retry-After': str(retry_after)},
+        )
+
+    def reject(self, rendered):
+        status, body, headers = rendered
+        response = HttpResponse(body, status=status, content_type='application/json')
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    def is_open(self):
+        now = timezone.localtime().time()
+        return self.opens <= now <= self.closes
 
     def __call__(self, request):
-        current_time = timezone.now().time()
-        if not (time(9, 0) <= current_time <= time(21, 59)):
-            return Response({'error': 'Platform is closed outside 9:00-21:59'}, status=status.HTTP_403_FORBIDDEN)
-        return self.get_response(request)
\ No newline at end of file
+        priority = bool(PRIORITY_PATHS.match(request.path_info))
+        kind = 'priority' if priority else 'normal'
+        if self.hours_enforced and not priority and not self.is_open():
+            with state.lock:
+                state.counters[f'{kind}_closed'] += 1
+            return self.reject(self.closed_response)
+        limit = self.max_in_flight + (self.priority_reserve if priority else 0)
+        with state.lock:
+            admitted = state.in_flight < limit
+            if admitted:
+                state.in_flight += 1
+            state.counters[f'{kind}_admitted' if admitted else f'{kind}_shed'] += 1
+        if not admitted:
+            return self.reject(self.overloaded_response)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            _release()
+            raise
+        if response.streaming:
+            _release_on_close(response)
+        else:
+            _release()
+        return response
+
+
+def _release():
+    with state.lock:
+        state.in_flight -= 1
+
+
+def _release_on_close(response):
+    """
+    Keep a streaming response's slot until the server closes it. close() is
+    wrapped rather than the content iterator, whose cleanup would not run if
+    the response is closed before its first chunk.
+    """
+    close = response.close
+    released = False
+
+    def closing():
+        nonlocal released
+        try:
+            close()
+        finally:
+            if not released:
+                released = True
+                _release()
+    response.close = closing
+
+
+def admission_counters():
+    """This worker's admission decisions, e.g. {'normal_admitted': 120, 'normal_shed': 3, 'in_flight': 2}."""
+    with state.lock:
+        return {**state.counters, 'in_flight': state.in_flight}
\ No newline at end of file
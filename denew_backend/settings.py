@@ -39,6 +39,7 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'denew_backend.middleware.AdmissionControlMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -93,7 +94,7 @@ AUTH_USER_MODEL = 'accounts.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'denew_backend.accounts.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -158,6 +159,71 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Cache. Local memory is per worker; with several gunicorn workers point
+# CACHE_BACKEND at a shared backend (e.g. django.core.cache.backends.filebased.FileBasedCache
+# with CACHE_LOCATION=/var/tmp/denew_cache, or the db backend after createcachetable).
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='denew-default'),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int)},
+    },
+}
+
+# Verification codes (stored in accounts_verificationcode): lifetime in seconds
+# and wrong guesses allowed per code
+VERIFICATION_CODE_TTL = config('VERIFICATION_CODE_TTL', default=600, cast=int)
+VERIFICATION_CODE_MAX_ATTEMPTS = config('VERIFICATION_CODE_MAX_ATTEMPTS', default=5, cast=int)
+
+# Authenticated user rows cached per worker for read requests: seconds an entry
+# lives and how many users each worker keeps (see accounts/authentication.py)
+AUTH_USER_CACHE_TTL = config('AUTH_USER_CACHE_TTL', default=5, cast=int)
+AUTH_USER_CACHE_SIZE = config('AUTH_USER_CACHE_SIZE', default=2048, cast=int)
+
+# Rows fetched per round trip by the streaming staff exports (accounts/exports.py)
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+# Unfiltered admin changelists of tables past this many rows show the planner's
+# row estimate instead of running COUNT(*) (PostgreSQL only)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = config('ADMIN_ESTIMATED_COUNT_THRESHOLD', default=100000, cast=int)
+
+# Profile picture uploads (accounts/pictures.py): largest accepted upload in
+# bytes, and threads resizing them per process (0 processes in the request)
+PROFILE_PICTURE_MAX_BYTES = config('PROFILE_PICTURE_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+PROFILE_PICTURE_WORKERS = config('PROFILE_PICTURE_WORKERS', default=2, cast=int)
+
+# Keyset pagination for list endpoints (?page_size=, capped at API_MAX_PAGE_SIZE)
+API_PAGE_SIZE = config('API_PAGE_SIZE', default=50, cast=int)
+API_MAX_PAGE_SIZE = config('API_MAX_PAGE_SIZE', default=200, cast=int)
+
+# Seconds versioned shared content (terms, campaigns, product payloads) stays cached.
+# With a shared cache, edits bump the version for every worker, so this only bounds
+# how long unused entries linger. The per-worker LocMemCache default only sees the
+# bump in the worker that saved the edit; the others serve the old content until
+# their entry expires, so the default is kept short there.
+LOCAL_MEMORY_CACHE = CACHES['default']['BACKEND'].endswith('.LocMemCache')
+CONTENT_CACHE_TIMEOUT = config('CONTENT_CACHE_TIMEOUT', default=60 if LOCAL_MEMORY_CACHE else 86400, cast=int)
+
+# Seconds a cached per-user dashboard summary may be served (writes invalidate it sooner)
+DASHBOARD_CACHE_TIMEOUT = config('DASHBOARD_CACHE_TIMEOUT', default=300, cast=int)
+
+# Seconds a worker keeps its in-memory product catalog before re-reading it
+# (local product changes invalidate it immediately, see accounts/catalog.py)
+PRODUCT_CATALOG_TTL = config('PRODUCT_CATALOG_TTL', default=300, cast=int)
+
+# Write all 40 tasks of a set in one bulk insert when the set is started
+TASK_SET_PREGENERATE = config('TASK_SET_PREGENERATE', default=True, cast=bool)
+
+# Admission control (denew_backend/middleware.py). OPERATING_HOURS is local time
+# (TIME_ZONE); admin and withdrawal settlement routes are exempt from it and get
+# ADMISSION_PRIORITY_RESERVE extra in-flight slots per worker.
+OPERATING_HOURS_ENFORCED = config('OPERATING_HOURS_ENFORCED', default=False, cast=bool)
+OPERATING_HOURS = config('OPERATING_HOURS', default='09:00-21:59')
+ADMISSION_MAX_IN_FLIGHT = config('ADMISSION_MAX_IN_FLIGHT', default=64, cast=int)
+ADMISSION_PRIORITY_RESERVE = config('ADMISSION_PRIORITY_RESERVE', default=8, cast=int)
+ADMISSION_RETRY_AFTER = config('ADMISSION_RETRY_AFTER', default=5, cast=int)
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # CORS settings for frontend integration - FIXED to include both www and non-www versions
@@ -167,6 +233,16 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='denewhub@gmail.com')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='plwr zafs ocxo eydg')
 DEFAULT_FROM_EMAIL = 'from@denew.com'
 
+# Email outbox (accounts/outbox.py). With EMAIL_DISPATCH_IN_PROCESS each web worker
+# runs a dispatcher thread; turn it off when `manage.py drain_email_outbox --loop`
+# runs as a separate worker.
+EMAIL_DISPATCH_IN_PROCESS = config('EMAIL_DISPATCH_IN_PROCESS', default=True, cast=bool)
+EMAIL_DISPATCH_WORKERS = config('EMAIL_DISPATCH_WORKERS', default=4, cast=int)
+EMAIL_DISPATCH_POLL_SECONDS = config('EMAIL_DISPATCH_POLL_SECONDS', default=60, cast=int)
+EMAIL_BATCH_SIZE = config('EMAIL_BATCH_SIZE', default=50, cast=int)
+EMAIL_MAX_ATTEMPTS = config('EMAIL_MAX_ATTEMPTS', default=5, cast=int)
+EMAIL_RETRY_BASE_SECONDS = config('EMAIL_RETRY_BASE_SECONDS', default=30, cast=int)
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = config(
     'CORS_ALLOWED_ORIGINS',
@@ -174,6 +250,7 @@ CORS_ALLOWED_ORIGINS = config(
     cast=lambda v: [s.strip() for s in v.split(',')]
 )
 CORS_ALLOW_CREDENTIALS = True
+CORS_EXPOSE_HEADERS = ['X-Next-Cursor', 'Retry-After']  # pagination cursor; load-shedding retry hint
 CORS_ALLOWED_METHODS = ['DELETE', 'GET', 'OPTIONS', 'PATCH', 'POST', 'PUT']
 CORS_ALLOWED_HEADERS = [
     'accept',
@@ -7,12 +7,12 @@ django.setup()
 
 # Import the User model
 from denew_backend.accounts.models import User
+from denew_backend.accounts.ledger import set_balance
 
 # Update the balance for testuser2
 try:
     user = User.objects.get(username='testuser2')
-    user.balance = 150.00
-    user.save()
+    user.balance = set_balance(user.pk, 150, reference='update_balance.py').balance_after
     print(f"Updated balance for {user.username} to {user.balance}")
 except User.DoesNotExist:
     print("User 'testuser2' not found")